@@ -0,0 +1,65 @@
+'''
+Counts allocations and source resolutions when 100k events go through the
+registry to a listener that reads event.source several times, for each
+source resolution mode, using the simulated backend.
+
+Usage: python benchmarks/events.py [events] [source reads per event]
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyia
+from pyia import constants
+from pyia.event import Event, SOURCE_LAZY, SOURCE_EAGER, SOURCE_NEVER
+
+class CountingEvent(Event):
+    __slots__ = ()
+    created = 0
+    def __init__(self, *args):
+        CountingEvent.created += 1
+        Event.__init__(self, *args)
+
+def run(backend, app, count, reads, mode):
+    registry = pyia.Registry
+    registry.source_resolution = mode
+    def listener(event):
+        for i in range(reads):
+            event.source
+    registry.registerEventListener(listener, constants.EVENT_OBJECT_FOCUS)
+    events = list(backend.eventStorm(
+        count, [constants.EVENT_OBJECT_FOCUS], [app], seed=0))
+    backend.resetCalls()
+    CountingEvent.created = 0
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    backend.fireEvents(events)
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    registry.deregisterEventListener(listener, constants.EVENT_OBJECT_FOCUS)
+    return {'mode': mode, 'seconds': elapsed, 'events': CountingEvent.created,
+            'resolutions': backend.calls['AccessibleObjectFromEvent'],
+            'peak_bytes': peak}
+
+def main():
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    reads = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+    # pyia's __init__ hides the registry module behind its singleton.
+    sys.modules['pyia.registry'].Event = CountingEvent
+    backend = pyia.setBackend('simulated')
+    app = backend.createWindow(name='App')
+    print('%d events, %d source reads each, Event is %d bytes' %
+          (count, reads, sys.getsizeof(Event(0, 0, 0, 0, 0, 0))))
+    for mode in (SOURCE_LAZY, SOURCE_EAGER, SOURCE_NEVER):
+        result = run(backend, app, count, reads, mode)
+        print('%(mode)-6s %(seconds)6.2fs  %(events)7d Events  '
+              '%(resolutions)7d resolutions  peak %(peak_bytes)8d bytes' %
+              result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Measures a search of the whole desktop while one application answers every
+call slowly, with and without a call guard (deadlines and circuit breakers),
+using the simulated backend's per-process latency.
+
+Usage: python benchmarks/hung_app.py [apps] [latency of the slow app in ms]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyia
+
+def search(backend, label):
+    backend.resetCalls()
+    t0 = time.perf_counter()
+    found = pyia.findAllDescendants(backend.desktop_client, lambda acc: True)
+    elapsed = time.perf_counter() - t0
+    print('%-36s %8.3fs %6d found %8d calls' %
+          (label, elapsed, len(found), sum(backend.calls.values())))
+
+def main():
+    apps = len(sys.argv) > 1 and int(sys.argv[1]) or 10
+    latency = len(sys.argv) > 2 and float(sys.argv[2]) or 20.0
+    backend = pyia.setBackend('simulated')
+    for pid in range(1, apps + 1):
+        app = backend.createWindow(name='App %d' % pid, pid=pid)
+        backend.buildTree(app, 4, 3)
+    backend.process_latency[apps] = latency / 1000
+    print('%d applications, process %d takes %gms per call' %
+          (apps, apps, latency))
+    search(backend, 'unguarded')
+    guard = pyia.enableCallGuard(call_timeout=latency / 4000,
+                                 failure_threshold=2)
+    search(backend, 'call timeout %gms' % (latency / 4))
+    search(backend, 'again')
+    print('breaker of process %d: %s' % (apps, guard.breaker(apps).state))
+    pyia.disableCallGuard()
+    guard = pyia.enableCallGuard(slow_call=latency / 4000,
+                                 failure_threshold=2)
+    search(backend, 'slow call %gms, no timeouts' % (latency / 4))
+    with guard.deadline(latency / 1000) as deadline:
+        search(backend, 'deadline %gms' % latency)
+    print('deadline expired: %s' % deadline.expired)
+    pyia.disableCallGuard()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+Measures how long "import pyia" takes in a fresh interpreter, and how long
+the first use of the accessible class takes after that, against the
+simulated backend so it runs anywhere.
+
+Usage: python benchmarks/import_time.py [runs]
+'''
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import sys, time
+t0 = time.perf_counter()
+import pyia
+t1 = time.perf_counter()
+assert 'comtypes' not in sys.modules
+pyia.IAccessible
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+'''
+
+def measure(runs):
+    env = dict(os.environ, PYIA_BACKEND='simulated', PYTHONPATH=ROOT)
+    imports, first_uses = [], []
+    for i in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', PROBE], env=env, cwd=ROOT)
+        import_time, first_use = map(float, out.split())
+        imports.append(import_time)
+        first_uses.append(first_use)
+    return sorted(imports), sorted(first_uses)
+
+def main():
+    runs = len(sys.argv) > 1 and int(sys.argv[1]) or 20
+    imports, first_uses = measure(runs)
+    for label, samples in (('import pyia', imports),
+                           ('first use', first_uses)):
+        print('%-12s median %.2f ms  min %.2f ms' %
+              (label, samples[len(samples) // 2] * 1000, samples[0] * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Measures the per-call cost of localized role and state text, asking the
+system every time (Backend.getRoleText/getStateText, what pyia did before)
+against the process-wide tables (localizedRoleText/localizedStateText).
+
+Runs on the simulated backend unless PYIA_BACKEND says otherwise; pass a
+simulated per-call latency in microseconds to stand in for GetRoleTextW.
+
+Usage: python benchmarks/localized_text.py [calls] [latency in us]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('PYIA_BACKEND', 'simulated')
+
+import pyia
+from pyia.constants import UNLOCALIZED_ROLE_NAMES, UNLOCALIZED_STATE_NAMES
+
+def measure(label, func, values, count):
+    backend = pyia.getBackend()
+    if hasattr(backend, 'resetCalls'):
+        backend.resetCalls()
+    t0 = time.perf_counter()
+    for i in range(count):
+        func(values[i % len(values)])
+    elapsed = time.perf_counter() - t0
+    calls = getattr(backend, 'calls', None)
+    print('%-28s %8.3f us/call  %s' %
+          (label, elapsed / count * 1e6,
+           calls is not None and '%d system calls' % sum(calls.values())
+           or ''))
+
+def main():
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 100000
+    latency = len(sys.argv) > 2 and float(sys.argv[2]) or 0.0
+    backend = pyia.getBackend()
+    if latency and hasattr(backend, 'method_latency'):
+        backend.method_latency['GetRoleTextW'] = latency / 1e6
+        backend.method_latency['GetStateTextW'] = latency / 1e6
+    roles = sorted(UNLOCALIZED_ROLE_NAMES)
+    states = sorted(UNLOCALIZED_STATE_NAMES)
+    print('%d lookups on the %s backend' % (count, backend.name))
+    t0 = time.perf_counter()
+    backend.refreshLocalizedText()
+    print('%-28s %8.3f ms' % ('loading the tables',
+                              (time.perf_counter() - t0) * 1000))
+    measure('getRoleText (uncached)', backend.getRoleText, roles, count)
+    measure('localizedRoleText', backend.localizedRoleText, roles, count)
+    measure('getStateText (uncached)', backend.getStateText, states, count)
+    measure('localizedStateText', backend.localizedStateText, states, count)
+
+if __name__ == '__main__':
+    main()
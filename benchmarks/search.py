@@ -0,0 +1,94 @@
+'''
+Counts cross-process calls (simulated round trips) per tree search query,
+comparing the old recursive depth-first findDescendant with the lazy
+iterDescendants engine and its max_depth, limit and prune options.
+
+Usage: python benchmarks/search.py [width] [depth]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyia
+
+def legacyFindDescendant(acc, pred):
+    # findDescendant's depth-first mode before the traversal engine: the
+    # whole subtree of acc is searched again for every child of acc.
+    for child in acc:
+        try:
+            ret = _legacyDepth(acc, pred)
+        except Exception:
+            ret = None
+        if ret is not None: return ret
+
+def _legacyDepth(acc, pred):
+    try:
+        if pred(acc): return acc
+    except Exception:
+        pass
+    for child in acc:
+        try:
+            ret = _legacyDepth(child, pred)
+        except Exception:
+            ret = None
+        if ret is not None: return ret
+
+def measure(backend, label, query):
+    backend.resetCalls()
+    t0 = time.perf_counter()
+    result = query()
+    elapsed = time.perf_counter() - t0
+    if isinstance(result, list):
+        found = len(result)
+    else:
+        found = result is not None and 1 or 0
+    print('%-40s %8d calls %6d found %8.1fms' %
+          (label, sum(backend.calls.values()), found, elapsed * 1000))
+
+def main():
+    width = len(sys.argv) > 1 and int(sys.argv[1]) or 8
+    depth = len(sys.argv) > 2 and int(sys.argv[2]) or 4
+    backend = pyia.setBackend('simulated')
+    app = backend.createWindow(name='App')
+    nodes = backend.buildTree(app, width, depth)
+    print('%d wide, %d deep, %d nodes' % (width, depth, nodes))
+    last = 'item ' + '.'.join([str(width - 1)] * depth)
+    is_last = lambda acc: acc.accName() == last
+    is_first_leaf = lambda acc: acc.accName() == 'item ' + '.'.join(
+        ['0'] * depth)
+    missing = lambda acc: acc.accName() == 'missing'
+    everything = lambda acc: True
+    # Prune every subtree but the last at the top level.
+    prune = lambda acc: acc.accName().count('.') == 0 and \
+        acc.accName() != 'item %d' % (width - 1)
+
+    measure(backend, 'legacy depth-first, first leaf',
+            lambda: legacyFindDescendant(app, is_first_leaf))
+    measure(backend, 'findDescendant, first leaf',
+            lambda: pyia.findDescendant(app, is_first_leaf))
+    measure(backend, 'legacy depth-first, last leaf',
+            lambda: legacyFindDescendant(app, is_last))
+    measure(backend, 'findDescendant, last leaf',
+            lambda: pyia.findDescendant(app, is_last))
+    measure(backend, 'legacy depth-first, no match',
+            lambda: legacyFindDescendant(app, missing))
+    measure(backend, 'findDescendant, no match',
+            lambda: pyia.findDescendant(app, missing))
+    measure(backend, 'findDescendant breadth first, last leaf',
+            lambda: pyia.findDescendant(app, is_last, True))
+    measure(backend, 'findDescendant pruned, last leaf',
+            lambda: pyia.findDescendant(app, is_last, prune=prune))
+    measure(backend, 'findAllDescendants',
+            lambda: pyia.findAllDescendants(app, everything))
+    measure(backend, 'findAllDescendants max_depth=2',
+            lambda: pyia.findAllDescendants(app, everything, max_depth=2))
+    measure(backend, 'findAllDescendants limit=10',
+            lambda: pyia.findAllDescendants(app, everything, limit=10))
+    measure(backend, 'findAllDescendants limit=10 breadth first',
+            lambda: pyia.findAllDescendants(app, everything, True, limit=10))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+Benchmark suite for pyia's hot paths, on the simulated backend so it runs
+anywhere: child iteration and indexing, the tree searches, accStateSet,
+Event construction and Registry._handleEvent dispatch, over wide, deep and
+balanced trees and a range of listener counts.
+
+Every case is timed over several runs, reporting the fastest and the median,
+and its round trips (simulated cross-process calls) are counted. Round trip
+counts do not depend on the machine, so --compare fails on any increase.
+Times do, so they are only reported, unless --check-times is given. Even
+then they are first scaled by how long a fixed calibration loop took on
+each machine, and compared with a tolerance.
+
+Usage: python benchmarks/suite.py [options]
+
+  --json FILE          write the results as JSON (- for stdout)
+  --compare FILE       compare against a baseline written by --json, exiting
+                       with status 1 on regressions
+  --check-times        with --compare, count calibrated slowdowns beyond the
+                       threshold as regressions too
+  --save-baseline      write the results to benchmarks/baseline.json
+  --threshold RATIO    calibrated slowdown tolerated before a time counts as
+                       a regression, 0.25 by default
+  --repeat N           timed runs per case, 5 by default
+  --filter TEXT        only run cases whose name contains TEXT
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pyia
+from pyia import constants
+from pyia.event import Event
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# name -> (width, depth): children per node and levels below the window.
+SHAPES = {
+    'wide': (2000, 1),
+    'deep': (1, 200),
+    'balanced': (6, 5)}
+
+LISTENER_COUNTS = (1, 10, 100)
+
+EVENT_COUNT = 10000
+
+CALIBRATION_LOOPS = 200000
+
+def calibrate(repeat):
+    '''
+    @return: Fastest time taken by a fixed loop of plain Python, the unit
+    times are scaled by to compare them across machines
+    @rtype: float
+    '''
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        values = {}
+        for j in range(CALIBRATION_LOOPS):
+            values[j & 255] = values.get(j & 255, 0) + j
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def buildShape(backend, shape):
+    width, depth = SHAPES[shape]
+    app = backend.createWindow(name='App %s' % shape)
+    backend.buildTree(app, width, depth)
+    nodes = [app]
+    for node in nodes:
+        nodes.extend(node._children)
+    last = nodes[-1]
+    return app, nodes, last
+
+def treeCases(backend, shape):
+    '''
+    @return: (name, function, operations per call) for the tree cases on a
+    tree of the given shape
+    @rtype: list
+    '''
+    app, nodes, last = buildShape(backend, shape)
+    parents = [node for node in nodes if node._children]
+    last_name = last._props[constants.CHILDID_SELF]['name']
+    app_name = app._props[constants.CHILDID_SELF]['name']
+    is_last = lambda acc: acc.accName() == last_name
+    is_item = lambda acc: acc.accRole() == constants.ROLE_SYSTEM_LISTITEM
+    is_app = lambda acc: acc.accName() == app_name
+
+    def iterate():
+        for node in parents:
+            for child in node:
+                pass
+
+    def index():
+        for node in parents:
+            node[len(node._children) // 2]
+
+    def stateSet():
+        for node in nodes:
+            'focused' in node.accStateSet()
+
+    return [
+        ('iter/%s' % shape, iterate, len(parents)),
+        ('getitem/%s' % shape, index, len(parents)),
+        ('findDescendant-dfs/%s' % shape,
+         lambda: pyia.findDescendant(app, is_last), 1),
+        ('findDescendant-bfs/%s' % shape,
+         lambda: pyia.findDescendant(app, is_last, True), 1),
+        ('findAllDescendants/%s' % shape,
+         lambda: pyia.findAllDescendants(app, is_item), 1),
+        ('findAncestor/%s' % shape,
+         lambda: pyia.findAncestor(last, is_app), 1),
+        ('accStateSet/%s' % shape, stateSet, len(nodes))]
+
+def eventCases(backend):
+    app = backend.createWindow(name='Events')
+    backend.buildTree(app, 10, 1)
+    objects = [app] + list(app._children)
+    events = list(backend.eventStorm(
+        EVENT_COUNT, [constants.EVENT_OBJECT_FOCUS], objects, seed=0))
+    tid = backend.getWindowThreadProcessID(app.hwnd)[1]
+
+    def construct():
+        for event_type, hwnd, object_id, child_id in events:
+            Event(event_type, hwnd, object_id, child_id, tid, 0)
+
+    rv = [('Event', construct, EVENT_COUNT)]
+    for count in LISTENER_COUNTS:
+        rv.append(('_handleEvent/%d-listeners' % count,
+                   _dispatchCase(events, tid, count), EVENT_COUNT))
+    return rv
+
+def _dispatchCase(events, tid, count):
+    registry = pyia.Registry
+
+    def run():
+        registry.clearListeners()
+        listeners = [lambda event: None for i in range(count)]
+        for listener in listeners:
+            registry.registerEventListener(listener,
+                                           constants.EVENT_OBJECT_FOCUS)
+        handle = next(iter(registry.hooks.values()))
+        handleEvent = registry._handleEvent
+        try:
+            t0 = time.perf_counter()
+            for event_type, hwnd, object_id, child_id in events:
+                handleEvent(handle, event_type, hwnd, object_id, child_id,
+                            tid, 0)
+            return time.perf_counter() - t0
+        finally:
+            registry.clearListeners()
+    # Registering is not part of what is measured.
+    run.timed = True
+    return run
+
+def measure(backend, func, repeat):
+    backend.resetCalls()
+    func()
+    round_trips = sum(backend.calls.values())
+    times = []
+    for i in range(repeat):
+        if getattr(func, 'timed', False):
+            times.append(func())
+        else:
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+    return round_trips, times
+
+def run(repeat, name_filter=None):
+    backend = pyia.setBackend('simulated')
+    cases = []
+    for shape in SHAPES:
+        cases.extend(treeCases(backend, shape))
+    cases.extend(eventCases(backend))
+    results = {}
+    for name, func, ops in cases:
+        if name_filter and name_filter not in name:
+            continue
+        round_trips, times = measure(backend, func, repeat)
+        results[name] = {'ops': ops, 'round_trips': round_trips,
+                         'min': min(times),
+                         'median': statistics.median(times)}
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'pyia': pyia.__version__,
+            'repeat': repeat,
+            'calibration': calibrate(repeat),
+            'results': results}
+
+def scale(report, baseline):
+    '''
+    @return: Factor turning baseline times into times on this machine,
+    going by the calibration loop, 1 when either lacks it
+    @rtype: float
+    '''
+    old = baseline.get('calibration')
+    new = report.get('calibration')
+    if not old or not new:
+        return 1.0
+    return new / old
+
+def compare(report, baseline, threshold, check_times=False):
+    '''
+    @param check_times: Count calibrated slowdowns beyond threshold too
+    @type check_times: boolean
+    @return: Descriptions of the regressions
+    @rtype: list
+    '''
+    regressions = []
+    old_results = baseline['results']
+    factor = scale(report, baseline)
+    for name, result in report['results'].items():
+        old = old_results.get(name)
+        if old is None:
+            continue
+        if result['round_trips'] > old['round_trips']:
+            regressions.append('%s: %d round trips, was %d' % (
+                name, result['round_trips'], old['round_trips']))
+        expected = old['min'] * factor
+        if check_times and expected and \
+                result['min'] > expected * (1 + threshold):
+            regressions.append('%s: %.1f%% slower' % (
+                name, (result['min'] / expected - 1) * 100))
+    return regressions
+
+def printReport(report, baseline=None):
+    old_results = baseline and baseline['results'] or {}
+    factor = baseline and scale(report, baseline) or 1.0
+    print('pyia %(pyia)s, %(implementation)s %(python)s on %(machine)s, '
+          'best of %(repeat)d' % report)
+    if baseline:
+        print('baseline times scaled by %.2f for this machine' % factor)
+    print('%-32s %12s %12s %10s %8s' % (
+        'case', 'min us/op', 'median', 'trips/run', 'vs base'))
+    for name, result in report['results'].items():
+        ops = result['ops']
+        old = old_results.get(name)
+        change = ''
+        if old and old['min']:
+            change = '%+.1f%%' % (
+                (result['min'] / (old['min'] * factor) - 1) * 100)
+        print('%-32s %12.3f %12.3f %10d %8s' % (
+            name, result['min'] / ops * 1e6, result['median'] / ops * 1e6,
+            result['round_trips'], change))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks pyia on the simulated backend.')
+    parser.add_argument('--json', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--check-times', action='store_true')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter')
+    args = parser.parse_args()
+
+    report = run(args.repeat, args.filter)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        printReport(report, baseline)
+    if args.json and args.json != '-':
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(BASELINE, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(report, baseline, args.threshold,
+                              args.check_times)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -25,16 +25,31 @@ Boston, MA 02111-1307, USA.
 '''
 
 __version__ = "0.0.2"
-from comtypes.client import GetModule
-GetModule('oleacc.dll')
-from comtypes.gen.Accessibility import IAccessible
-del GetModule
+from .backend import getBackend, setBackend
 from . import accessible
+from .accessible import memoizedChildren, ManagedChildAccessible, \
+    ManagedChildArray
 from .utils import *
 from .constants import *
+from .snapshot import snapshotSubtree
+from .treediff import diffSnapshots
+from .snapfile import writeSnapshot, openSnapshot
+from .spatial import SpatialIndex
+from .instrument import enableInstrumentation, disableInstrumentation, \
+    getInstrumentation
+from .guard import enableCallGuard, disableCallGuard, getCallGuard
+from .selector import compileSelector
+from .stateset import StateSet
 from . import registry
 
 # Create singleton registry.
 Registry = registry.Registry()
 registry.Registry = Registry
 del registry
+
+def __getattr__(name):
+    # Nothing touches COM until the accessible class is first asked for, so
+    # constants and utilities import cheaply.
+    if name == 'IAccessible':
+        return getBackend().IAccessible
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
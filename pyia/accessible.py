@@ -25,69 +25,104 @@ Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 Boston, MA 02111-1307, USA.
 '''
 
+import threading
 import types
-from comtypes.automation import VARIANT, VT_I4, VT_DISPATCH
-from ctypes import c_long, oledll, byref, create_unicode_buffer
-from comtypes.gen.Accessibility import IAccessible
-from comtypes import named_property, COMError, hresult
+from array import array
+from contextlib import contextmanager
+from .backend import getBackend
 from .constants import CHILDID_SELF, \
-    UNLOCALIZED_ROLE_NAMES, \
-    UNLOCALIZED_STATE_NAMES
+    UNLOCALIZED_ROLE_NAMES
+from .stateset import StateSet
 
-def _makeExceptionHandler(func):
+# The L{pyia.instrument.CallStats} recording calls, None when
+# instrumentation is off.
+_call_stats = None
+# The L{pyia.guard.CallGuard} applying deadlines and circuit breakers to
+# calls, None when there is none.
+_call_guard = None
+
+def _hookedCall(name, func, error, obj, args, kwargs):
+    guard = _call_guard
+    if guard is not None:
+        guarded = func
+        func = lambda obj, *args, **kwargs: \
+            guard.call(guarded, error, obj, args, kwargs)
+    stats = _call_stats
+    if stats is not None:
+        return stats.call(name, func, error, obj, args, kwargs)
+    return func(obj, *args, **kwargs)
+
+def _makeExceptionHandler(func, error, name=None):
     '''
     Builds a function calling the one it wraps in try/except statements catching
-    COMError exceptions.
+    COMError exceptions. While instrumentation is on, calls are recorded under
+    name; while a call guard is installed, they go through it.
   
+    @param error: COMError class of the active backend
+    @type error: class
+    @param name: Name to record calls under, the name of func by default
+    @type name: string
     @return: Function calling the method being wrapped
     @rtype: function
     '''
+    if name is None:
+        name = func.__name__
     def _inner(self, *args, **kwargs):
+        if _call_stats is not None or _call_guard is not None:
+            return _hookedCall(name, func, error, self, args, kwargs)
         try:
             return func(self, *args, **kwargs)
-        except COMError as e:
+        except error as e:
             # TODO: Translate COMErrors to more pythonic equivalents.
             raise
     return _inner
 
-def _mixExceptions(cls):
+def _mixExceptions(cls, backend):
     '''
     Wraps all methods and properties in a class with handlers for CORBA 
     exceptions.
     
     @param cls: Class to mix interface methods into
     @type cls: class
+    @param backend: Backend cls belongs to
+    @type backend: L{pyia.backend.Backend}
     '''
-    # get a method type as a reference from a known method
+    error = backend.COMError
+    named_property = backend.named_property
     # loop over all names in the new class
     for name in list(cls.__dict__.keys()):
         obj = cls.__dict__[name]
         # check if we're on a protected or private method
         if name.startswith('_'):
             continue
-        # check if we're on a method
-        elif isinstance(obj, types.MethodType):
+        # check if we're on a method; functions in a class dictionary are
+        # plain functions, not methods
+        elif isinstance(obj, types.FunctionType):
+            if obj.__name__ == '_inner':
+                continue
             # wrap the function in an exception handler
-            method = _makeExceptionHandler(obj)
+            method = _makeExceptionHandler(obj, error, name)
             # add the wrapped function to the class
             setattr(cls, name, method)
-        elif isinstance(obj, named_property):
+        elif named_property is not None and \
+                isinstance(obj, named_property):
             # wrap the function in an exception handler
             if obj.getter is not None:
-                obj.getter = _makeExceptionHandler(obj.getter)
+                obj.getter = _makeExceptionHandler(obj.getter, error, name)
             if obj.setter is not None:
-                obj.setter = _makeExceptionHandler(obj.setter)
+                obj.setter = _makeExceptionHandler(obj.setter, error,
+                                                   name + '.set')
         # check if we're on a property
         elif isinstance(obj, property):
             # wrap the getters and setters
             if obj.fget and obj.fget.__name__ != '_inner':
-                getter = _makeExceptionHandler(obj.fget)
+                getter = _makeExceptionHandler(obj.fget, error, name)
             else:
-                getter = None
+                getter = obj.fget
             if obj.fset and obj.fset.__name__ != '_inner':
-                setter = _makeExceptionHandler(obj.fset)
+                setter = _makeExceptionHandler(obj.fset, error, name + '.set')
             else:
-                setter = None
+                setter = obj.fset
             setattr(cls, name, property(getter, setter))
 
 def _mixClass(cls, new_cls, ignore=[]):
@@ -157,34 +192,106 @@ def _mixClass(cls, new_cls, ignore=[]):
             setattr(cls, name, func)
 
 
+# How many children __iter__ fetches per AccessibleChildren call.
+CHILD_CHUNK_SIZE = 256
+
+_traversal = threading.local()
+
+@contextmanager
+def memoizedChildren():
+    '''
+    Within this context, the children of each accessible are fetched at most
+    once per thread, and indexing, slicing and iterating all reuse that fetch.
+    Meant for wrapping one traversal of a tree that is not expected to change
+    under it. Nested contexts share the outermost memo.
+    '''
+    memo = getattr(_traversal, 'children', None)
+    if memo is not None:
+        yield
+        return
+    # Keyed by id(), with the accessible kept alive alongside its children;
+    # hashing COM pointers would cost a QueryInterface each.
+    _traversal.children = {}
+    try:
+        yield
+    finally:
+        _traversal.children = None
+
 class _IAccessibleMixin(object):
     def __getitem__(self, index):
+        memo = getattr(_traversal, 'children', None)
+        if memo is not None:
+            children = self._memoizedChildren(memo)
+            if isinstance(index, slice):
+                return [self._wrapChild(c) for c in children[index]]
+            return self._wrapChild(children[index])
         n = self.accChildCount
+        backend = getBackend()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(n)
+            indices = range(start, stop, step)
+            if not indices:
+                return []
+            first = min(indices[0], indices[-1])
+            # Fetch the covering range in one call and pick from it.
+            children = backend.accessibleChildren(
+                self, first, max(indices[0], indices[-1]) - first + 1)
+            return [self._wrapChild(children[i - first]) for i in indices
+                    if i - first < len(children)]
         if index >= n or index < -n:
             raise IndexError
         elif index < 0:
             index += n
-        for i, c in enumerate(self):
-            if i == index:
-                return c
-        raise IndexError
+        children = backend.accessibleChildren(self, index, 1)
+        if not children:
+            raise IndexError
+        return self._wrapChild(children[0])
 
     def __iter__(self):
-        accChildCount = self.accChildCount
-        VariantArrayType = VARIANT * accChildCount
-        rgvarChildren = VariantArrayType()
-        pcObtained = c_long()
+        memo = getattr(_traversal, 'children', None)
+        if memo is not None:
+            children = self._memoizedChildren(memo)
+        else:
+            children = getBackend().iterChildren(
+                self, self.accChildCount, CHILD_CHUNK_SIZE)
+        for child in children:
+            yield self._wrapChild(child)
+
+    def iterChildren(self, chunk_size=None):
+        '''
+        Iterates over the children, fetching chunk_size of them at a time
+        (L{CHILD_CHUNK_SIZE} by default), so the first child is available
+        right away and huge lists and tables are never held all at once.
+        '''
+        children = getBackend().iterChildren(
+            self, self.accChildCount, chunk_size or CHILD_CHUNK_SIZE)
+        for child in children:
+            yield self._wrapChild(child)
+
+    def simpleChildren(self):
+        '''
+        Fetches the children in one go and keeps those that are simple
+        children, as a compact L{ManagedChildArray}. Children with an
+        IAccessible of their own are left out.
+        '''
+        children = getBackend().accessibleChildren(
+            self, 0, self.accChildCount)
+        return ManagedChildArray(
+            self, [c for c in children if isinstance(c, int)])
+
+    def _wrapChild(self, child):
+        if isinstance(child, int):
+            return ManagedChildAccessible(self, child)
+        return child
+
+    def _memoizedChildren(self, memo):
         try:
-            oledll.oleacc.AccessibleChildren(self, 0, accChildCount, 
-                                             rgvarChildren, byref(pcObtained))
-        except:
-            pcObtained = c_long(0)
-        for i in range(pcObtained.value):
-            child = rgvarChildren[i]
-            if child.vt == VT_I4:
-                yield ManagedChildAccessible(self, child.value)
-            elif child.vt == VT_DISPATCH:
-                yield child.value.QueryInterface(IAccessible)
+            return memo[id(self)][1]
+        except KeyError:
+            children = getBackend().accessibleChildren(
+                self, 0, self.accChildCount)
+            memo[id(self)] = (self, children)
+            return children
 
     def __str__(self):
         try:
@@ -198,33 +305,10 @@ class _IAccessibleMixin(object):
         return self.accChildCount
 
     def accStateSet(self, child_id=CHILDID_SELF):
-        states = []
-        state = self.accState(child_id)
-        for shift in range(64):
-            state_bit = 1 << shift
-            if state_bit & state:
-                states.append(
-                    UNLOCALIZED_STATE_NAMES.get(
-                        (state_bit & state), 'unknown'))
-        return states
+        return StateSet(self.accState(child_id))
 
     def accLocalizedStateSet(self, child_id=CHILDID_SELF):
-        states = []
-        state = self.accState(child_id)
-        for shift in range(64):
-            state_bit = 1 << shift
-            if state_bit & state:
-                states.append(self._getStateText(state_bit & state))
-        return states
-
-    def _getStateText(self, state_bit):
-        stateLen = oledll.oleacc.GetStateTextW(state_bit,0,0)
-        if stateLen:
-            buf = create_unicode_buffer(stateLen + 2)
-            oledll.oleacc.GetStateTextW(state_bit, buf, stateLen + 1)
-            return buf.value
-        else:
-            return ''
+        return StateSet(self.accState(child_id)).localizedNames
         
     def accRoleName(self, child_id=CHILDID_SELF):
         role = self.accRole(child_id)
@@ -238,39 +322,75 @@ class _IAccessibleMixin(object):
         if not isinstance(role, int):
             # Maybe one of those Mozilla string roles, just return it.
             return role
-        roleLen = oledll.oleacc.GetRoleTextW(role,0,0)
-        if roleLen:
-            buf = create_unicode_buffer(roleLen + 2)
-            oledll.oleacc.GetRoleTextW(role, buf, roleLen + 1)
-            return buf.value
-        else:
-            return ''
+        return getBackend().localizedRoleText(role)
 
-class _ChildMethodWrapper(object):
-    def __init__(self, meth, child_id):
-        self.child_id = child_id
-        self.meth = meth
-    def __call__(self, *args, **kwargs):
-#        print 'should call', self.meth, 'with', self.child_id
-        return self.meth(self.child_id)
+# Parent methods a simple child forwards to, with its child ID as the first
+# argument...
+_CHILD_ID_FIRST = (
+    'accDefaultAction', 'accDescription', 'accDoDefaultAction', 'accHelp',
+    'accHelpTopic', 'accKeyboardShortcut', 'accLocation', 'accName',
+    'accRole', 'accRoleName', 'accLocalizedRoleName', 'accState',
+    'accStateSet', 'accLocalizedStateSet', 'accValue')
+# ...or as the last, after the caller's arguments.
+_CHILD_ID_LAST = ('accNavigate', 'accSelect')
+
+def _childIDFirst(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.parent, name)(self.child_id, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+def _childIDLast(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.parent, name)(*(args + (self.child_id,)),
+                                          **kwargs)
+    method.__name__ = name
+    return method
 
 class ManagedChildAccessible(object):
-    _managed_funcs = [
-        'accDefaultAction', 'accDescription', 'accDoDefaultAction', 
-        'accFocus', 'accHelp', 'accHelpTopic', 'accKeyboardShortcut', 
-        'accLocation', 'accName', 'accNavigate', 'accParent', 
-        'accRole', 'accRoleName', 'accSelect', 'accState', 
-        'accStateSet', 'accValue']
+    '''
+    A simple child: an element with no IAccessible of its own, accessed
+    through its parent and child ID. Small and slotted, so huge lists are
+    cheap to enumerate; the IAccessible methods are defined once on the
+    class and pass on whatever arguments they are given.
+    '''
+    __slots__ = ('parent', 'child_id')
+
+    _managed_funcs = _CHILD_ID_FIRST + _CHILD_ID_LAST + ('accFocus',
+                                                         'accParent')
 
     def __init__(self, parent, child_id):
         self.parent = parent
         self.child_id = child_id
 
-    def __getattr__(self, name):
-        if name in self._managed_funcs:
-            return _ChildMethodWrapper(
-                getattr(self.parent, name), self.child_id)
-        raise AttributeError
+    @property
+    def accParent(self):
+        return self.parent
+
+    @property
+    def accFocus(self):
+        if self.parent.accFocus == self.child_id:
+            return self
+        return None
+
+    @property
+    def accChildCount(self):
+        return 0
+
+    def __eq__(self, other):
+        if not isinstance(other, ManagedChildAccessible):
+            return NotImplemented
+        return self.child_id == other.child_id and \
+            (self.parent is other.parent or self.parent == other.parent)
+
+    def __ne__(self, other):
+        rv = self.__eq__(other)
+        if rv is NotImplemented:
+            return rv
+        return not rv
+
+    def __hash__(self):
+        return hash(self.child_id)
 
     def __bool__(self):
         return True
@@ -291,5 +411,72 @@ class ManagedChildAccessible(object):
     def __getitem__(self, index):
         raise IndexError
 
-_mixExceptions(IAccessible)
-_mixClass(IAccessible, _IAccessibleMixin)
+for _name in _CHILD_ID_FIRST:
+    setattr(ManagedChildAccessible, _name, _childIDFirst(_name))
+for _name in _CHILD_ID_LAST:
+    setattr(ManagedChildAccessible, _name, _childIDLast(_name))
+del _name
+
+class ManagedChildArray(object):
+    '''
+    The simple children of one parent, held as an array of child IDs.
+    Indexing and iterating make L{ManagedChildAccessible}s as they go;
+    L{cursor} and L{get} avoid even that for bulk work.
+    '''
+    __slots__ = ('parent', 'child_ids')
+
+    def __init__(self, parent, child_ids):
+        self.parent = parent
+        self.child_ids = array('l', child_ids)
+
+    def __len__(self):
+        return len(self.child_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ManagedChildArray(self.parent, self.child_ids[index])
+        return ManagedChildAccessible(self.parent, self.child_ids[index])
+
+    def __iter__(self):
+        parent = self.parent
+        for child_id in self.child_ids:
+            yield ManagedChildAccessible(parent, child_id)
+
+    def cursor(self):
+        '''
+        Generates one L{ManagedChildAccessible} moved to each child in turn.
+        Do not keep it past the next step; copy it (or its child_id) to hold
+        on to a child.
+        '''
+        child = ManagedChildAccessible(self.parent, 0)
+        for child_id in self.child_ids:
+            child.child_id = child_id
+            yield child
+
+    def get(self, name, *args):
+        '''
+        Reads a property of every child, such as get('accName').
+
+        @param name: Parent method taking the child ID first
+        @type name: string
+        @return: Values in child order
+        @rtype: list
+        '''
+        method = getattr(self.parent, name)
+        return [method(child_id, *args) for child_id in self.child_ids]
+
+def _installMixins(backend):
+    '''
+    Mixes the pyia conveniences into the accessible class of backend. Called
+    by L{pyia.backend.setBackend}; classes shared by several backends are only
+    mixed once.
+
+    @param backend: Backend being activated
+    @type backend: L{pyia.backend.Backend}
+    '''
+    cls = backend.IAccessible
+    if cls.__dict__.get('_pyia_mixed'):
+        return
+    _mixExceptions(cls, backend)
+    _mixClass(cls, _IAccessibleMixin)
+    cls._pyia_mixed = True
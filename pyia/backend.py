@@ -0,0 +1,281 @@
+'''
+Pluggable access to the platform accessibility API.
+
+Everything in pyia that would otherwise talk to oleacc.dll, user32.dll or
+comtypes directly goes through the active L{Backend} instead. The default
+backend is the real Windows one in L{pyia.winbackend}; L{pyia.simulated}
+provides an in-memory MSAA tree for profiling and benchmarking off a Windows
+desktop. The backend can be chosen with the PYIA_BACKEND environment variable
+('windows' or 'simulated') or with L{setBackend} before anything else is used.
+
+Backends are created, and their accessible class mixed, on first use rather
+than when pyia is imported.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import os
+from .constants import UNLOCALIZED_ROLE_NAMES, UNLOCALIZED_STATE_NAMES
+
+class Backend(object):
+    '''
+    Interface every accessibility backend implements. Object handles
+    (hwnds, object IDs, child IDs) are plain integers; accessibles are
+    instances of L{IAccessible}, which gets the pyia mixins installed when
+    the backend is activated.
+
+    @cvar IAccessible: Class of the accessible objects this backend returns
+    @cvar COMError: Exception raised by failing calls on those objects
+    @cvar named_property: Descriptor type used for parameterized properties,
+    or None
+    '''
+    name = None
+    IAccessible = None
+    COMError = Exception
+    named_property = None
+
+    def accessibleChildren(self, acc, start, count):
+        '''
+        Fetches up to count children of acc starting at index start.
+
+        @return: Children, either accessibles or integer child IDs
+        @rtype: list
+        '''
+        raise NotImplementedError
+
+    def iterChildren(self, acc, count, chunk_size):
+        '''
+        Generates the first count children of acc, fetching chunk_size of
+        them at a time so memory use stays bounded however many there are.
+        Backends may override this to reuse buffers between chunks.
+        '''
+        start = 0
+        while start < count:
+            n = min(chunk_size, count - start)
+            children = self.accessibleChildren(acc, start, n)
+            for child in children:
+                yield child
+            if len(children) < n:
+                return
+            start += n
+
+    def accessibleObjectFromWindow(self, hwnd, object_id=0):
+        raise NotImplementedError
+
+    def accessibleObjectFromEvent(self, hwnd, object_id, child_id):
+        '''
+        @return: The accessible and child ID the event refers to, or None
+        @rtype: tuple or None
+        '''
+        raise NotImplementedError
+
+    def windowFromAccessibleObject(self, acc):
+        raise NotImplementedError
+
+    def getWindowThreadProcessID(self, hwnd):
+        '''
+        @return: Process ID and thread ID owning hwnd
+        @rtype: tuple
+        '''
+        raise NotImplementedError
+
+    def getDesktopWindow(self):
+        raise NotImplementedError
+
+    def getForegroundWindow(self):
+        raise NotImplementedError
+
+    def isWindow(self, hwnd):
+        raise NotImplementedError
+
+    def isChildWindow(self, parent, hwnd):
+        '''
+        @return: Whether hwnd is a child window of parent, at any depth.
+        Answered locally, without asking parent's process.
+        @rtype: boolean
+        '''
+        raise NotImplementedError
+
+    def getRoleText(self, role):
+        '''
+        Asks the system for the localized text of a role. Use
+        L{localizedRoleText}, which remembers the answers.
+        '''
+        raise NotImplementedError
+
+    def getStateText(self, state_bit):
+        '''
+        Asks the system for the localized text of a state bit. Use
+        L{localizedStateText}, which remembers the answers.
+        '''
+        raise NotImplementedError
+
+    # Localized role and state text, as filled by refreshLocalizedText().
+    _role_text = None
+    _state_text = None
+
+    def localizedRoleText(self, role):
+        '''
+        Localized text of a role. The text of every ROLE_SYSTEM_* role is
+        read on first use and kept; other roles are read once when first
+        asked for.
+        '''
+        table = self._role_text
+        if table is None:
+            table = self.refreshLocalizedText()[0]
+        try:
+            return table[role]
+        except KeyError:
+            text = table[role] = self.getRoleText(role)
+            return text
+
+    def localizedStateText(self, state_bit):
+        '''
+        Localized text of a state bit, kept like L{localizedRoleText}.
+        '''
+        table = self._state_text
+        if table is None:
+            table = self.refreshLocalizedText()[1]
+        try:
+            return table[state_bit]
+        except KeyError:
+            text = table[state_bit] = self.getStateText(state_bit)
+            return text
+
+    def refreshLocalizedText(self):
+        '''
+        Reads the localized text of every ROLE_SYSTEM_* and STATE_SYSTEM_*
+        constant again. Call this after the system language changed.
+
+        @return: The new role and state text tables
+        @rtype: tuple of dictionaries
+        '''
+        role_text = dict((role, self.getRoleText(role))
+                         for role in UNLOCALIZED_ROLE_NAMES)
+        state_text = dict((bit, self.getStateText(bit))
+                          for bit in UNLOCALIZED_STATE_NAMES)
+        # Swapped in whole, so readers on other threads see either the old
+        # or the new tables.
+        self._role_text, self._state_text = role_text, state_text
+        return role_text, state_text
+
+    def setWinEventHook(self, event_min, event_max, callback,
+                        process_id=0, thread_id=0, flags=0):
+        '''
+        Installs a hook calling callback(handle, event_id, hwnd, object_id,
+        child_id, thread_id, timestamp) for events between event_min and
+        event_max inclusive.
+
+        @return: Hook ID, or 0 on failure
+        @rtype: integer
+        '''
+        raise NotImplementedError
+
+    def unhookWinEvent(self, hook_id):
+        '''
+        Removes a hook installed by L{setWinEventHook}. Only the thread that
+        installed a hook can remove it.
+
+        @return: Whether the hook was removed
+        @rtype: boolean
+        '''
+        raise NotImplementedError
+
+    def initThread(self):
+        '''
+        Prepares the calling thread for using this backend. Called by pyia's
+        own worker threads before they touch any accessible.
+        '''
+        pass
+
+    def sharesAccessibles(self):
+        '''
+        @return: Whether accessibles of the calling thread can be used as they
+        are by pyia's worker threads. When not, they have to go through
+        L{marshalAccessible} and L{unmarshalAccessible}.
+        @rtype: boolean
+        '''
+        return True
+
+    def marshalAccessible(self, acc):
+        '''
+        Packs an accessible of the calling thread for another thread, which
+        unpacks it once with L{unmarshalAccessible}.
+        '''
+        return acc
+
+    def unmarshalAccessible(self, marshaled):
+        '''
+        @return: The accessible packed by L{marshalAccessible}, usable on the
+        calling thread
+        @rtype: IAccessible
+        '''
+        return marshaled
+
+    def uninitThread(self):
+        pass
+
+    def pumpEvents(self, timeout):
+        '''
+        Dispatches pending window messages (and thus hooked events) for
+        timeout seconds.
+        '''
+        raise NotImplementedError
+
+_backends = {
+    'windows': ('pyia.winbackend', 'WindowsBackend'),
+    'simulated': ('pyia.simulated', 'SimulatedBackend')}
+
+_backend = None
+
+def _createBackend(name):
+    try:
+        module_name, class_name = _backends[name]
+    except KeyError:
+        raise ValueError('Unknown backend: %s' % name)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)()
+
+def getBackend():
+    '''
+    @return: The active backend, creating the default one if needed
+    @rtype: L{Backend}
+    '''
+    if _backend is None:
+        setBackend(os.environ.get('PYIA_BACKEND', 'windows'))
+    return _backend
+
+def setBackend(backend):
+    '''
+    Makes backend the active one and installs the pyia mixins into its
+    accessible class.
+
+    @param backend: Backend instance or registered backend name
+    @type backend: L{Backend} or string
+    @return: The backend that was activated
+    @rtype: L{Backend}
+    '''
+    global _backend
+    if isinstance(backend, str):
+        backend = _createBackend(backend)
+    from .accessible import _installMixins
+    _installMixins(backend)
+    _backend = backend
+    return backend
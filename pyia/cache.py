@@ -0,0 +1,247 @@
+'''
+An opt-in cache of accessible properties, invalidated by WinEvents.
+
+Values are keyed by the (hwnd, object ID, child ID) triple WinEvents use to
+name objects, filled on read and dropped again when the registry sees an
+event saying they changed. Enable it with
+L{pyia.registry.Registry.enablePropertyCache} and read through
+L{CachedAccessible} wrappers, typically obtained with
+L{PropertyCache.fromEvent}.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import threading
+from collections import OrderedDict
+from . import constants
+from .backend import getBackend
+from .constants import CHILDID_SELF, UNLOCALIZED_ROLE_NAMES
+from .stateset import StateSet
+
+# Events that change a single property of the object they are about.
+_PROPERTY_EVENTS = {
+    constants.EVENT_OBJECT_NAMECHANGE: 'name',
+    constants.EVENT_OBJECT_STATECHANGE: 'state',
+    constants.EVENT_OBJECT_VALUECHANGE: 'value',
+    constants.EVENT_OBJECT_DESCRIPTIONCHANGE: 'description'}
+
+INVALIDATING_EVENTS = tuple(_PROPERTY_EVENTS) + \
+    (constants.EVENT_OBJECT_REORDER, constants.EVENT_OBJECT_DESTROY)
+
+class PropertyCache(object):
+    '''
+    Size bounded LRU cache of property values.
+
+    @ivar max_entries: Most objects to keep properties for
+    @type max_entries: integer
+    @ivar hits: Reads answered from the cache
+    @ivar misses: Reads that had to go to the application
+    @ivar evictions: Objects dropped to stay within max_entries
+    @ivar invalidations: Objects or properties dropped because of events
+    '''
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # (hwnd, object_id) -> child IDs with entries, for dropping a whole
+        # object and its simple children at once.
+        self._objects = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a value fetched while an event was
+        # being handled is not stored after the event dropped it.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, prop, fetch, *args):
+        '''
+        Returns the cached value of prop for key, calling fetch(*args) and
+        caching the result on a miss.
+
+        @param key: (hwnd, object ID, child ID) of the object
+        @type key: tuple
+        @param prop: Property name, such as 'name' or 'state'
+        @type prop: string
+        @param fetch: Callable returning the live value
+        @type fetch: callable
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and prop in entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[prop]
+            self.misses += 1
+            generation = self._generation
+        value = fetch(*args)
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, prop, value)
+        return value
+
+    def _store(self, key, prop, value):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {}
+            self._objects.setdefault(key[:2], set()).add(key[2])
+            while len(self._entries) > self.max_entries:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._forget(old_key)
+                self.evictions += 1
+        else:
+            self._entries.move_to_end(key)
+        entry[prop] = value
+
+    def _forget(self, key):
+        child_ids = self._objects.get(key[:2])
+        if child_ids is not None:
+            child_ids.discard(key[2])
+            if not child_ids:
+                del self._objects[key[:2]]
+
+    def _drop(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._forget(key)
+            self.invalidations += 1
+
+    def invalidate(self, event_type, hwnd, object_id, child_id):
+        '''
+        Drops whatever the given event makes stale. Name, state, value and
+        description changes drop that property of the object; a reorder drops
+        the object and all its simple children, since their child IDs may
+        now refer to other items; a destroy drops the object, along with its
+        simple children if it is a full object.
+        '''
+        with self._lock:
+            self._generation += 1
+            prop = _PROPERTY_EVENTS.get(event_type)
+            if prop is not None:
+                entry = self._entries.get((hwnd, object_id, child_id))
+                if entry is not None and prop in entry:
+                    del entry[prop]
+                    self.invalidations += 1
+            elif event_type == constants.EVENT_OBJECT_REORDER or \
+                    (event_type == constants.EVENT_OBJECT_DESTROY and
+                     child_id == CHILDID_SELF):
+                for cid in list(self._objects.get((hwnd, object_id), ())):
+                    self._drop((hwnd, object_id, cid))
+            elif event_type == constants.EVENT_OBJECT_DESTROY:
+                self._drop((hwnd, object_id, child_id))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._objects.clear()
+
+    def stats(self):
+        '''
+        @return: Entry count and hit, miss, eviction and invalidation counters
+        @rtype: dictionary
+        '''
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def wrap(self, acc, hwnd, object_id, child_id=CHILDID_SELF):
+        '''
+        @return: acc reading name, role, state, value and description through
+        this cache
+        @rtype: L{CachedAccessible}
+        '''
+        return CachedAccessible(self, acc, hwnd, object_id, child_id)
+
+    def fromEvent(self, event):
+        '''
+        @return: The source of event read through this cache, or None if it
+        could not be resolved
+        @rtype: L{CachedAccessible}
+        '''
+        backend = getBackend()
+        if not backend.isWindow(event.hwnd):
+            return None
+        rv = backend.accessibleObjectFromEvent(
+            event.hwnd, event.object_id, event.child_id)
+        if rv is None:
+            return None
+        acc, child_id = rv
+        return CachedAccessible(self, acc, event.hwnd, event.object_id,
+                                child_id or CHILDID_SELF)
+
+class CachedAccessible(object):
+    '''
+    Wraps an accessible (or one of its simple children) whose WinEvent
+    identity is known, answering the cacheable getters from a
+    L{PropertyCache}. Like those of the accessible, they take a child ID,
+    so the simple children of a wrapped object are cached too. Everything
+    else is forwarded to the accessible.
+    '''
+    def __init__(self, cache, acc, hwnd, object_id, child_id=CHILDID_SELF):
+        self.cache = cache
+        self.acc = acc
+        self.child_id = child_id
+        self.key = (hwnd, object_id, child_id)
+
+    def __getattr__(self, name):
+        return getattr(self.acc, name)
+
+    def _get(self, prop, getter, child_id):
+        # CHILDID_SELF is the wrapped element itself; any other child ID is
+        # a simple child of the wrapped accessible.
+        if child_id == CHILDID_SELF:
+            child_id = self.child_id
+            key = self.key
+        else:
+            key = self.key[:2] + (child_id,)
+        return self.cache.get(key, prop, getattr(self.acc, getter), child_id)
+
+    def accName(self, child_id=CHILDID_SELF):
+        return self._get('name', 'accName', child_id)
+
+    def accRole(self, child_id=CHILDID_SELF):
+        return self._get('role', 'accRole', child_id)
+
+    def accState(self, child_id=CHILDID_SELF):
+        return self._get('state', 'accState', child_id)
+
+    def accValue(self, child_id=CHILDID_SELF):
+        return self._get('value', 'accValue', child_id)
+
+    def accDescription(self, child_id=CHILDID_SELF):
+        return self._get('description', 'accDescription', child_id)
+
+    def accStateSet(self, child_id=CHILDID_SELF):
+        return StateSet(self.accState(child_id))
+
+    def accRoleName(self, child_id=CHILDID_SELF):
+        role = self.accRole(child_id)
+        if not isinstance(role, int):
+            return role
+        return UNLOCALIZED_ROLE_NAMES.get(role, 'unknown')
+
+    def __str__(self):
+        try:
+            return '[%s | %s]' % (self.accRoleName(), self.accName() or '')
+        except:
+            return '[DEAD]'
@@ -0,0 +1,141 @@
+'''
+Coalescing of redundant WinEvent bursts.
+
+Progress bars, scrolling and live regions fire the same location, name or
+value change many times a second. An L{EventCoalescer} sits between the
+registry's hook callback and listener dispatch, holds such events back for a
+short window and only lets the latest event per (type, hwnd, object ID,
+child ID) through. Enable it with L{pyia.registry.Registry.enableCoalescing}.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import threading
+import time
+from collections import OrderedDict
+from . import constants
+
+COALESCED_EVENTS = (constants.EVENT_OBJECT_LOCATIONCHANGE,
+                    constants.EVENT_OBJECT_NAMECHANGE,
+                    constants.EVENT_OBJECT_VALUECHANGE)
+
+class EventCoalescer(object):
+    '''
+    Holds back coalescable events and passes the latest of each kind on to
+    dispatch once it has waited window seconds, or as soon as max_depth
+    distinct events are pending. Other event types are passed on right away,
+    so they may overtake held back events.
+
+    @ivar window: Seconds an event may be held back
+    @type window: float
+    @ivar max_depth: Most distinct events held back at once
+    @type max_depth: integer
+    @ivar event_types: Event IDs that are coalesced
+    @type event_types: frozenset
+    @ivar suppressed: Events dropped in favour of a later one
+    @type suppressed: integer
+    @ivar dispatched: Events passed on to dispatch
+    @type dispatched: integer
+    '''
+    def __init__(self, dispatch, window=0.05, max_depth=256,
+                 event_types=COALESCED_EVENTS):
+        '''
+        @param dispatch: Called with (event_id, hwnd, object_id, child_id,
+        thread_id, timestamp, ...) for every event let through
+        @type dispatch: callable
+        '''
+        self.dispatch = dispatch
+        self.window = window
+        self.max_depth = max_depth
+        self.event_types = frozenset(event_types)
+        self.suppressed = 0
+        self.dispatched = 0
+        # (event_id, hwnd, object_id, child_id) -> (arrival, event args),
+        # oldest first.
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, eventID, window, objectID, childID, threadID, timestamp,
+             *extra):
+        '''
+        Takes an event for dispatch. Any extra arguments are passed on to
+        dispatch as well, and only events with equal extra arguments are
+        merged.
+        '''
+        if eventID not in self.event_types:
+            self.dispatched += 1
+            self.dispatch(eventID, window, objectID, childID, threadID,
+                          timestamp, *extra)
+            return
+        key = (eventID, window, objectID, childID) + extra
+        now = time.time()
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None:
+                self.suppressed += 1
+                # Keep the original arrival time and position, so a steady
+                # stream of updates still gets through once per window.
+                now = previous[0]
+            self._pending[key] = \
+                (now, (eventID, window, objectID, childID, threadID,
+                       timestamp) + extra)
+            overflow = len(self._pending) >= self.max_depth
+        if overflow:
+            self.flush()
+        else:
+            self.flushExpired()
+
+    def _take(self, expired_before=None):
+        taken = []
+        with self._lock:
+            while self._pending:
+                key, (arrival, args) = next(iter(self._pending.items()))
+                if expired_before is not None and arrival > expired_before:
+                    break
+                del self._pending[key]
+                taken.append(args)
+        return taken
+
+    def flushExpired(self):
+        '''
+        Passes on the events that have been held back for the whole window.
+        '''
+        for args in self._take(time.time() - self.window):
+            self.dispatched += 1
+            self.dispatch(*args)
+
+    def flush(self):
+        '''
+        Passes on every held back event.
+        '''
+        for args in self._take():
+            self.dispatched += 1
+            self.dispatch(*args)
+
+    def stats(self):
+        '''
+        @return: Pending, suppressed and dispatched event counts
+        @rtype: dictionary
+        '''
+        return {'pending': len(self._pending), 'suppressed': self.suppressed,
+                'dispatched': self.dispatched}
@@ -25,6 +25,21 @@ Boston, MA 02111-1307, USA.
 '''
 # Child ID.
 CHILDID_SELF = 0
+
+# Object IDs
+OBJID_WINDOW = 0
+OBJID_SYSMENU = -1
+OBJID_TITLEBAR = -2
+OBJID_MENU = -3
+OBJID_CLIENT = -4
+OBJID_VSCROLL = -5
+OBJID_HSCROLL = -6
+OBJID_SIZEGRIP = -7
+OBJID_CARET = -8
+OBJID_CURSOR = -9
+OBJID_ALERT = -10
+OBJID_SOUND = -11
+
 # Accessible Roles 
 # TODO: Is there a way to retrieve this at runtime or build time?
 #
@@ -0,0 +1,207 @@
+'''
+Off-thread listener dispatch with bounded queues.
+
+A listener wrapped in a L{QueuedListener} gets its events through a queue of
+its own, drained on a shared L{WorkerPool}, so slow listeners no longer stall
+the message pump. Each queue is bounded and has an overflow policy deciding
+what happens when the listener falls behind. Listeners are registered this
+way with the dispatch argument of
+L{pyia.registry.Registry.registerEventListener}.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import threading
+import traceback
+from collections import deque
+from .backend import getBackend
+
+# Dispatch policies
+DISPATCH_INLINE = 'inline'
+DISPATCH_POOL = 'pool'
+
+# Overflow policies
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+
+class WorkerPool(object):
+    '''
+    A fixed number of daemon threads running queued listeners. Each thread
+    is initialized for the active backend (joining the multithreaded COM
+    apartment on Windows). Threads start with the first submitted work; once
+    shut down, a pool takes no more.
+    '''
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    def submit(self, func):
+        '''
+        Queues func to be called by a worker thread.
+
+        @raise RuntimeError: The pool was shut down
+        '''
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('Worker pool was shut down')
+            if not self._threads:
+                self._start()
+            self._ready.append(func)
+            self._cond.notify()
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name='pyia-worker-%d' % i, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        backend = getBackend()
+        backend.initThread()
+        try:
+            while True:
+                with self._cond:
+                    while not self._ready and not self._shutdown:
+                        self._cond.wait()
+                    if self._shutdown:
+                        return
+                    func = self._ready.popleft()
+                try:
+                    func()
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            backend.uninitThread()
+
+    def shutdown(self, wait=True):
+        '''
+        Stops the worker threads once they finish what they are running.
+        Work still queued is dropped.
+
+        @param wait: Wait for the threads to exit. Without waiting, a thread
+        stuck in a call to a hung application is left to exit whenever the
+        call returns.
+        @type wait: boolean
+        '''
+        with self._cond:
+            self._shutdown = True
+            self._ready.clear()
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        if not wait:
+            return
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+class QueuedListener(object):
+    '''
+    Callable standing in for a listener in the dispatch table. Events are
+    queued and delivered in order, one at a time, by a pool worker.
+
+    @ivar client: The wrapped listener
+    @ivar maxsize: Most events queued at once
+    @type maxsize: integer
+    @ivar overflow: What a full queue does with a new event: wait for room
+    (L{OVERFLOW_BLOCK}, stalling the caller), discard the oldest queued event
+    (L{OVERFLOW_DROP_OLDEST}) or discard the new one (L{OVERFLOW_DROP_NEWEST})
+    @ivar delivered: Events handed to the listener
+    @type delivered: integer
+    @ivar dropped: Events discarded because the queue was full
+    @type dropped: integer
+    '''
+    # Most events one worker turn delivers before letting other listeners
+    # have the thread.
+    batch = 64
+
+    def __init__(self, client, pool, maxsize=1024, overflow=OVERFLOW_BLOCK,
+                 call=None):
+        '''
+        @param call: Called as call(client, event) to deliver an event,
+        client(event) by default
+        @type call: callable
+        '''
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST,
+                            OVERFLOW_DROP_NEWEST):
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        self.client = client
+        self.pool = pool
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.call = call
+        self.delivered = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._scheduled = False
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def __call__(self, event):
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.maxsize:
+                        self._cond.wait()
+            self._queue.append(event)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.pool.submit(self._drain)
+
+    def _drain(self):
+        for i in range(self.batch):
+            with self._cond:
+                if not self._queue:
+                    self._scheduled = False
+                    return
+                event = self._queue.popleft()
+                self._cond.notify()
+            try:
+                if self.call is None:
+                    self.client(event)
+                else:
+                    self.call(self.client, event)
+            except Exception:
+                traceback.print_exc()
+            self.delivered += 1
+        # Still more to do; requeue behind the other listeners.
+        self.pool.submit(self._drain)
+
+    def stats(self):
+        '''
+        @return: Queue depth and delivered and dropped counts
+        @rtype: dictionary
+        '''
+        return {'depth': len(self._queue), 'delivered': self.delivered,
+                'dropped': self.dropped}
@@ -27,15 +27,41 @@ Boston, MA 02111-1307, USA.
 from .constants import winEventIDsToEventNames
 from .utils import accessibleObjectFromEvent
 
+# When an event resolves its source accessible
+SOURCE_LAZY = 'lazy'
+SOURCE_EAGER = 'eager'
+SOURCE_NEVER = 'never'
+
+_UNRESOLVED = object()
+
 class Event(object):
+    '''
+    A WinEvent. The source accessible costs a cross-process call to resolve,
+    so it is resolved at most once: on first access of L{source}
+    (L{SOURCE_LAZY}), at construction (L{SOURCE_EAGER}), or not at all, with
+    source always None (L{SOURCE_NEVER}). Any other value of resolve raises
+    ValueError.
+    '''
+    __slots__ = ('type', 'hwnd', 'object_id', 'child_id', 'thread_id',
+                 'timestamp', '_source')
+
     def __init__(self, 
-                 event_type, hwnd, object_id, child_id, thread_id, timestamp):
+                 event_type, hwnd, object_id, child_id, thread_id, timestamp,
+                 resolve=SOURCE_LAZY):
         self.type = event_type
         self.hwnd = hwnd
         self.object_id = object_id
         self.child_id = child_id
         self.thread_id = thread_id
         self.timestamp = timestamp
+        if resolve == SOURCE_LAZY:
+            self._source = _UNRESOLVED
+        elif resolve == SOURCE_EAGER:
+            self._source = accessibleObjectFromEvent(self)
+        elif resolve == SOURCE_NEVER:
+            self._source = None
+        else:
+            raise ValueError('Unknown source resolution: %s' % resolve)
 
     def __str__(self):
         return '''\
@@ -48,10 +74,9 @@ class Event(object):
              self.source, self.hwnd, self.thread_id, self.timestamp)
 
     def _get_source(self):
-        try:
-            rv = self._source
-        except AttributeError:
-            rv = accessibleObjectFromEvent(self)
+        rv = self._source
+        if rv is _UNRESOLVED:
+            rv = self._source = accessibleObjectFromEvent(self)
         return rv
     
     source = property(_get_source)
@@ -0,0 +1,500 @@
+'''
+Deadlines and per-process circuit breakers for calls into applications that
+stop responding.
+
+Like L{pyia.instrument}, this hooks the exception handlers mixed into the
+backend's accessible class, and the backend's child fetching too, once
+L{enableCallGuard} installs a L{CallGuard}. The guard then:
+
+  - gives every call a deadline, running it on a worker thread and raising
+    L{CallTimeout} if it does not return in time;
+  - enforces traversal deadlines set with L{CallGuard.deadline}, raising
+    L{DeadlineExceeded} once one has passed;
+  - keeps a L{CircuitBreaker} per process, found through
+    L{pyia.utils.getAccessibleThreadProcessID}. Repeated slow or failing
+    calls open the breaker, and calls into the process then fail at once
+    with L{AppNotResponding}. After a while one probe call is let through,
+    and the breaker closes again if it succeeds.
+
+Tree searches treat calls that raise as non-matches and fetches that raise
+as having no children. A hung application therefore costs each traversal
+one fast failure per subtree, instead of a COM timeout per call.
+
+Timed calls run on worker threads, which cannot use the accessibles of a
+thread in a single-threaded COM apartment (see
+L{pyia.backend.Backend.sharesAccessibles}). Calls from such a thread are made
+on it without a timeout; one taking longer than the call timeout counts as a
+failure, as slow calls do, so the breaker still cuts a hung application off
+once it has answered.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from . import accessible
+from .backend import Backend, getBackend
+from .dispatch import WorkerPool
+from .utils import getAccessibleThreadProcessID
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class AppNotResponding(Exception):
+    '''
+    Raised instead of calling into a process whose circuit breaker is open.
+
+    @ivar pid: The process ID, None if it could not be found
+    '''
+    def __init__(self, pid, message=None):
+        Exception.__init__(self, message or
+                           'Process %s is not responding' % pid)
+        self.pid = pid
+
+class CallTimeout(AppNotResponding):
+    '''
+    Raised when a call does not return before its deadline. The call itself
+    carries on in the background until the application answers.
+    '''
+
+class DeadlineExceeded(Exception):
+    '''
+    Raised by calls made after the traversal deadline has passed.
+    '''
+
+class CircuitBreaker(object):
+    '''
+    Tracks the health of one process. Closed, calls go through. After
+    failure_threshold consecutive slow or failed calls it opens and calls
+    fail fast. Once reset_timeout seconds have passed, it goes half open and
+    lets one probe call through: success closes it, failure opens it again.
+
+    @ivar state: L{CLOSED}, L{OPEN} or L{HALF_OPEN}
+    @ivar failures: Consecutive slow or failed calls
+    @type failures: integer
+    @ivar trips: Times the breaker opened
+    @type trips: integer
+    '''
+    def __init__(self, failure_threshold=3, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self, now=None):
+        '''
+        @return: Whether a call may go through now. When the breaker goes
+        half open, the call allowed is the probe.
+        @rtype: boolean
+        '''
+        if self.state == CLOSED:
+            return True
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and \
+                    now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self.state = CLOSED
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    (self.state == CLOSED and
+                     self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = now
+                self.trips += 1
+
+    def abandon(self, now=None):
+        '''
+        Ends a call that says nothing about the process, such as one cut
+        short by a traversal deadline. If it was the probe, the breaker opens
+        again, without counting a trip, and the next probe is let through
+        after another reset_timeout.
+        '''
+        if self.state != HALF_OPEN:
+            return
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.opened_at = now
+
+class _Deadline(object):
+    '''
+    A traversal deadline, as yielded by L{CallGuard.deadline}.
+
+    @ivar at: When it passes, as time.monotonic()
+    @ivar expired: Whether a call was refused because it had passed
+    '''
+    __slots__ = ('at', 'expired')
+
+    def __init__(self, at):
+        self.at = at
+        self.expired = False
+
+class CallGuard(object):
+    '''
+    Applies deadlines and circuit breakers to calls into applications.
+
+    @ivar call_timeout: Seconds a call may take before L{CallTimeout} is
+    raised, or None to let calls take as long as they take. Calls from
+    threads whose accessibles the workers cannot use are not timed, and
+    only count as failures when they take longer.
+    @type call_timeout: float
+    @ivar slow_call: Calls that return after this many seconds still count as
+    failures for the breaker, None for no limit. This lets the breakers work
+    without timed calls.
+    @type slow_call: float
+    @ivar count_errors: Whether COM errors count as failures. A run of calls
+    on objects that were just destroyed fails too, so without this only
+    slow calls and timeouts do.
+    @type count_errors: boolean
+    @ivar timeouts: Calls that timed out
+    @ivar rejected: Calls refused by an open breaker
+    '''
+    def __init__(self, call_timeout=None, slow_call=None, failure_threshold=3,
+                 reset_timeout=5.0, count_errors=True, workers=4,
+                 max_objects=4096):
+        self.call_timeout = call_timeout
+        self.slow_call = slow_call
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.count_errors = count_errors
+        self.max_objects = max_objects
+        self.timeouts = 0
+        self.rejected = 0
+        self._breakers = {}
+        # Accessible -> process ID, oldest first.
+        self._processes = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._workers = workers
+        self._pool = None
+
+    def breaker(self, pid):
+        '''
+        @return: The circuit breaker of a process
+        @rtype: L{CircuitBreaker}
+        '''
+        breaker = self._breakers.get(pid)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(pid)
+                if breaker is None:
+                    breaker = self._breakers[pid] = CircuitBreaker(
+                        self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def isResponding(self, acc):
+        '''
+        @return: False if calls into the process of acc are being refused.
+        Objects whose process is not known yet count as responding.
+        @rtype: boolean
+        '''
+        try:
+            pid = self._processes.get(acc)
+        except TypeError:
+            return True
+        breaker = self._breakers.get(pid)
+        return breaker is None or breaker.state != OPEN
+
+    def states(self):
+        '''
+        @return: Breaker state of every process seen, keyed by process ID
+        @rtype: dictionary
+        '''
+        return dict((pid, breaker.state)
+                    for pid, breaker in list(self._breakers.items()))
+
+    @contextmanager
+    def deadline(self, seconds):
+        '''
+        Within this context, calls made by this thread after seconds have
+        passed raise L{DeadlineExceeded}, and timed calls time out by then
+        at the latest. A traversal cut short this way ends quickly, since
+        every remaining call fails at once. Nested deadlines cannot extend
+        the enclosing one.
+
+        @return: The deadline; its expired flag tells whether it cut anything
+        short
+        @rtype: L{_Deadline}
+        '''
+        at = time.monotonic() + seconds
+        outer = getattr(self._local, 'deadline', None)
+        if outer is not None and outer.at < at:
+            at = outer.at
+        rv = self._local.deadline = _Deadline(at)
+        try:
+            yield rv
+        finally:
+            self._local.deadline = outer
+            if outer is not None and rv.expired and rv.at == outer.at:
+                outer.expired = True
+
+    def _processOf(self, obj, timeout=None):
+        try:
+            pid = self._processes[obj]
+        except (KeyError, TypeError):
+            pass
+        else:
+            return pid
+        if timeout is None:
+            return self._lookUpProcess(obj)
+        # Finding the process calls into the application as well. If that
+        # takes too long, the answer still counts against the process when
+        # it arrives.
+        t0 = time.monotonic()
+
+        def lookUp(obj):
+            pid = self._lookUpProcess(obj)
+            if time.monotonic() - t0 >= timeout:
+                self.breaker(pid).failure()
+            return pid
+
+        try:
+            return self._run(lookUp, obj, (), {}, timeout, None)
+        except CallTimeout:
+            self.timeouts += 1
+            raise
+
+    def _lookUpProcess(self, obj):
+        try:
+            pid = getAccessibleThreadProcessID(obj)[0]
+        except Exception:
+            return None
+        try:
+            with self._lock:
+                self._processes[obj] = pid
+                while len(self._processes) > self.max_objects:
+                    self._processes.popitem(last=False)
+        except TypeError:
+            # Unhashable; looked up every time.
+            pass
+        return pid
+
+    def _timed(self):
+        # Whether calls of this thread can be timed on the workers.
+        shares = getattr(self._local, 'shares', None)
+        if shares is None:
+            shares = self._local.shares = getBackend().sharesAccessibles()
+        return shares
+
+    def _run(self, func, obj, args, kwargs, timeout, pid):
+        pool = self._pool
+        if pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = WorkerPool(self._workers)
+                pool = self._pool
+        done = threading.Event()
+        state = {'cancelled': False}
+
+        def task():
+            if state['cancelled']:
+                return
+            try:
+                state['result'] = func(obj, *args, **kwargs)
+            except BaseException as e:
+                state['error'] = e
+            done.set()
+
+        pool.submit(task)
+        if not done.wait(timeout):
+            state['cancelled'] = True
+            raise CallTimeout(pid, 'Call into process %s timed out after '
+                              '%.3fs' % (pid, timeout))
+        if 'error' in state:
+            raise state['error']
+        return state['result']
+
+    def call(self, func, error, obj, args, kwargs):
+        '''
+        Calls func(obj, *args, **kwargs) under the guard.
+
+        @param error: COMError class of the backend
+        @raise AppNotResponding: The breaker of the process of obj is open
+        @raise CallTimeout: The call did not return in time
+        @raise DeadlineExceeded: The traversal deadline has passed
+        '''
+        deadline = getattr(self._local, 'deadline', None)
+        now = time.monotonic()
+        timeout = self.call_timeout
+        slow_call = self.slow_call
+        timed = self._timed()
+        if not timed:
+            if timeout is not None and (slow_call is None or
+                                        timeout < slow_call):
+                slow_call = timeout
+            timeout = None
+        # Whether the traversal deadline comes before the call's own.
+        cut_short = False
+        if deadline is not None:
+            remaining = deadline.at - now
+            if remaining <= 0:
+                deadline.expired = True
+                raise DeadlineExceeded('Traversal deadline passed')
+            if timed and (timeout is None or remaining < timeout):
+                timeout = remaining
+                cut_short = True
+        try:
+            pid = self._processOf(obj, timeout)
+        except CallTimeout:
+            if cut_short:
+                deadline.expired = True
+                raise DeadlineExceeded('Traversal deadline passed')
+            raise
+        breaker = self.breaker(pid)
+        if not breaker.allow(now):
+            self.rejected += 1
+            raise AppNotResponding(pid)
+        try:
+            if timeout is None:
+                rv = func(obj, *args, **kwargs)
+            else:
+                rv = self._run(func, obj, args, kwargs, timeout, pid)
+        except CallTimeout:
+            if cut_short:
+                # Not the application's fault as far as we know.
+                breaker.abandon()
+                deadline.expired = True
+                raise DeadlineExceeded('Traversal deadline passed')
+            self.timeouts += 1
+            breaker.failure()
+            raise
+        except error:
+            if self.count_errors:
+                breaker.failure()
+            else:
+                breaker.success()
+            raise
+        except BaseException:
+            breaker.abandon()
+            raise
+        if slow_call is not None and time.monotonic() - now >= slow_call:
+            breaker.failure()
+        else:
+            breaker.success()
+        return rv
+
+    def reset(self):
+        '''
+        Closes every breaker and forgets which process objects belong to.
+        '''
+        with self._lock:
+            self._breakers.clear()
+            self._processes.clear()
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+def enableCallGuard(call_timeout=None, slow_call=None, failure_threshold=3,
+                    reset_timeout=5.0, count_errors=True, workers=4):
+    '''
+    Puts calls made through the accessible class, and AccessibleChildren,
+    under a new L{CallGuard}, replacing any guard installed before.
+
+    @param call_timeout: Seconds a call may take, or None for no per-call
+    deadline. Timed calls run on a pool of worker threads.
+    @type call_timeout: float
+    @param slow_call: Seconds after which a call that returns still counts
+    as a failure, or None
+    @type slow_call: float
+    @param failure_threshold: Consecutive failures that open a process's
+    breaker
+    @type failure_threshold: integer
+    @param reset_timeout: Seconds an open breaker waits before letting a
+    probe call through
+    @type reset_timeout: float
+    @param count_errors: Whether COM errors count as failures
+    @type count_errors: boolean
+    @param workers: Threads available to timed calls. Each call that times
+    out holds one until the application answers it.
+    @type workers: integer
+    @return: The guard
+    @rtype: L{CallGuard}
+    '''
+    disableCallGuard()
+    guard = CallGuard(call_timeout, slow_call, failure_threshold,
+                      reset_timeout, count_errors, workers)
+    backend = getBackend()
+    # AccessibleChildren is a backend function rather than a method, so the
+    # guard shadows it on the backend instance.
+    accessibleChildren = backend.accessibleChildren
+    error = backend.COMError
+
+    def guardedChildren(acc, start, count):
+        return guard.call(accessibleChildren, error, acc, (start, count), {})
+
+    def guardedIterChildren(acc, count, chunk_size):
+        # Backends may fetch chunks without going through
+        # accessibleChildren, reusing one buffer that a timed out call
+        # would still be writing to. The generic loop fetches every chunk
+        # through the guard, into a buffer of its own.
+        return Backend.iterChildren(backend, acc, count, chunk_size)
+
+    backend.accessibleChildren = guardedChildren
+    backend.iterChildren = guardedIterChildren
+    accessible._call_guard = guard
+    return guard
+
+def disableCallGuard():
+    '''
+    Removes the guard installed by L{enableCallGuard}.
+
+    @return: The guard removed, or None if there was none
+    @rtype: L{CallGuard}
+    '''
+    guard, accessible._call_guard = accessible._call_guard, None
+    backend = getBackend()
+    backend.__dict__.pop('accessibleChildren', None)
+    backend.__dict__.pop('iterChildren', None)
+    if guard is not None:
+        guard.close()
+    return guard
+
+def getCallGuard():
+    '''
+    @return: The installed guard, or None
+    @rtype: L{CallGuard}
+    '''
+    return accessible._call_guard
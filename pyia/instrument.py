@@ -0,0 +1,287 @@
+'''
+Opt-in per-call instrumentation of the accessible class.
+
+Every public method and property of the backend's accessible class goes
+through the exception handler mixed in by L{pyia.accessible}. While
+instrumentation is on, that handler also times the call and records it in a
+L{CallStats}: per method or property name, the calls, the errors and a
+latency histogram giving p50, p99 and max. Calls slower than a threshold can
+be logged with a sample of the stack that made them. While it is off, the
+handler only tests one global.
+
+Turn it on with L{enableInstrumentation}, read it with L{CallStats.snapshot}
+or L{CallStats.prometheus}, and turn it off with L{disableInstrumentation}.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from . import accessible
+
+log = logging.getLogger('pyia.instrument')
+
+# Code a call goes through between its caller and the recording of it: this
+# module, the call guard, and the hooks of the exception handlers.
+_HOOK_FILES = frozenset(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ('instrument.py', 'guard.py'))
+_HOOK_FUNCTIONS = frozenset(
+    (os.path.abspath(accessible.__file__), name)
+    for name in ('_inner', '_hookedCall', '<lambda>'))
+
+def _isHook(code):
+    filename = code.co_filename
+    return filename in _HOOK_FILES or \
+        (filename, code.co_name) in _HOOK_FUNCTIONS
+
+# Histogram buckets per power of two of the latency in nanoseconds, so a
+# reported quantile is within 1/16 of the true value.
+_SUB_BUCKETS = 8
+
+def _bucket(ns):
+    mantissa, exponent = math.frexp(ns)
+    return exponent * _SUB_BUCKETS + int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+
+def _bucketValue(bucket):
+    # Midpoint of the latencies falling in bucket, in seconds.
+    exponent, sub = divmod(bucket, _SUB_BUCKETS)
+    mantissa = 0.5 + (sub + 0.5) / (2 * _SUB_BUCKETS)
+    return math.ldexp(mantissa, exponent) / 1e9
+
+class _MethodStats(object):
+    __slots__ = ('calls', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def quantile(self, q):
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(_bucketValue(bucket), self.max)
+        return self.max
+
+class SlowCall(object):
+    '''
+    A call that took longer than the slow call threshold.
+
+    @ivar name: Method or property name
+    @ivar seconds: How long it took
+    @ivar error: The exception it raised, or None
+    @ivar stack: The innermost frames of the caller, as formatted by the
+    traceback module
+    @type stack: list of strings
+    @ivar timestamp: When it returned, as time.time()
+    '''
+    __slots__ = ('name', 'seconds', 'error', 'stack', 'timestamp')
+
+    def __init__(self, name, seconds, error, stack):
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+        self.stack = stack
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        return '<SlowCall %s %.1fms>' % (self.name, self.seconds * 1000)
+
+class CallStats(object):
+    '''
+    Call counts, error counts and latency histograms per method or property
+    name. Property setters are recorded as name.set.
+
+    @ivar slow_threshold: Calls taking longer than this many seconds are
+    logged and kept in slow_calls, None to not look for slow calls
+    @type slow_threshold: float
+    @ivar stack_depth: Frames kept of the stack of a slow call
+    @type stack_depth: integer
+    @ivar slow_calls: The latest slow calls
+    @type slow_calls: collections.deque of L{SlowCall}
+    '''
+    def __init__(self, slow_threshold=None, stack_depth=8, max_slow_calls=100):
+        self.slow_threshold = slow_threshold
+        self.stack_depth = stack_depth
+        self.slow_calls = deque(maxlen=max_slow_calls)
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, func, error, obj, args, kwargs):
+        '''
+        Calls func(obj, *args, **kwargs), recording it under name.
+        '''
+        failed = None
+        t0 = time.perf_counter()
+        try:
+            return func(obj, *args, **kwargs)
+        except error as e:
+            failed = e
+            raise
+        finally:
+            self.record(name, time.perf_counter() - t0, failed)
+
+    def record(self, name, seconds, error=None):
+        '''
+        Records one call.
+
+        @param name: Method or property name
+        @type name: string
+        @param seconds: How long the call took
+        @type seconds: float
+        @param error: The COM error it raised, if any
+        '''
+        with self._lock:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = _MethodStats()
+            stats.calls += 1
+            if error is not None:
+                stats.errors += 1
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+            bucket = seconds > 0 and _bucket(seconds * 1e9) or 0
+            stats.buckets[bucket] = stats.buckets.get(bucket, 0) + 1
+        threshold = self.slow_threshold
+        if threshold is not None and seconds >= threshold:
+            # Start at the caller, leaving out the hooks however many there
+            # are.
+            frame = sys._getframe(1)
+            while frame is not None and _isHook(frame.f_code):
+                frame = frame.f_back
+            stack = traceback.format_list(
+                traceback.extract_stack(frame, self.stack_depth))
+            self.slow_calls.append(SlowCall(name, seconds, error, stack))
+            log.warning('Slow call to %s: %.1fms%s\n%s', name,
+                        seconds * 1000, error is not None and
+                        ' (%s)' % error or '', ''.join(stack).rstrip())
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self.slow_calls.clear()
+
+    def snapshot(self):
+        '''
+        @return: For each name, a dictionary of 'calls', 'errors', 'total',
+        'p50', 'p99' and 'max', times being in seconds
+        @rtype: dictionary
+        '''
+        with self._lock:
+            return dict((name, {'calls': stats.calls,
+                                'errors': stats.errors,
+                                'total': stats.total,
+                                'p50': stats.quantile(0.5),
+                                'p99': stats.quantile(0.99),
+                                'max': stats.max})
+                        for name, stats in self._methods.items())
+
+    def prometheus(self, prefix='pyia'):
+        '''
+        @return: The statistics in the Prometheus text exposition format,
+        latencies as a summary
+        @rtype: string
+        '''
+        snapshot = self.snapshot()
+        names = sorted(snapshot)
+        lines = [
+            '# HELP %s_calls_total Calls to accessible methods and '
+            'properties.' % prefix,
+            '# TYPE %s_calls_total counter' % prefix]
+        for name in names:
+            lines.append('%s_calls_total{method="%s"} %d' % (
+                prefix, name, snapshot[name]['calls']))
+        lines.extend([
+            '# HELP %s_call_errors_total Calls that raised a COM error.' %
+            prefix,
+            '# TYPE %s_call_errors_total counter' % prefix])
+        for name in names:
+            lines.append('%s_call_errors_total{method="%s"} %d' % (
+                prefix, name, snapshot[name]['errors']))
+        lines.extend([
+            '# HELP %s_call_seconds Latency of calls.' % prefix,
+            '# TYPE %s_call_seconds summary' % prefix])
+        for name in names:
+            stats = snapshot[name]
+            for quantile, key in (('0.5', 'p50'), ('0.99', 'p99')):
+                lines.append('%s_call_seconds{method="%s",quantile="%s"} %r'
+                             % (prefix, name, quantile, stats[key]))
+            lines.append('%s_call_seconds_sum{method="%s"} %r' % (
+                prefix, name, stats['total']))
+            lines.append('%s_call_seconds_count{method="%s"} %d' % (
+                prefix, name, stats['calls']))
+        lines.extend([
+            '# HELP %s_call_seconds_max Slowest call.' % prefix,
+            '# TYPE %s_call_seconds_max gauge' % prefix])
+        for name in names:
+            lines.append('%s_call_seconds_max{method="%s"} %r' % (
+                prefix, name, snapshot[name]['max']))
+        return '\n'.join(lines) + '\n'
+
+def enableInstrumentation(slow_threshold=None, stack_depth=8,
+                          max_slow_calls=100):
+    '''
+    Starts recording calls made through the accessible class, replacing any
+    statistics being recorded.
+
+    @param slow_threshold: Log calls taking at least this many seconds, None
+    for no slow call logging
+    @type slow_threshold: float
+    @param stack_depth: Frames to keep of the stack of a slow call
+    @type stack_depth: integer
+    @param max_slow_calls: Most slow calls to keep
+    @type max_slow_calls: integer
+    @return: The statistics being recorded
+    @rtype: L{CallStats}
+    '''
+    stats = CallStats(slow_threshold, stack_depth, max_slow_calls)
+    accessible._call_stats = stats
+    return stats
+
+def disableInstrumentation():
+    '''
+    Stops recording calls.
+
+    @return: The statistics recorded, or None if instrumentation was off
+    @rtype: L{CallStats}
+    '''
+    stats, accessible._call_stats = accessible._call_stats, None
+    return stats
+
+def getInstrumentation():
+    '''
+    @return: The statistics being recorded, or None if instrumentation is off
+    @rtype: L{CallStats}
+    '''
+    return accessible._call_stats
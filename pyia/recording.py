@@ -0,0 +1,142 @@
+'''
+Compact recording and replay of WinEvent streams.
+
+An L{EventRecorder} attached to the registry appends every event reaching
+the hook callback to a file of fixed width binary records. L{replayEvents}
+later feeds such a file back through the registry's dispatch path, at the
+original pace, scaled or as fast as possible, so listener throughput can be
+measured away from the machine the events came from.
+
+The file starts with the 8 byte L{MAGIC}, followed by L{RECORD} structs of
+(event ID, hwnd, object ID, child ID, thread ID, event timestamp in
+milliseconds, process ID, arrival time in seconds).
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PYIAEV02'
+RECORD = struct.Struct('<iqiiiiid')
+
+# Records read from disk at a time.
+_READ_CHUNK = 4096
+
+class EventRecorder(object):
+    '''
+    Appends events to a recording file.
+
+    @ivar path: File being written
+    @ivar count: Events recorded by this recorder
+    @type count: integer
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        else:
+            _checkHeader(path)
+
+    def record(self, eventID, window, objectID, childID, threadID,
+               timestamp, processID=0):
+        data = RECORD.pack(eventID, window, objectID, childID, threadID,
+                           timestamp, processID, time.time())
+        with self._lock:
+            self._file.write(data)
+            self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _checkHeader(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a pyia event recording' % path)
+
+def readEvents(path):
+    '''
+    Reads a recording back.
+
+    @return: Generator of (event ID, hwnd, object ID, child ID, thread ID,
+    timestamp, process ID, arrival time) tuples
+    @rtype: generator
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a pyia event recording' % path)
+        while True:
+            data = f.read(RECORD.size * _READ_CHUNK)
+            # Ignore a partial record left by an interrupted writer.
+            data = data[:len(data) - len(data) % RECORD.size]
+            if not data:
+                return
+            for record in RECORD.iter_unpack(data):
+                yield record
+
+def countEvents(path):
+    '''
+    @return: Number of complete records in a recording
+    @rtype: integer
+    '''
+    return (os.path.getsize(path) - len(MAGIC)) // RECORD.size
+
+def replayEvents(path, registry=None, speed=1.0):
+    '''
+    Feeds a recording through the registry as if its hooks were seeing the
+    events again, including property cache invalidation and coalescing.
+    Each event reaches the listeners whose process and thread filters match
+    the recorded process and thread IDs.
+
+    @param registry: Registry to dispatch through, the pyia singleton by
+    default
+    @type registry: L{pyia.registry.Registry}
+    @param speed: 1.0 for the original pace, 2.0 for twice as fast and so on,
+    or None to dispatch as fast as possible
+    @type speed: float
+    @return: Number of events replayed and seconds taken
+    @rtype: tuple
+    '''
+    if registry is None:
+        from . import Registry as registry
+    handle = registry._replayEvent
+    count = 0
+    start = time.time()
+    first = None
+    for record in readEvents(path):
+        if speed:
+            if first is None:
+                first = record[7]
+            delay = start + (record[7] - first) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        handle(*record[:7])
+        count += 1
+    return count, time.time() - start
@@ -26,69 +26,550 @@ Boston, MA 02111-1307, USA.
 '''
 
 from . import constants
+import collections
+import os
+import threading
+import time
 import traceback
-from ctypes import CFUNCTYPE, c_int, c_voidp, windll
-from comtypes.client import PumpEvents
-from .event import Event
+import types
+# asyncio is imported by the methods using it, since importing it takes
+# several times as long as importing the rest of pyia.
+from .backend import getBackend
+from .cache import PropertyCache, INVALIDATING_EVENTS
+from .coalesce import EventCoalescer, COALESCED_EVENTS
+from .dispatch import WorkerPool, QueuedListener, DISPATCH_INLINE, \
+    DISPATCH_POOL, OVERFLOW_BLOCK
+from .event import Event, SOURCE_LAZY
+from .recording import EventRecorder
 from .utils import accessibleObjectFromEvent
 
+def _hookRanges(event_types, gap=0):
+    '''
+    Groups event IDs into the fewest (event_min, event_max) ranges covering
+    them, merging neighbouring ranges separated by at most gap unwanted IDs.
+
+    @return: Sorted, disjoint ranges
+    @rtype: list
+    '''
+    ranges = []
+    for event_type in sorted(event_types):
+        if ranges and event_type - ranges[-1][1] <= gap + 1:
+            ranges[-1][1] = event_type
+        else:
+            ranges.append([event_type, event_type])
+    return [tuple(r) for r in ranges]
+
+# Hook scope, as (process ID, thread ID, SetWinEventHook flags), of listeners
+# registered without process or thread filters.
+GLOBAL_SCOPE = (0, 0, constants.WINEVENT_OUTOFCONTEXT)
+
 class Registry(object):
+    '''
+    Dispatches WinEvents to registered listeners.
+
+    @ivar clients: Dispatch tables keyed by hook scope, a (process ID, thread
+    ID, hook flags) tuple. Each maps event IDs to the (listener, hwnd,
+    object ID) entries registered for them, in registration order, with
+    None for hwnd or object ID meaning any.
+    @type clients: dictionary
+    @ivar hooks: Installed hook IDs keyed by (scope, event_min, event_max)
+    @type hooks: dictionary
+    @ivar hook_gap: Largest run of unwanted event IDs a single hook may span
+    to cover two wanted ones. Unwanted events are dropped before an Event is
+    built, but each still costs a callback.
+    @type hook_gap: integer
+    @ivar pump_interval: How often the pump thread started by L{run} picks
+    up hook changes requested from other threads, in seconds
+    @type pump_interval: float
+    @ivar workers: Size of the worker pool running pool dispatched listeners
+    @type workers: integer
+    @ivar source_resolution: When events resolve their source, one of the
+    SOURCE_* constants in L{pyia.event}
+    @type source_resolution: string
+    '''
     def __init__(self):
         self.clients = {}
-        self.hook_ids = []
-        self._c_handleEvent = CFUNCTYPE(
-                c_voidp,c_int,c_int,c_int,c_int,c_int,c_int,c_int)(
-                    self._handleEvent)
+        self.hooks = {}
+        self.hook_gap = 0
+        # Number of listeners (and the property cache) needing each event,
+        # per scope.
+        self._hook_refs = {}
+        # Hook ID -> scope, to find the dispatch table for a callback.
+        self._hook_scopes = {}
+        # Recently seen events -> the hook that delivered them first.
+        self._recent_events = collections.OrderedDict()
+        self.property_cache = None
+        self.coalescer = None
+        self.recorder = None
+        self.source_resolution = SOURCE_LAZY
+        self.pump_interval = 0.05
+        # Set while run() pumps messages on a thread of its own.
+        self._pump_thread = None
+        # Thread that installed the hooks, the only one able to remove them.
+        self._hook_thread = None
+        self._hooks_dirty = False
+        self._loop = None
+        self._stopped = None
+        self.workers = 4
+        self.worker_pool = None
+        # Pool dispatched listeners -> the QueuedListener in the table.
+        self._queued = {}
 
     def __call__(self):
         return self
 
     def _handleEvent(self, handle, eventID, window, objectID, childID, 
                      threadID, timestamp):
-        e = Event(eventID, window, objectID, childID, threadID, timestamp)
-        for client, event_type in list(self.clients.keys()):
-            if event_type == eventID:
-                try:
-                    client(e)
-                except Exception:
-                    traceback.print_exc()
-            
-    def registerEventListener(self, client, *event_types):
+        scope = self._hook_scopes.get(handle, GLOBAL_SCOPE)
+        if len(self._hook_scopes) < 2 or self._firstDelivery(
+                handle, (eventID, window, objectID, childID, threadID,
+                         timestamp)):
+            self._noteEvent(eventID, window, objectID, childID, threadID,
+                            timestamp, scope[0])
+        self._deliverEvent(eventID, window, objectID, childID, threadID,
+                           timestamp, scope)
+
+    def _firstDelivery(self, handle, key):
+        # Every hook whose range and filters match an event gets a callback
+        # for it. Repeats from the same hook are new events.
+        first = self._recent_events.get(key)
+        if first is not None and first != handle:
+            return False
+        self._recent_events[key] = handle
+        self._recent_events.move_to_end(key)
+        if len(self._recent_events) > 64:
+            self._recent_events.popitem(last=False)
+        return True
+
+    def _noteEvent(self, eventID, window, objectID, childID, threadID,
+                   timestamp, processID=0):
+        # Done once per event, however many hooks deliver it.
+        if self.recorder is not None:
+            if not processID:
+                processID = getBackend().getWindowThreadProcessID(window)[0]
+            self.recorder.record(eventID, window, objectID, childID, threadID,
+                                 timestamp, processID)
+        if self.property_cache is not None:
+            # Invalidate before any listener gets a chance to read.
+            self.property_cache.invalidate(eventID, window, objectID, childID)
+
+    def _deliverEvent(self, eventID, window, objectID, childID, threadID,
+                      timestamp, scope):
+        table = self.clients.get(scope)
+        if table is None or eventID not in table:
+            return
+        if self.coalescer is not None:
+            self.coalescer.push(eventID, window, objectID, childID, threadID,
+                                timestamp, scope)
+        else:
+            self._dispatchEvent(eventID, window, objectID, childID, threadID,
+                                timestamp, scope)
+
+    def _replayEvent(self, eventID, window, objectID, childID, threadID,
+                     timestamp, processID):
+        '''
+        Handles a recorded event the way the hooks would have: once for the
+        property cache and recorder, then for every scope whose process and
+        thread filters match it.
+        '''
+        self._noteEvent(eventID, window, objectID, childID, threadID,
+                        timestamp, processID)
+        for scope in list(self.clients):
+            process_id, thread_id, flags = scope
+            if process_id and process_id != processID or \
+                    thread_id and thread_id != threadID or \
+                    flags & constants.WINEVENT_SKIPOWNPROCESS and \
+                    processID == os.getpid():
+                continue
+            self._deliverEvent(eventID, window, objectID, childID, threadID,
+                               timestamp, scope)
+
+    def _dispatchEvent(self, eventID, window, objectID, childID, threadID,
+                       timestamp, scope=GLOBAL_SCOPE):
+        clients = self.clients.get(scope, {}).get(eventID)
+        if not clients:
+            return
+        e = None
+        for client, hwnd, object_id in clients:
+            if hwnd is not None and hwnd != window or \
+                    object_id is not None and object_id != objectID:
+                continue
+            if e is None:
+                e = Event(eventID, window, objectID, childID, threadID,
+                          timestamp, self.source_resolution)
+            try:
+                self._callClient(client, e)
+            except Exception:
+                traceback.print_exc()
+
+    def _callClient(self, client, event):
+        rv = client(event)
+        if rv is not None and isinstance(rv, types.CoroutineType):
+            self._scheduleListener(rv)
+
+    def _scheduleListener(self, coro):
+        # Async listeners run on the loop given to run(), never on the thread
+        # handling the hook.
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError('Async listeners need Registry.run()')
+        import asyncio
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(self._listenerDone)
+
+    def _listenerDone(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    def _ref(self, scope, event_type):
+        refs = self._hook_refs.setdefault(scope, {})
+        refs[event_type] = refs.get(event_type, 0) + 1
+
+    def _unref(self, scope, event_type):
+        refs = self._hook_refs[scope]
+        count = refs[event_type] - 1
+        if count:
+            refs[event_type] = count
+        else:
+            del refs[event_type]
+            if not refs:
+                del self._hook_refs[scope]
+
+    def _updateHooks(self):
+        pump_thread = self._pump_thread
+        if pump_thread is not None and \
+                pump_thread is not threading.current_thread():
+            # Hooks deliver to the thread that installed them, so leave it to
+            # the pump thread.
+            self._hooks_dirty = True
+            return
+        self._applyHooks()
+
+    def _applyHooks(self):
+        '''
+        Brings the installed hooks in line with the referenced event types,
+        installing new ranges before removing the ones they replace.
+        '''
+        self._hooks_dirty = False
+        backend = getBackend()
+        wanted = set()
+        for scope, refs in list(self._hook_refs.items()):
+            process_id, thread_id, flags = scope
+            for event_min, event_max in _hookRanges(refs, self.hook_gap):
+                key = (scope, event_min, event_max)
+                wanted.add(key)
+                if key in self.hooks:
+                    continue
+                hook_id = backend.setWinEventHook(
+                    event_min, event_max, self._handleEvent, process_id,
+                    thread_id, flags)
+                if hook_id:
+                    if not self.hooks:
+                        self._hook_thread = threading.current_thread()
+                    self._hook_scopes[hook_id] = scope
+                    self.hooks[key] = hook_id
+                else:
+                    print("Could not register callback for %s" % \
+                        ', '.join(
+                            constants.winEventIDsToEventNames.get(t, str(t))
+                            for t in sorted(refs)
+                            if event_min <= t <= event_max))
+        for key in list(self.hooks):
+            if key not in wanted:
+                self._unhook(backend, key)
+
+    def _unhook(self, backend, key):
+        hook_id = self.hooks[key]
+        if not backend.unhookWinEvent(hook_id) and \
+                self._hook_thread is not threading.current_thread():
+            # Only the installing thread can remove it, so it stays on
+            # record for that thread to retry.
+            return
+        del self.hooks[key]
+        self._hook_scopes.pop(hook_id, None)
+        if not self.hooks:
+            self._hook_thread = None
+
+    def registerEventListener(self, client, *event_types,
+                              dispatch=DISPATCH_INLINE, queue_size=1024,
+                              overflow=OVERFLOW_BLOCK, process_id=0,
+                              thread_id=0, hwnd=None, object_id=None,
+                              skip_own_process=False, skip_own_thread=False):
+        '''
+        Calls client with an L{Event} for every event of the given types.
+
+        Process and thread filters, and the skip_own_* options, are passed on
+        to SetWinEventHook, so unwanted events never reach pyia. The hwnd and
+        object ID filters are checked before an Event is built. Listeners with
+        different process or thread filters get hooks of their own.
+
+        @param dispatch: L{DISPATCH_INLINE} to call client from the hook
+        callback, or L{DISPATCH_POOL} to queue events for it and call it on
+        the worker pool
+        @param queue_size: Bound of the queue of a pool dispatched listener
+        @type queue_size: integer
+        @param overflow: What a full queue does with new events, one of the
+        OVERFLOW_* constants in L{pyia.dispatch}
+        @param process_id: Only events from this process, 0 for any
+        @type process_id: integer
+        @param thread_id: Only events from this thread, 0 for any
+        @type thread_id: integer
+        @param hwnd: Only events about this window, None for any
+        @type hwnd: integer
+        @param object_id: Only events about this object ID, None for any
+        @type object_id: integer
+        @param skip_own_process: Ignore events from this process
+        @type skip_own_process: boolean
+        @param skip_own_thread: Ignore events from this thread
+        @type skip_own_thread: boolean
+        '''
+        if dispatch == DISPATCH_POOL:
+            entry = self._queued.get(client)
+            if entry is None:
+                if self.worker_pool is None:
+                    self.worker_pool = WorkerPool(self.workers)
+                entry = QueuedListener(client, self.worker_pool, queue_size,
+                                       overflow, self._callClient)
+                self._queued[client] = entry
+        elif dispatch == DISPATCH_INLINE:
+            entry = client
+        else:
+            raise ValueError('Unknown dispatch policy: %s' % dispatch)
+        flags = constants.WINEVENT_OUTOFCONTEXT
+        if skip_own_process:
+            flags |= constants.WINEVENT_SKIPOWNPROCESS
+        if skip_own_thread:
+            flags |= constants.WINEVENT_SKIPOWNTHREAD
+        scope = (process_id, thread_id, flags)
+        table = self.clients.setdefault(scope, {})
+        item = (entry, hwnd, object_id)
         for event_type in event_types:
-            if (client, event_type) in self.clients:
+            clients = table.get(event_type, ())
+            if item in clients:
                 continue
-            hook_id = \
-                windll.user32.SetWinEventHook(
-                    event_type, event_type, 0, self._c_handleEvent, 0, 0, 
-                    constants.WINEVENT_OUTOFCONTEXT)
-            if hook_id:
-                self.clients[(client, event_type)] = hook_id
-            else:
-                print("Could not register callback for %s" % \
-                    constants.winEventIDsToEventNames.get(event_type, event_type))
+            # Tuples are replaced rather than mutated, so a dispatch in
+            # progress never sees the table change under it.
+            table[event_type] = clients + (item,)
+            self._ref(scope, event_type)
+        self._updateHooks()
 
     def deregisterEventListener(self, client, *event_types):
-        for event_type in event_types:
-            try:
-                windll.user32.UnhookWinEvent(
-                    self.clients[(client, event_type)])
-                del self.clients[(client, event_type)]
-            except KeyError:
-                pass
+        '''
+        Stops calling client for the given event types, whatever filters and
+        dispatch policies it was registered with.
+        '''
+        entry = self._queued.get(client, client)
+        for scope, table in list(self.clients.items()):
+            for event_type in event_types:
+                clients = table.get(event_type, ())
+                remaining = tuple(c for c in clients
+                                  if c[0] != client and c[0] != entry)
+                if len(remaining) == len(clients):
+                    continue
+                if remaining:
+                    table[event_type] = remaining
+                else:
+                    del table[event_type]
+                for i in range(len(clients) - len(remaining)):
+                    self._unref(scope, event_type)
+            if not table:
+                del self.clients[scope]
+        if entry is not client and not any(
+                c[0] is entry for table in self.clients.values()
+                for clients in table.values() for c in clients):
+            del self._queued[client]
+        self._updateHooks()
+
+    def listenerStats(self):
+        '''
+        @return: Queue depth, delivered and dropped counts of every pool
+        dispatched listener, keyed by listener
+        @rtype: dictionary
+        '''
+        return dict((client, entry.stats())
+                    for client, entry in list(self._queued.items()))
+
+    def enablePropertyCache(self, max_entries=4096):
+        '''
+        Turns on the shared property cache, hooking the events that
+        invalidate it.
+
+        @param max_entries: Most objects to cache properties for
+        @type max_entries: integer
+        @return: The cache
+        @rtype: L{PropertyCache}
+        '''
+        if self.property_cache is None:
+            self.property_cache = PropertyCache(max_entries)
+            for event_type in INVALIDATING_EVENTS:
+                self._ref(GLOBAL_SCOPE, event_type)
+            self._updateHooks()
+        return self.property_cache
+
+    def disablePropertyCache(self):
+        if self.property_cache is not None:
+            self.property_cache = None
+            for event_type in INVALIDATING_EVENTS:
+                self._unref(GLOBAL_SCOPE, event_type)
+            self._updateHooks()
+
+    def enableCoalescing(self, window=0.05, max_depth=256,
+                         event_types=COALESCED_EVENTS):
+        '''
+        Holds back bursts of the given event types, dispatching only the
+        latest event per (type, hwnd, object ID, child ID) after at most
+        window seconds, or once max_depth distinct events are pending.
+
+        @return: The coalescer, whose counters report suppressed events
+        @rtype: L{EventCoalescer}
+        '''
+        if self.coalescer is None:
+            self.coalescer = EventCoalescer(
+                self._dispatchEvent, window, max_depth, event_types)
+        return self.coalescer
+
+    def disableCoalescing(self):
+        '''
+        Dispatches any held back events and stops coalescing.
+        '''
+        coalescer, self.coalescer = self.coalescer, None
+        if coalescer is not None:
+            coalescer.flush()
+
+    def startRecording(self, path):
+        '''
+        Appends every event reaching the registry's hooks to path, for
+        L{pyia.recording.replayEvents}. Only event types something is
+        registered for are hooked, and so recorded.
+
+        @return: The recorder
+        @rtype: L{EventRecorder}
+        '''
+        self.stopRecording()
+        self.recorder = EventRecorder(path)
+        return self.recorder
+
+    def stopRecording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
 
     def clearListeners(self):
+        self.coalescer = None
+        self.clients.clear()
+        self._queued.clear()
+        self._hook_refs.clear()
+        self._recent_events.clear()
+        self.property_cache = None
+        self._updateHooks()
+
+    def iter_loop(self, timeout=1):
+        if self.coalescer is None:
+            getBackend().pumpEvents(timeout)
+            return
+        # Wake up at least once per coalescing window so held back events
+        # go out on time even when nothing else arrives.
+        deadline = time.time() + timeout
         while True:
-            try:
-                client_tuple, hook_id = self.clients.popitem()
-            except KeyError:
+            remaining = deadline - time.time()
+            if remaining <= 0:
                 break
-            else:
-                windll.user32.UnhookWinEvent(hook_id)
+            getBackend().pumpEvents(min(remaining, self.coalescer.window))
+            coalescer = self.coalescer
+            if coalescer is not None:
+                coalescer.flushExpired()
+        
+    def _unhookAll(self):
+        backend = getBackend()
+        for key in list(self.hooks):
+            self._unhook(backend, key)
+
+    def _pump(self, stop):
+        # run() has taken the hooks down; install them again on this thread,
+        # then pump until told to stop.
+        backend = getBackend()
+        backend.initThread()
+        try:
+            self._applyHooks()
+            try:
+                while not stop.is_set():
+                    self.iter_loop(self.pump_interval)
+                    if self._hooks_dirty:
+                        self._applyHooks()
+            finally:
+                self._unhookAll()
+        finally:
+            backend.uninitThread()
 
+    async def run(self):
+        '''
+        Runs the event feed alongside the calling asyncio loop until
+        L{stop} is called or the task is cancelled. Messages are pumped on a
+        dedicated thread, which owns the hooks while this runs and calls
+        regular listeners; coroutine listeners are scheduled on the loop.
+
+        Hooks installed before this is called are moved to that thread, which
+        only the thread that installed them can do, so call this from it.
+
+        @raise RuntimeError: The hooks were installed by another thread
+        '''
+        if self.hooks and self._hook_thread is not threading.current_thread():
+            raise RuntimeError('Event hooks were installed by %s; run() must '
+                               'be called from it' % self._hook_thread.name)
+        self._unhookAll()
+        if self.hooks:
+            raise RuntimeError('Could not remove the event hooks')
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._stopped = loop.create_future()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._pump, args=(stop,),
+                                  name='pyia-pump', daemon=True)
+        self._pump_thread = thread
+        thread.start()
+        try:
+            await self._stopped
+        finally:
+            stop.set()
+            await loop.run_in_executor(None, thread.join)
+            self._pump_thread = None
+            self._loop = None
+            self._stopped = None
+            # Hooks go back to the loop thread for start() or iter_loop().
+            self._applyHooks()
+
+    def stop(self):
+        '''
+        Ends a running L{run}. Safe to call from any thread.
+        '''
+        loop, stopped = self._loop, self._stopped
+        if loop is not None and stopped is not None:
+            loop.call_soon_threadsafe(
+                lambda: stopped.done() or stopped.set_result(None))
+
+    async def events(self, *event_types):
+        '''
+        Streams events of the given types to an async for loop::
+
+          async for event in Registry.events(EVENT_OBJECT_FOCUS):
+              ...
+
+        The underlying listener is deregistered when the loop ends.
+        '''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        def listener(event):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        self.registerEventListener(listener, *event_types)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.deregisterEventListener(listener, *event_types)
 
-    def iter_loop(self, timeout=1):
-        PumpEvents(timeout)
-        
     def start(self):
         while True:
             try:
@@ -0,0 +1,439 @@
+'''
+A small selector language for finding accessibles, compiled to matchers.
+
+Selectors look like CSS, with MSAA role names as element names and MSAA
+state names as pseudo-classes::
+
+  dialog > "push button"[name="OK"]:focusable
+
+matches focusable push buttons named OK that are children of a dialog. The
+parts are:
+
+  - A role name, quoted when it has spaces (C{"push button"}, or
+    C{push-button}), or C{*} for any role. Names that are not MSAA roles are
+    compared with string roles as found in Mozilla.
+  - Attribute tests on name, value, description, help, keyboardShortcut or
+    defaultAction: C{[name="OK"]}, C{!=}, C{^=} (starts with), C{$=} (ends
+    with), C{*=} (contains), C{~=} (regular expression search), or just
+    C{[name]} for a non empty value.
+  - State tests such as C{:focusable} or C{:not(invisible)}, with hyphens for
+    spaces (C{:read-only}).
+  - Combinators between parts: whitespace for any descendant, C{>} for a
+    child. A leading C{>} anchors the selector at the root of the search.
+
+Compiled selectors test role first, then state, then the string properties,
+stopping at the first failure, and fetch each property at most once per
+node. When a search walks the tree from the top, a selector keeps track of
+which of its parts the ancestors of each node matched, and skips subtrees it
+can no longer match in (those below a failed anchored or child step).
+
+The search functions in L{pyia.utils} take selector strings in place of
+predicates and compile them through L{compileSelector}, which caches them.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import functools
+import re
+from collections import deque
+from .constants import UNLOCALIZED_ROLE_NAMES, UNLOCALIZED_STATE_NAMES
+
+_ROLES = dict((name, role) for role, name in UNLOCALIZED_ROLE_NAMES.items())
+_STATES = dict((name, state) for state, name in UNLOCALIZED_STATE_NAMES.items())
+
+# Attribute names -> getters.
+_ATTRIBUTES = {
+    'name': 'accName',
+    'value': 'accValue',
+    'description': 'accDescription',
+    'help': 'accHelp',
+    'keyboardShortcut': 'accKeyboardShortcut',
+    'defaultAction': 'accDefaultAction'}
+# Getters in the order they are tested. All cost a round trip, but name is
+# the one most likely to rule a node out.
+_GETTER_ORDER = ('accName', 'accValue', 'accDescription', 'accHelp',
+                 'accKeyboardShortcut', 'accDefaultAction')
+
+# Compiled on first use, to keep it out of import time.
+_TOKEN = r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<ident>\w[\w-]*)
+  | (?P<op>[!^$*~]?=)
+  | (?P<punct>[>*\[\]:()])
+'''
+
+_OPERATORS = {
+    '=': lambda value, arg: value == arg,
+    '!=': lambda value, arg: value != arg,
+    '^=': lambda value, arg: value.startswith(arg),
+    '$=': lambda value, arg: value.endswith(arg),
+    '*=': lambda value, arg: arg in value,
+    '~=': lambda value, arg: arg.search(value) is not None}
+
+def _tokenize(text):
+    token = re.compile(_TOKEN, re.VERBOSE)
+    pos = 0
+    tokens = []
+    while pos < len(text):
+        m = token.match(text, pos)
+        if m is None:
+            raise ValueError('Unexpected %r at %d in selector %r' %
+                             (text[pos], pos, text))
+        kind = m.lastgroup
+        value = m.group()
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        tokens.append((kind, value, pos))
+        pos = m.end()
+    return tokens
+
+def _get(acc, getter, memo):
+    try:
+        return memo[getter]
+    except KeyError:
+        value = memo[getter] = getattr(acc, getter)()
+        return value
+
+class _Compound(object):
+    '''
+    One step of a selector: a role, state and attribute tests, all of which
+    a node has to pass.
+    '''
+    __slots__ = ('role', 'state_mask', 'state_value', 'tests')
+
+    def __init__(self):
+        self.role = None
+        self.state_mask = 0
+        self.state_value = 0
+        self.tests = []
+
+    def matches(self, acc, memo):
+        try:
+            if self.role is not None and \
+                    _get(acc, 'accRole', memo) != self.role:
+                return False
+            if self.state_mask and \
+                    _get(acc, 'accState', memo) & self.state_mask != \
+                    self.state_value:
+                return False
+            for getter, op, arg in self.tests:
+                value = _get(acc, getter, memo)
+                if op is None:
+                    if not value:
+                        return False
+                elif not _OPERATORS[op](value or '', arg):
+                    return False
+            return True
+        except Exception:
+            return False
+
+class _Parser(object):
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def error(self, message):
+        if self.pos < len(self.tokens):
+            where = 'at %d' % self.tokens[self.pos][2]
+        else:
+            where = 'at end'
+        return ValueError('%s %s in selector %r' % (message, where, self.text))
+
+    def peek(self, skip_space=True):
+        pos = self.pos
+        while skip_space and pos < len(self.tokens) and \
+                self.tokens[pos][0] == 'space':
+            pos += 1
+        if pos < len(self.tokens):
+            return self.tokens[pos]
+        return (None, None, len(self.text))
+
+    def take(self, skip_space=True):
+        while skip_space and self.pos < len(self.tokens) and \
+                self.tokens[self.pos][0] == 'space':
+            self.pos += 1
+        if self.pos >= len(self.tokens):
+            raise ValueError('Unexpected end of selector %r' % self.text)
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        kind, got, pos = self.take()
+        if got != value or kind == 'string':
+            self.pos -= 1
+            raise self.error('Expected %r' % value)
+
+    def parse(self):
+        compounds = []
+        child_steps = []
+        anchored = self.peek()[:2] == ('punct', '>')
+        if anchored:
+            self.take()
+        while True:
+            compounds.append(self.compound())
+            kind, value, pos = self.peek(skip_space=False)
+            if kind is None:
+                break
+            if self.peek()[0] is None:
+                # Trailing space.
+                break
+            if self.peek()[:2] == ('punct', '>'):
+                self.take()
+                child_steps.append(True)
+            elif kind == 'space':
+                child_steps.append(False)
+            else:
+                raise self.error('Unexpected %r' % value)
+        return compounds, child_steps, anchored
+
+    def compound(self):
+        compound = _Compound()
+        kind, value, pos = self.peek()
+        if kind in ('ident', 'string'):
+            self.take()
+            compound.role = _role(value)
+        elif value == '*' and kind == 'punct':
+            self.take()
+        elif value not in ('[', ':'):
+            raise self.error('Expected a role, attribute or state')
+        while True:
+            kind, value, pos = self.peek(skip_space=False)
+            if kind != 'punct':
+                break
+            if value == '[':
+                self.take()
+                compound.tests.append(self.attribute())
+            elif value == ':':
+                self.take()
+                self.state(compound)
+            else:
+                break
+        compound.tests.sort(key=lambda t: _GETTER_ORDER.index(t[0]))
+        return compound
+
+    def attribute(self):
+        kind, name, pos = self.take()
+        if kind != 'ident' or name not in _ATTRIBUTES:
+            self.pos -= 1
+            raise self.error('Unknown attribute %r' % name)
+        kind, value, pos = self.take()
+        if value == ']':
+            return (_ATTRIBUTES[name], None, None)
+        if kind != 'op':
+            self.pos -= 1
+            raise self.error('Expected an operator')
+        op = value
+        kind, arg, pos = self.take()
+        if kind not in ('string', 'ident'):
+            self.pos -= 1
+            raise self.error('Expected a value')
+        if op == '~=':
+            try:
+                arg = re.compile(arg)
+            except re.error as e:
+                raise self.error('Bad regular expression (%s)' % e)
+        self.expect(']')
+        return (_ATTRIBUTES[name], op, arg)
+
+    def state(self, compound):
+        kind, name, pos = self.take(skip_space=False)
+        negate = False
+        if kind == 'ident' and name == 'not' and \
+                self.peek(skip_space=False)[1] == '(':
+            self.take()
+            kind, name, pos = self.take()
+            negate = True
+        if kind != 'ident':
+            self.pos -= 1
+            raise self.error('Expected a state')
+        state = _STATES.get(name.replace('-', ' '))
+        if state is None:
+            self.pos -= 1
+            raise self.error('Unknown state %r' % name)
+        if negate:
+            self.expect(')')
+        compound.state_mask |= state
+        if not negate:
+            compound.state_value |= state
+
+def _role(name):
+    role = _ROLES.get(name)
+    if role is None:
+        role = _ROLES.get(name.replace('-', ' '), name)
+    return role
+
+def _parentOf(acc):
+    from .accessible import ManagedChildAccessible
+    from .backend import getBackend
+    if isinstance(acc, ManagedChildAccessible):
+        return acc.parent
+    try:
+        return acc.accParent.QueryInterface(getBackend().IAccessible)
+    except Exception:
+        return None
+
+class Selector(object):
+    '''
+    A compiled selector. Use L{iterMatches} to search a subtree with it, or
+    call it with an accessible to test that accessible alone, which looks
+    at ancestors through accParent as needed. A selector called directly
+    has no search root, so a leading C{>} is ignored then.
+
+    @ivar text: The selector's source
+    @type text: string
+    @ivar start: Steps the children of a search root may match, to pass to
+    L{step} or L{iterMatches}
+    '''
+    def __init__(self, text):
+        self.text = text
+        self._compounds, self._child_steps, self._anchored = \
+            _Parser(text).parse()
+        self._last = len(self._compounds) - 1
+        # Steps are (indices of parts that any descendant may match, indices
+        # of parts only the node itself may match).
+        if self._anchored:
+            self.start = (frozenset(), frozenset([0]))
+        else:
+            self.start = (frozenset([0]), frozenset())
+
+    def __repr__(self):
+        return 'Selector(%r)' % self.text
+
+    def __call__(self, acc):
+        return self._matchUp(acc, self._last)
+
+    def _matchUp(self, acc, index):
+        if not self._compounds[index].matches(acc, {}):
+            return False
+        if index == 0:
+            return True
+        parent = _parentOf(acc)
+        if self._child_steps[index - 1]:
+            return parent is not None and self._matchUp(parent, index - 1)
+        while parent is not None:
+            if self._matchUp(parent, index - 1):
+                return True
+            parent = _parentOf(parent)
+        return False
+
+    def step(self, acc, steps):
+        '''
+        Tests acc against the parts of the selector its ancestors allow.
+
+        @param steps: What acc may match, L{start} for the children of the
+        search root, otherwise as returned for the parent of acc
+        @return: Whether acc matches the whole selector, and the steps its
+        children may match, or None if they cannot match any more
+        @rtype: tuple
+        '''
+        sticky, direct = steps
+        memo = {}
+        matched = False
+        new_sticky = sticky
+        new_direct = set()
+        for index in sorted(sticky | direct):
+            if not self._compounds[index].matches(acc, memo):
+                continue
+            if index == self._last:
+                matched = True
+            elif self._child_steps[index]:
+                new_direct.add(index + 1)
+            else:
+                new_sticky = new_sticky | frozenset([index + 1])
+        if not new_sticky and not new_direct:
+            return matched, None
+        return matched, (new_sticky, frozenset(new_direct))
+
+    def iterMatches(self, acc, breadth_first=False, max_depth=None,
+                    limit=None, prune=None, steps=None):
+        '''
+        Generates the descendants of acc matching this selector. Takes the
+        same options as L{pyia.utils.iterDescendants}, which calls it for
+        selectors.
+
+        @param steps: What the children of acc may match, if acc is not the
+        root of the search (see L{step})
+        '''
+        if limit is not None and limit <= 0:
+            return
+        if steps is None:
+            steps = self.start
+        found = 0
+        if breadth_first:
+            queue = deque([(acc, 1, steps)])
+            while queue:
+                node, depth, steps = queue.popleft()
+                expand = max_depth is None or depth < max_depth
+                try:
+                    for child in node:
+                        if prune is not None and _prunes(prune, child):
+                            continue
+                        matched, child_steps = self.step(child, steps)
+                        if matched:
+                            yield child
+                            found += 1
+                            if found == limit:
+                                return
+                        if expand and child_steps is not None:
+                            queue.append((child, depth + 1, child_steps))
+                except Exception:
+                    pass
+            return
+        stack = [(iter(acc), 1, steps)]
+        while stack:
+            children, depth, steps = stack[-1]
+            try:
+                child = next(children)
+            except Exception:
+                stack.pop()
+                continue
+            if prune is not None and _prunes(prune, child):
+                continue
+            matched, child_steps = self.step(child, steps)
+            if matched:
+                yield child
+                found += 1
+                if found == limit:
+                    return
+            if child_steps is not None and \
+                    (max_depth is None or depth < max_depth):
+                stack.append((iter(child), depth + 1, child_steps))
+
+def _prunes(prune, acc):
+    try:
+        return prune(acc)
+    except Exception:
+        return False
+
+@functools.lru_cache(maxsize=256)
+def compileSelector(text):
+    '''
+    Compiles a selector, reusing the compiled form of recently used ones.
+
+    @param text: Selector source, see L{pyia.selector}
+    @type text: string
+    @return: The compiled selector
+    @rtype: L{Selector}
+    @raise ValueError: The selector does not parse
+    '''
+    return Selector(text)
@@ -0,0 +1,571 @@
+'''
+An in-memory MSAA implementation for profiling, load testing and
+benchmarking pyia off a Windows desktop.
+
+Trees are built out of L{SimulatedAccessible} objects, each of which may also
+carry simple (managed) children addressed by child ID, just like real
+IAccessible servers. Every call that would cross a process boundary on Windows
+is counted in L{SimulatedBackend.calls} and may be delayed by a configurable
+latency, so traversal and dispatch throughput can be measured at realistic
+cross-process call costs. Synthetic WinEvents are delivered to hooks installed
+through the usual L{SimulatedBackend.setWinEventHook} call.
+
+Example::
+
+  backend = pyia.setBackend(SimulatedBackend(latency=0.0001))
+  app = backend.createWindow(name='Editor', pid=42)
+  backend.buildTree(app, width=10, depth=3)
+  backend.fireEvent(EVENT_OBJECT_FOCUS, app.hwnd, OBJID_CLIENT)
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import collections
+import os
+import random
+import threading
+import time
+import traceback
+from .backend import Backend
+from .constants import CHILDID_SELF, OBJID_WINDOW, OBJID_CLIENT, \
+    ROLE_SYSTEM_WINDOW, ROLE_SYSTEM_CLIENT, ROLE_SYSTEM_LISTITEM, \
+    STATE_SYSTEM_FOCUSED, STATE_SYSTEM_SELECTED, \
+    NAVDIR_NEXT, NAVDIR_PREVIOUS, NAVDIR_FIRSTCHILD, NAVDIR_LASTCHILD, \
+    WINEVENT_SKIPOWNPROCESS, WINEVENT_SKIPOWNTHREAD, \
+    UNLOCALIZED_ROLE_NAMES, UNLOCALIZED_STATE_NAMES
+
+class SimulatedCOMError(Exception):
+    '''
+    Raised by simulated calls that would fail with a COMError on Windows,
+    such as calls on destroyed objects or unknown child IDs.
+    '''
+    pass
+
+_DEFAULT_PROPERTIES = {
+    'name': None,
+    'value': None,
+    'description': None,
+    'role': ROLE_SYSTEM_CLIENT,
+    'state': 0,
+    'help': None,
+    'helpTopic': None,
+    'keyboardShortcut': None,
+    'defaultAction': None,
+    'location': (0, 0, 0, 0)}
+
+class SimulatedAccessible(object):
+    '''
+    A simulated IAccessible object. Property getters take an optional child
+    ID like their COM counterparts and address either the object itself
+    (CHILDID_SELF) or one of its simple children.
+    '''
+    def __init__(self, backend, **props):
+        self._backend = backend
+        self._parent = None
+        self._children = []
+        self._props = {CHILDID_SELF: self._makeProps(props)}
+        self._next_child_id = 1
+        self._dead = False
+        self.hwnd = None
+        self.object_id = None
+
+    @staticmethod
+    def _makeProps(props):
+        rv = dict(_DEFAULT_PROPERTIES)
+        for name in props:
+            if name not in rv:
+                raise TypeError('Unknown property: %s' % name)
+        rv.update(props)
+        return rv
+
+    def _get(self, method, child_id, prop):
+        self._backend._roundTrip(method, self.hwnd)
+        if self._dead:
+            raise SimulatedCOMError('Object is disconnected')
+        try:
+            return self._props[child_id][prop]
+        except KeyError:
+            raise SimulatedCOMError('Invalid child ID: %r' % child_id)
+
+    def QueryInterface(self, interface):
+        self._backend._roundTrip('QueryInterface', self.hwnd)
+        if self._dead:
+            raise SimulatedCOMError('Object is disconnected')
+        return self
+
+    def _get_accParent(self):
+        self._backend._roundTrip('accParent', self.hwnd)
+        if self._dead:
+            raise SimulatedCOMError('Object is disconnected')
+        return self._parent
+    accParent = property(_get_accParent)
+
+    def _get_accChildCount(self):
+        self._backend._roundTrip('accChildCount', self.hwnd)
+        if self._dead:
+            raise SimulatedCOMError('Object is disconnected')
+        return len(self._children)
+    accChildCount = property(_get_accChildCount)
+
+    def _get_accFocus(self):
+        self._backend._roundTrip('accFocus', self.hwnd)
+        for child in self._children:
+            if self._childState(child) & STATE_SYSTEM_FOCUSED:
+                return child
+        return None
+    accFocus = property(_get_accFocus)
+
+    def _get_accSelection(self):
+        self._backend._roundTrip('accSelection', self.hwnd)
+        return [child for child in self._children
+                if self._childState(child) & STATE_SYSTEM_SELECTED]
+    accSelection = property(_get_accSelection)
+
+    def _childState(self, child):
+        if isinstance(child, int):
+            return self._props[child]['state']
+        return child._props[CHILDID_SELF]['state']
+
+    def accChild(self, child_id):
+        self._backend._roundTrip('accChild', self.hwnd)
+        if child_id in self._props and child_id != CHILDID_SELF:
+            return None
+        raise SimulatedCOMError('Invalid child ID: %r' % child_id)
+
+    def accName(self, child_id=CHILDID_SELF):
+        return self._get('accName', child_id, 'name')
+
+    def accValue(self, child_id=CHILDID_SELF):
+        return self._get('accValue', child_id, 'value')
+
+    def accDescription(self, child_id=CHILDID_SELF):
+        return self._get('accDescription', child_id, 'description')
+
+    def accRole(self, child_id=CHILDID_SELF):
+        return self._get('accRole', child_id, 'role')
+
+    def accState(self, child_id=CHILDID_SELF):
+        return self._get('accState', child_id, 'state')
+
+    def accHelp(self, child_id=CHILDID_SELF):
+        return self._get('accHelp', child_id, 'help')
+
+    def accHelpTopic(self, child_id=CHILDID_SELF):
+        return self._get('accHelpTopic', child_id, 'helpTopic')
+
+    def accKeyboardShortcut(self, child_id=CHILDID_SELF):
+        return self._get('accKeyboardShortcut', child_id, 'keyboardShortcut')
+
+    def accDefaultAction(self, child_id=CHILDID_SELF):
+        return self._get('accDefaultAction', child_id, 'defaultAction')
+
+    def accLocation(self, child_id=CHILDID_SELF):
+        return self._get('accLocation', child_id, 'location')
+
+    def accSelect(self, flags, child_id=CHILDID_SELF):
+        self._get('accSelect', child_id, 'state')
+
+    def accDoDefaultAction(self, child_id=CHILDID_SELF):
+        self._get('accDoDefaultAction', child_id, 'defaultAction')
+
+    def accNavigate(self, direction, start=CHILDID_SELF):
+        self._backend._roundTrip('accNavigate', self.hwnd)
+        if direction == NAVDIR_FIRSTCHILD and start == CHILDID_SELF:
+            return self._children[0] if self._children else None
+        elif direction == NAVDIR_LASTCHILD and start == CHILDID_SELF:
+            return self._children[-1] if self._children else None
+        elif direction in (NAVDIR_NEXT, NAVDIR_PREVIOUS):
+            if start == CHILDID_SELF:
+                if self._parent is None:
+                    return None
+                siblings = self._parent._children
+                item = self
+            else:
+                siblings = self._children
+                item = start
+            try:
+                i = siblings.index(item)
+            except ValueError:
+                return None
+            i += direction == NAVDIR_NEXT and 1 or -1
+            if 0 <= i < len(siblings):
+                return siblings[i]
+        return None
+
+    def accHitTest(self, x, y):
+        self._backend._roundTrip('accHitTest', self.hwnd)
+        if self._dead:
+            raise SimulatedCOMError('Object is disconnected')
+        for child in reversed(self._children):
+            if isinstance(child, int):
+                rect = self._props[child]['location']
+            else:
+                rect = child._props[CHILDID_SELF]['location']
+            left, top, width, height = rect
+            if left <= x < left + width and top <= y < top + height:
+                return child
+        left, top, width, height = self._props[CHILDID_SELF]['location']
+        if left <= x < left + width and top <= y < top + height:
+            return CHILDID_SELF
+        return None
+
+    def setProperties(self, child_id=CHILDID_SELF, **props):
+        '''
+        Changes properties of this object or one of its simple children
+        without any round trip. No event is fired; use
+        L{SimulatedBackend.fireEvent} for that.
+        '''
+        for name in props:
+            if name not in _DEFAULT_PROPERTIES:
+                raise TypeError('Unknown property: %s' % name)
+        self._props[child_id].update(props)
+
+    def addSimpleChild(self, **props):
+        '''
+        Adds a simple child element, addressed through this object.
+
+        @return: The new child ID
+        @rtype: integer
+        '''
+        child_id = self._next_child_id
+        self._next_child_id += 1
+        self._props[child_id] = self._makeProps(props)
+        self._children.append(child_id)
+        return child_id
+
+    def remove(self):
+        '''
+        Detaches this object from its parent and disconnects it and all its
+        descendants, so subsequent calls on them fail.
+        '''
+        if self._parent is not None:
+            self._parent._children.remove(self)
+            self._parent = None
+        self._backend._unregister(self)
+
+class SimulatedBackend(Backend):
+    '''
+    Backend serving a tree of L{SimulatedAccessible} objects.
+
+    @ivar latency: Seconds every simulated round trip takes
+    @type latency: float
+    @ivar method_latency: Per-call latency overrides, keyed by method name
+    @type method_latency: dictionary
+    @ivar process_latency: Latency added to every call into a process, keyed
+    by process ID, to stand in for slow or hung applications
+    @type process_latency: dictionary
+    @ivar calls: Number of round trips made, keyed by method name
+    @type calls: collections.Counter
+    '''
+    name = 'simulated'
+    IAccessible = SimulatedAccessible
+    COMError = SimulatedCOMError
+
+    def __init__(self, latency=0.0, method_latency=None,
+                 process_latency=None):
+        self.latency = latency
+        self.method_latency = dict(method_latency or {})
+        self.process_latency = dict(process_latency or {})
+        self.calls = collections.Counter()
+        self._windows = {}
+        # Child window -> parent window.
+        self._window_parents = {}
+        self._objects = {}
+        self._hooks = {}
+        # Hook ID -> ident of the thread that installed it.
+        self._hook_threads = {}
+        self._next_hwnd = 0x10000
+        self._next_object_id = 1
+        self._next_hook_id = 1
+        self._queue = collections.deque()
+        self._queue_cond = threading.Condition()
+        self._start_time = time.time()
+        self.desktop_hwnd = self._newWindow(os.getpid(), 0)
+        self.desktop = SimulatedAccessible(
+            self, name='Desktop', role=ROLE_SYSTEM_WINDOW)
+        self.desktop.hwnd = self.desktop_hwnd
+        self.desktop.object_id = OBJID_WINDOW
+        self.desktop_client = self.createAccessible(
+            self.desktop, name='Desktop', role=ROLE_SYSTEM_CLIENT)
+        self._objects[(self.desktop_hwnd, OBJID_WINDOW)] = self.desktop
+        self._objects[(self.desktop_hwnd, OBJID_CLIENT)] = self.desktop_client
+        self.foreground_hwnd = self.desktop_hwnd
+
+    def _roundTrip(self, method, hwnd=None):
+        self.calls[method] += 1
+        delay = self.method_latency.get(method, self.latency)
+        if hwnd is not None and self.process_latency:
+            pid = self._windows.get(hwnd, (0, 0))[0]
+            delay += self.process_latency.get(pid, 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def resetCalls(self):
+        '''
+        Clears the round trip counters.
+        '''
+        self.calls.clear()
+
+    def _newWindow(self, pid, tid):
+        hwnd = self._next_hwnd
+        self._next_hwnd += 4
+        self._windows[hwnd] = (pid, tid)
+        return hwnd
+
+    def _register(self, acc, parent):
+        acc._parent = parent
+        acc.hwnd = parent.hwnd
+        acc.object_id = self._next_object_id
+        self._next_object_id += 1
+        self._objects[(acc.hwnd, acc.object_id)] = acc
+        parent._children.append(acc)
+
+    def _unregister(self, acc):
+        stack = [acc]
+        while stack:
+            node = stack.pop()
+            node._dead = True
+            self._objects.pop((node.hwnd, node.object_id), None)
+            if node.object_id == OBJID_CLIENT:
+                self._objects.pop((node.hwnd, OBJID_WINDOW), None)
+                self._windows.pop(node.hwnd, None)
+                self._window_parents.pop(node.hwnd, None)
+            stack.extend(c for c in node._children if not isinstance(c, int))
+
+    def createAccessible(self, parent, **props):
+        '''
+        Creates an object as the last child of parent, in parent's window.
+
+        @return: The new object
+        @rtype: L{SimulatedAccessible}
+        '''
+        acc = SimulatedAccessible(self, **props)
+        self._register(acc, parent)
+        return acc
+
+    def createWindow(self, parent=None, pid=1, tid=1, **props):
+        '''
+        Creates a new window with its own hwnd, owned by the given process and
+        thread. Top level windows are parented to the desktop client.
+
+        @return: The client object of the new window
+        @rtype: L{SimulatedAccessible}
+        '''
+        acc = SimulatedAccessible(self, **props)
+        acc.hwnd = self._newWindow(pid, tid)
+        if parent is None:
+            parent = self.desktop_client
+        else:
+            self._window_parents[acc.hwnd] = parent.hwnd
+        acc._parent = parent
+        parent._children.append(acc)
+        acc.object_id = OBJID_CLIENT
+        self._objects[(acc.hwnd, OBJID_WINDOW)] = acc
+        self._objects[(acc.hwnd, OBJID_CLIENT)] = acc
+        return acc
+
+    def buildTree(self, parent, width, depth, simple_leaves=False,
+                  role=ROLE_SYSTEM_LISTITEM, **props):
+        '''
+        Populates parent with a uniform tree, width children per node and
+        depth levels deep. A wide tree is buildTree(p, n, 1), a deep one
+        buildTree(p, 1, n). Nodes are named after their path, such as
+        'item 0.3.1'.
+
+        @param simple_leaves: Make the last level simple children
+        @type simple_leaves: boolean
+        @return: Number of nodes created
+        @rtype: integer
+        '''
+        count = 0
+        level = [(parent, 'item ')]
+        for d in range(depth):
+            last = d == depth - 1
+            next_level = []
+            for node, prefix in level:
+                for i in range(width):
+                    name = '%s%d' % (prefix, i)
+                    if last and simple_leaves:
+                        node.addSimpleChild(name=name, role=role, **props)
+                    else:
+                        child = self.createAccessible(
+                            node, name=name, role=role, **props)
+                        next_level.append((child, name + '.'))
+                    count += 1
+            level = next_level
+        return count
+
+    def accessibleChildren(self, acc, start, count):
+        self._roundTrip('AccessibleChildren', acc.hwnd)
+        if acc._dead:
+            return []
+        return acc._children[start:start + count]
+
+    def accessibleObjectFromWindow(self, hwnd, object_id=OBJID_WINDOW):
+        self._roundTrip('AccessibleObjectFromWindow', hwnd)
+        return self._objects.get((hwnd, object_id))
+
+    def accessibleObjectFromEvent(self, hwnd, object_id, child_id):
+        self._roundTrip('AccessibleObjectFromEvent', hwnd)
+        acc = self._objects.get((hwnd, object_id))
+        if acc is None or child_id not in acc._props:
+            return None
+        return acc, child_id
+
+    def windowFromAccessibleObject(self, acc):
+        self._roundTrip('WindowFromAccessibleObject',
+                        getattr(acc, 'hwnd', None))
+        return getattr(acc, 'hwnd', None) or 0
+
+    def getWindowThreadProcessID(self, hwnd):
+        return self._windows.get(hwnd, (0, 0))
+
+    def getDesktopWindow(self):
+        return self.desktop_hwnd
+
+    def getForegroundWindow(self):
+        return self.foreground_hwnd
+
+    def isWindow(self, hwnd):
+        return hwnd in self._windows
+
+    def isChildWindow(self, parent, hwnd):
+        hwnd = self._window_parents.get(hwnd)
+        while hwnd is not None:
+            if hwnd == parent:
+                return True
+            hwnd = self._window_parents.get(hwnd)
+        return False
+
+    def getRoleText(self, role):
+        self._roundTrip('GetRoleTextW')
+        return UNLOCALIZED_ROLE_NAMES.get(role, 'unknown object')
+
+    def getStateText(self, state_bit):
+        self._roundTrip('GetStateTextW')
+        return UNLOCALIZED_STATE_NAMES.get(state_bit, '')
+
+    def setWinEventHook(self, event_min, event_max, callback,
+                        process_id=0, thread_id=0, flags=0):
+        hook_id = self._next_hook_id
+        self._next_hook_id += 1
+        self._hooks[hook_id] = \
+            (event_min, event_max, callback, process_id, thread_id, flags)
+        self._hook_threads[hook_id] = threading.get_ident()
+        return hook_id
+
+    def unhookWinEvent(self, hook_id):
+        # As with UnhookWinEvent, only the installing thread may remove a
+        # hook.
+        if self._hook_threads.get(hook_id) != threading.get_ident():
+            return False
+        del self._hook_threads[hook_id]
+        del self._hooks[hook_id]
+        return True
+
+    def fireEvent(self, event_type, hwnd, object_id=OBJID_CLIENT,
+                  child_id=CHILDID_SELF, thread_id=None, timestamp=None):
+        '''
+        Synchronously delivers an event to every hook interested in it, the
+        way an out of context hook would see it while pumping messages.
+        '''
+        pid, tid = self._windows.get(hwnd, (0, 0))
+        if thread_id is None:
+            thread_id = tid
+        if timestamp is None:
+            timestamp = int((time.time() - self._start_time) * 1000)
+        for hook_id, hook in list(self._hooks.items()):
+            event_min, event_max, callback, hook_pid, hook_tid, flags = hook
+            if not event_min <= event_type <= event_max:
+                continue
+            if hook_pid and hook_pid != pid:
+                continue
+            if hook_tid and hook_tid != thread_id:
+                continue
+            if flags & WINEVENT_SKIPOWNPROCESS and pid == os.getpid():
+                continue
+            if flags & WINEVENT_SKIPOWNTHREAD and pid == os.getpid() and \
+                    thread_id == threading.get_ident():
+                continue
+            try:
+                callback(hook_id, event_type, hwnd, object_id, child_id,
+                         thread_id, timestamp)
+            except Exception:
+                traceback.print_exc()
+
+    def fireEvents(self, events):
+        '''
+        Delivers a sequence of (event_type, hwnd, object_id, child_id) tuples.
+
+        @return: Number of events delivered
+        @rtype: integer
+        '''
+        n = 0
+        for event in events:
+            self.fireEvent(*event)
+            n += 1
+        return n
+
+    def postEvent(self, event_type, hwnd, object_id=OBJID_CLIENT,
+                  child_id=CHILDID_SELF, thread_id=None, timestamp=None):
+        '''
+        Queues an event for delivery by the next L{pumpEvents} call. Safe to
+        call from any thread.
+        '''
+        with self._queue_cond:
+            self._queue.append(
+                (event_type, hwnd, object_id, child_id, thread_id, timestamp))
+            self._queue_cond.notify()
+
+    def pumpEvents(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            with self._queue_cond:
+                while not self._queue:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self._queue_cond.wait(remaining)
+                event = self._queue.popleft()
+            self.fireEvent(*event)
+
+    def eventStorm(self, count, event_types, objects=None, seed=None):
+        '''
+        Generates random events about registered objects, suitable for
+        L{fireEvents} or L{postEvent}.
+
+        @param count: Number of events to generate
+        @type count: integer
+        @param event_types: Event types to pick from
+        @type event_types: sequence
+        @param objects: Objects to pick event sources from, all registered
+        ones by default
+        @type objects: sequence
+        @param seed: Random seed, for reproducible storms
+        @return: Generator of (event_type, hwnd, object_id, child_id) tuples
+        @rtype: generator
+        '''
+        rand = random.Random(seed)
+        if objects is None:
+            objects = list(self._objects.values())
+        targets = [(acc.hwnd, acc.object_id) for acc in objects]
+        for i in range(count):
+            hwnd, object_id = rand.choice(targets)
+            yield (rand.choice(event_types), hwnd, object_id, CHILDID_SELF)
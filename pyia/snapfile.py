@@ -0,0 +1,264 @@
+'''
+A columnar file format for snapshots, read through a memory map.
+
+L{writeSnapshot} stores a L{pyia.snapshot.Snapshot} as a header, a section
+table and one section per array, each 8 byte aligned and little endian:
+
+  - parent, first_child, next_sibling, child_count (int32, -1 for none):
+    the tree. Nodes are stored breadth first, so the children of a node are
+    first_child .. first_child + child_count - 1.
+  - child_id (int32): child IDs of simple children, 0 for full objects.
+  - role (int32), state (int64), location (int32, 4 per node: left, top,
+    width, height) and one int32 column of string table indices (-1 for
+    None) per string property, for the properties that were captured.
+    String roles are stored as -1 - their string table index.
+  - string_offsets (int64, one more than there are strings) and
+    string_data (UTF-8): the deduplicated string table.
+
+L{openSnapshot} maps a file and wraps the sections in memoryviews without
+copying or decoding anything; strings are decoded when read. The result is a
+L{MappedSnapshot}, which answers everything a Snapshot does, and hands out
+zero-copy NumPy arrays of the columns when NumPy is installed.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import mmap
+import struct
+import sys
+from array import array
+from .snapshot import Snapshot, PROPERTY_GETTERS
+
+MAGIC = b'PYIASN01'
+# Magic, node count, string count, section count.
+HEADER = struct.Struct('<8sQQI')
+# Name, offset, length in bytes.
+SECTION = struct.Struct('<24sQQ')
+
+def _typecode(name):
+    if name in ('state', 'string_offsets'):
+        return 'q'
+    if name == 'string_data':
+        return 'B'
+    return 'i'
+
+def _littleEndian(a):
+    if sys.byteorder == 'big' and a.itemsize > 1:
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a
+
+def writeSnapshot(snapshot, path):
+    '''
+    Saves a snapshot in the columnar format.
+
+    @param snapshot: The snapshot to save
+    @type snapshot: L{pyia.snapshot.Snapshot}
+    @param path: File to write
+    @type path: string
+    '''
+    n = len(snapshot)
+    first_child = array('i', [-1]) * n
+    next_sibling = array('i', [-1]) * n
+    child_count = array('i', snapshot._child_count)
+    for index in range(n):
+        children = snapshot.children(index)
+        if children:
+            first_child[index] = children[0]
+            for child in children[:-1]:
+                next_sibling[child] = child + 1
+    sections = [
+        ('parent', array('i', snapshot._parents)),
+        ('first_child', first_child),
+        ('next_sibling', next_sibling),
+        ('child_count', child_count),
+        ('child_id', array('i', snapshot._child_ids))]
+    for prop in snapshot.properties:
+        sections.append((prop, array(_typecode(prop),
+                                     snapshot._columns[prop])))
+    data = [s.encode('utf-8', 'surrogatepass') for s in snapshot._strings]
+    offsets = array('q', [0])
+    total = 0
+    for s in data:
+        total += len(s)
+        offsets.append(total)
+    sections.append(('string_offsets', offsets))
+    sections.append(('string_data', array('B', b''.join(data))))
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, values in sections:
+        offset = (offset + 7) & ~7
+        size = len(values) * values.itemsize
+        table.append((name, offset, size))
+        offset += size
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, n, len(data), len(sections)))
+        for name, offset, size in table:
+            f.write(SECTION.pack(name.encode('ascii'), offset, size))
+        for (name, offset, size), (_, values) in zip(table, sections):
+            f.write(b'\0' * (offset - f.tell()))
+            _littleEndian(values).tofile(f)
+
+class _StringTable(object):
+    '''
+    Decodes strings out of the mapped table as they are asked for.
+    '''
+    __slots__ = ('_offsets', '_data')
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start = self._offsets[index]
+        return str(self._data[start:self._offsets[index + 1]], 'utf-8',
+                   'surrogatepass')
+
+class MappedSnapshot(Snapshot):
+    '''
+    A snapshot read straight out of a mapped file. Close it, or use it in a
+    with statement, to unmap the file; nodes must not be used after that,
+    though arrays from L{array} can be.
+    '''
+    __slots__ = ('path', '_file', '_mmap', '_sections', '_views')
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self):
+        magic, n, string_count, section_count = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a pyia snapshot file' % self.path)
+        self._sections = {}
+        names = []
+        for i in range(section_count):
+            name, offset, size = SECTION.unpack_from(
+                self._mmap, HEADER.size + i * SECTION.size)
+            name = name.rstrip(b'\0').decode('ascii')
+            self._sections[name] = (offset, size)
+            names.append(name)
+        self._views = []
+        views = dict((name, self._view(name)) for name in names)
+        properties = tuple(name for name in names
+                           if name in PROPERTY_GETTERS)
+        Snapshot.__init__(
+            self, properties, views['parent'], views['first_child'],
+            views['child_count'], views['child_id'],
+            dict((prop, views[prop]) for prop in properties),
+            _StringTable(views['string_offsets'], views['string_data']))
+
+    def _view(self, name, owned=True):
+        # Owned views are released by close(); the others keep the map
+        # alive for as long as they are used.
+        offset, size = self._sections[name]
+        raw = memoryview(self._mmap)[offset:offset + size]
+        if owned:
+            self._views.append(raw)
+        typecode = _typecode(name)
+        if sys.byteorder == 'big' and typecode != 'B':
+            # No zero-copy view for foreign byte order.
+            values = array(typecode, raw)
+            values.byteswap()
+            return values
+        view = raw.cast(typecode)
+        if owned:
+            self._views.append(view)
+        return view
+
+    def array(self, name):
+        '''
+        Returns a section as a NumPy array sharing memory with the map, or
+        as a memoryview when NumPy is not installed. Locations come as an
+        (n, 4) array. The array stays usable after L{close}, keeping the
+        file mapped until it goes away.
+
+        @param name: A section name, such as 'parent', 'role' or 'name'
+        @type name: string
+        @raise KeyError: The file has no such section
+        '''
+        try:
+            import numpy
+        except ImportError:
+            return self._view(name, False)
+        offset, size = self._sections[name]
+        dtype = numpy.dtype(_typecode(name)).newbyteorder('<')
+        values = numpy.frombuffer(self._mmap, dtype, size // dtype.itemsize,
+                                  offset)
+        if name == 'location':
+            values = values.reshape(-1, 4)
+        return values
+
+    def close(self):
+        '''
+        Releases the snapshot's views of the file and unmaps it. While arrays
+        from L{array} or views made from them are still alive, the map cannot
+        be closed; it is then left to be unmapped once the last of them goes
+        away.
+        '''
+        views, self._views = getattr(self, '_views', ()), []
+        for view in reversed(views):
+            try:
+                view.release()
+            except BufferError:
+                pass
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Exported; unmapped when the exports and this reference
+                # are gone.
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def openSnapshot(path):
+    '''
+    Maps a file written by L{writeSnapshot}.
+
+    @return: The snapshot, backed by the file
+    @rtype: L{MappedSnapshot}
+    @raise ValueError: The file is not a snapshot file
+    '''
+    return MappedSnapshot(path)
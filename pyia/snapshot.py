@@ -0,0 +1,337 @@
+'''
+Immutable, array backed snapshots of accessible subtrees.
+
+A snapshot is taken in a single walk over the live tree, fetching only the
+requested properties for every node. Nodes are stored breadth first in flat
+arrays, so the children of a node occupy a contiguous index range, and all
+strings are interned in one table. Once taken, a snapshot never calls back
+into the application it was taken from.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+from array import array
+from collections import deque
+from .backend import getBackend
+from .constants import CHILDID_SELF, UNLOCALIZED_ROLE_NAMES
+from .stateset import StateSet
+
+# Properties a snapshot can hold, and the IAccessible getters they come from.
+PROPERTY_GETTERS = {
+    'name': 'accName',
+    'value': 'accValue',
+    'description': 'accDescription',
+    'role': 'accRole',
+    'state': 'accState',
+    'help': 'accHelp',
+    'keyboardShortcut': 'accKeyboardShortcut',
+    'defaultAction': 'accDefaultAction',
+    'location': 'accLocation'}
+
+DEFAULT_PROPERTIES = ('name', 'role', 'state', 'location')
+
+# String valued properties are stored as string table indices, -1 for None.
+_STRING_PROPERTIES = frozenset(
+    ['name', 'value', 'description', 'help', 'keyboardShortcut',
+     'defaultAction'])
+
+class Snapshot(object):
+    '''
+    A captured subtree. Node 0 is the root; use L{node} for an
+    accessible-like view of any node.
+    '''
+    __slots__ = ('properties', '_parents', '_child_start', '_child_count',
+                 '_child_ids', '_columns', '_strings', '_hashes')
+
+    def __init__(self, properties, parents, child_start, child_count,
+                 child_ids, columns, strings):
+        self.properties = properties
+        self._parents = parents
+        self._child_start = child_start
+        self._child_count = child_count
+        self._child_ids = child_ids
+        self._columns = columns
+        self._strings = strings
+        self._hashes = None
+
+    def __len__(self):
+        return len(self._parents)
+
+    def parent(self, index):
+        '''
+        @return: Index of the parent node, or -1 for the root
+        @rtype: integer
+        '''
+        return self._parents[index]
+
+    def children(self, index):
+        '''
+        @return: Indices of the children of the node
+        @rtype: range
+        '''
+        start = self._child_start[index]
+        return range(start, start + self._child_count[index])
+
+    def childID(self, index):
+        '''
+        @return: The child ID of a simple child, or CHILDID_SELF for nodes
+        that are full accessible objects
+        @rtype: integer
+        '''
+        return self._child_ids[index]
+
+    def get(self, index, prop):
+        '''
+        @param prop: One of the properties the snapshot was taken with
+        @type prop: string
+        @return: Value of prop for the node
+        @raise KeyError: prop was not captured
+        '''
+        column = self._columns[prop]
+        if prop in _STRING_PROPERTIES:
+            i = column[index]
+            if i < 0:
+                return None
+            return self._strings[i]
+        elif prop == 'role':
+            role = column[index]
+            if role < 0:
+                # String roles are stored as negative string table indices.
+                return self._strings[-role - 1]
+            return role
+        elif prop == 'location':
+            return tuple(column[index * 4:index * 4 + 4])
+        return column[index]
+
+    def subtreeHash(self, index):
+        '''
+        @return: Hash of the properties of the node and everything below it,
+        equal for subtrees that look the same. Computed for all nodes on
+        first use.
+        @rtype: integer
+        '''
+        hashes = self._hashes
+        if hashes is None:
+            hashes = self._hashes = self._subtreeHashes()
+        return hashes[index]
+
+    def _subtreeHashes(self):
+        properties = self.properties
+        hashes = [0] * len(self._parents)
+        # Children always come after their parent, so going backwards every
+        # child is done before its parent.
+        for index in range(len(hashes) - 1, -1, -1):
+            start = self._child_start[index]
+            hashes[index] = hash((
+                tuple(self.get(index, prop) for prop in properties),
+                tuple(hashes[start:start + self._child_count[index]])))
+        return hashes
+
+    def node(self, index=0):
+        '''
+        @return: View of the node that answers the usual accessible methods
+        @rtype: L{SnapshotNode}
+        '''
+        return SnapshotNode(self, index)
+
+    @property
+    def root(self):
+        return SnapshotNode(self, 0)
+
+class SnapshotNode(object):
+    '''
+    Read only view of one snapshot node, answering the subset of the
+    IAccessible interface a snapshot can, so search predicates and
+    L{pyia.utils} functions work on snapshots unchanged.
+    '''
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotNode) and \
+            self.snapshot is other.snapshot and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.snapshot), self.index))
+
+    def _get(self, prop, child_id):
+        if child_id != CHILDID_SELF:
+            raise ValueError('Snapshot nodes only answer for themselves')
+        return self.snapshot.get(self.index, prop)
+
+    def accName(self, child_id=CHILDID_SELF):
+        return self._get('name', child_id)
+
+    def accValue(self, child_id=CHILDID_SELF):
+        return self._get('value', child_id)
+
+    def accDescription(self, child_id=CHILDID_SELF):
+        return self._get('description', child_id)
+
+    def accRole(self, child_id=CHILDID_SELF):
+        return self._get('role', child_id)
+
+    def accState(self, child_id=CHILDID_SELF):
+        return self._get('state', child_id)
+
+    def accHelp(self, child_id=CHILDID_SELF):
+        return self._get('help', child_id)
+
+    def accKeyboardShortcut(self, child_id=CHILDID_SELF):
+        return self._get('keyboardShortcut', child_id)
+
+    def accDefaultAction(self, child_id=CHILDID_SELF):
+        return self._get('defaultAction', child_id)
+
+    def accLocation(self, child_id=CHILDID_SELF):
+        return self._get('location', child_id)
+
+    def accRoleName(self, child_id=CHILDID_SELF):
+        role = self.accRole(child_id)
+        if not isinstance(role, int):
+            return role
+        return UNLOCALIZED_ROLE_NAMES.get(role, 'unknown')
+
+    def accStateSet(self, child_id=CHILDID_SELF):
+        return StateSet(self.accState(child_id))
+
+    @property
+    def childID(self):
+        return self.snapshot.childID(self.index)
+
+    @property
+    def accParent(self):
+        parent = self.snapshot.parent(self.index)
+        if parent < 0:
+            return None
+        return SnapshotNode(self.snapshot, parent)
+
+    @property
+    def accChildCount(self):
+        return self.snapshot._child_count[self.index]
+
+    def QueryInterface(self, interface):
+        return self
+
+    def __len__(self):
+        return self.accChildCount
+
+    def __bool__(self):
+        return True
+
+    def __iter__(self):
+        snapshot = self.snapshot
+        for i in snapshot.children(self.index):
+            yield SnapshotNode(snapshot, i)
+
+    def __getitem__(self, index):
+        children = self.snapshot.children(self.index)
+        return SnapshotNode(self.snapshot, children[index])
+
+    def __str__(self):
+        try:
+            return '[%s | %s]' % (self.accRoleName(), self.accName() or '')
+        except KeyError:
+            return '[node %d]' % self.index
+
+def snapshotSubtree(acc, properties=DEFAULT_PROPERTIES, max_depth=None):
+    '''
+    Captures the subtree rooted at acc in one breadth first walk, fetching
+    each of the requested properties once per node. Simple children are
+    resolved through their parent in the same pass. Properties that fail to
+    be fetched are stored as None (or 0 for role and state).
+
+    @param acc: Root of the subtree
+    @type acc: IAccessible
+    @param properties: Properties to capture, keys of L{PROPERTY_GETTERS}
+    @type properties: iterable
+    @param max_depth: Deepest level to capture, the root being level 0, or
+    None for the whole subtree
+    @type max_depth: integer
+    @return: The captured subtree
+    @rtype: L{Snapshot}
+    '''
+    properties = tuple(properties)
+    for prop in properties:
+        if prop not in PROPERTY_GETTERS:
+            raise ValueError('Unknown property: %s' % prop)
+    backend = getBackend()
+    parents = array('l')
+    child_start = array('l')
+    child_count = array('l')
+    child_ids = array('l')
+    columns = {}
+    for prop in properties:
+        columns[prop] = prop in ('state', 'role') and array('q') or array('l')
+    strings = []
+    string_ids = {}
+    getters = [(prop, columns[prop], PROPERTY_GETTERS[prop])
+               for prop in properties]
+
+    def intern(s):
+        try:
+            return string_ids[s]
+        except KeyError:
+            string_ids[s] = len(strings)
+            strings.append(s)
+            return string_ids[s]
+
+    # Queue entries are (object to query, child ID, parent index, depth).
+    queue = deque([(acc, CHILDID_SELF, -1, 0)])
+    while queue:
+        obj, child_id, parent, depth = queue.popleft()
+        index = len(parents)
+        parents.append(parent)
+        child_ids.append(child_id)
+        for prop, column, getter in getters:
+            try:
+                value = getattr(obj, getter)(child_id)
+            except Exception:
+                value = None
+            if prop in _STRING_PROPERTIES:
+                column.append(value is None and -1 or intern(value))
+            elif prop == 'location':
+                column.extend(value is not None and value or (0, 0, 0, 0))
+            elif prop == 'role' and isinstance(value, str):
+                column.append(-intern(value) - 1)
+            else:
+                column.append(value or 0)
+        # Children get indices in the order they are queued, so they are
+        # contiguous and start after everything already queued.
+        child_start.append(index + len(queue) + 1)
+        if child_id != CHILDID_SELF or \
+                (max_depth is not None and depth >= max_depth):
+            child_count.append(0)
+            continue
+        try:
+            children = backend.accessibleChildren(obj, 0, obj.accChildCount)
+        except Exception:
+            children = []
+        child_count.append(len(children))
+        for child in children:
+            if isinstance(child, int):
+                queue.append((obj, child, index, depth + 1))
+            else:
+                queue.append((child, CHILDID_SELF, index, depth + 1))
+    return Snapshot(properties, parents, child_start, child_count, child_ids,
+                    columns, tuple(strings))
@@ -0,0 +1,544 @@
+'''
+An offline spatial index of accessible objects, for hit testing and region
+queries without round trips.
+
+L{SpatialIndex.build} walks a subtree once, reading every object's
+accLocation, and files the rectangles in a uniform grid of screen cells.
+Point and rectangle queries then only look at the cells they touch.
+Attached to the registry, the index keeps itself current from location
+change, reorder and destroy events, re-reading only what they are about.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+import collections
+import threading
+from . import constants
+from .accessible import ManagedChildAccessible
+from .backend import getBackend
+from .constants import CHILDID_SELF
+from .dispatch import DISPATCH_INLINE
+
+INDEX_EVENTS = (constants.EVENT_OBJECT_LOCATIONCHANGE,
+                constants.EVENT_OBJECT_REORDER,
+                constants.EVENT_OBJECT_DESTROY)
+
+class _Entry(object):
+    __slots__ = ('key', 'parent', 'children', 'order', 'depth', 'rect',
+                 'cells', 'event_key')
+
+    def __init__(self, key, parent, order, depth, rect):
+        self.key = key
+        self.parent = parent
+        self.children = []
+        self.order = order
+        self.depth = depth
+        self.rect = rect
+        # Grid cells holding the entry, None when it is in the large set.
+        self.cells = ()
+        self.event_key = None
+
+def _location(key):
+    acc, child_id = key
+    try:
+        rect = acc.accLocation(child_id)
+    except Exception:
+        return None
+    if rect is None:
+        return None
+    return tuple(rect)
+
+def _empty(rect):
+    return rect is None or rect[2] <= 0 or rect[3] <= 0
+
+class SpatialIndex(object):
+    '''
+    Rectangles of the objects in a subtree, filed in a grid of square cells.
+    Rectangles spanning more than max_cells cells, such as those of windows
+    and documents, are kept in a set of their own that every query scans.
+
+    Objects are identified by (accessible, child ID), which relies on the
+    backend returning equal accessibles for the same object, as COM proxies
+    do. Events are matched to objects through AccessibleObjectFromEvent the
+    first time, and through their (hwnd, object ID, child ID) after that.
+    Events from windows outside the root's window are dropped without a
+    round trip, as are, up to max_unknown of them, events naming objects
+    found not to be indexed before.
+
+    @ivar cell_size: Width and height of a grid cell, in pixels
+    @type cell_size: integer
+    @ivar max_cells: Most cells a rectangle is filed in
+    @type max_cells: integer
+    @ivar max_unknown: Most event keys remembered as naming no indexed object
+    @type max_unknown: integer
+    @ivar relocations: Objects whose location was read again
+    @ivar rebuilds: Subtrees walked again after reorder events
+    @ivar removals: Subtrees dropped after destroy events
+    '''
+    def __init__(self, cell_size=128, max_cells=64, max_unknown=1024):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.max_unknown = max_unknown
+        self.root = None
+        # Window of the root, None when the root is the desktop and events
+        # from any window may be about indexed objects.
+        self.window = None
+        self.max_depth = None
+        self._entries = {}
+        self._cells = {}
+        self._large = set()
+        # (hwnd, object ID, child ID) -> key, for events seen before.
+        self._event_keys = {}
+        # Event keys that named no indexed object, oldest first.
+        self._unknown_keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._registry = None
+        self.relocations = 0
+        self.rebuilds = 0
+        self.removals = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, acc):
+        return self._keyOf(acc) in self._entries
+
+    @staticmethod
+    def _keyOf(acc):
+        if isinstance(acc, ManagedChildAccessible):
+            return (acc.parent, acc.child_id)
+        return (acc, CHILDID_SELF)
+
+    def _walk(self, root, depth, max_depth):
+        # Reads the rectangles of root and its descendants, in pre-order, as
+        # (key, parent key, depth, rect) tuples. Takes no lock.
+        backend = getBackend()
+        rv = []
+        stack = [(root, None, depth)]
+        while stack:
+            key, parent, depth = stack.pop()
+            rv.append((key, parent, depth, _location(key)))
+            acc, child_id = key
+            if child_id != CHILDID_SELF or \
+                    (max_depth is not None and depth >= max_depth):
+                continue
+            try:
+                children = backend.accessibleChildren(acc, 0,
+                                                      acc.accChildCount)
+            except Exception:
+                continue
+            for child in reversed(children):
+                if isinstance(child, int):
+                    stack.append(((acc, child), key, depth + 1))
+                else:
+                    stack.append(((child, CHILDID_SELF), key, depth + 1))
+        return rv
+
+    def build(self, acc, max_depth=None):
+        '''
+        Indexes acc and its descendants, replacing anything indexed before.
+        Costs one accLocation per object, one child fetch per full object
+        and one WindowFromAccessibleObject for the root.
+
+        @param acc: Root of the subtree, such as the desktop
+        @type acc: IAccessible
+        @param max_depth: Deepest level to index, the root being level 0, or
+        None for the whole subtree
+        @type max_depth: integer
+        '''
+        key = self._keyOf(acc)
+        backend = getBackend()
+        window = backend.windowFromAccessibleObject(key[0])
+        if window == backend.getDesktopWindow():
+            window = None
+        nodes = self._walk(key, 0, max_depth)
+        with self._lock:
+            self._entries.clear()
+            self._cells.clear()
+            self._large.clear()
+            self._event_keys.clear()
+            self._unknown_keys.clear()
+            self.root = key
+            self.window = window or None
+            self.max_depth = max_depth
+            self._insert(nodes)
+
+    def _insert(self, nodes):
+        # Events about the new objects may have been dismissed before.
+        self._unknown_keys.clear()
+        entries = self._entries
+        for key, parent, depth, rect in nodes:
+            parent_entry = entries.get(parent)
+            order = 0
+            if parent_entry is not None:
+                siblings = parent_entry.children
+                if siblings:
+                    order = entries[siblings[-1]].order + 1
+                siblings.append(key)
+            entry = entries[key] = _Entry(key, parent, order, depth, rect)
+            self._file(entry)
+
+    def _cellRange(self, rect):
+        size = self.cell_size
+        left, top, width, height = rect
+        return (left // size, top // size, (left + width - 1) // size,
+                (top + height - 1) // size)
+
+    def _file(self, entry):
+        rect = entry.rect
+        if _empty(rect):
+            entry.cells = ()
+            return
+        x0, y0, x1, y1 = self._cellRange(rect)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            entry.cells = None
+            self._large.add(entry.key)
+            return
+        cells = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = (cx, cy)
+                keys = self._cells.get(cell)
+                if keys is None:
+                    keys = self._cells[cell] = set()
+                keys.add(entry.key)
+                cells.append(cell)
+        entry.cells = cells
+
+    def _unfile(self, entry):
+        if entry.cells is None:
+            self._large.discard(entry.key)
+        else:
+            for cell in entry.cells:
+                keys = self._cells[cell]
+                keys.discard(entry.key)
+                if not keys:
+                    del self._cells[cell]
+        entry.cells = ()
+
+    def _move(self, entry, rect):
+        if rect == entry.rect:
+            return
+        self._unfile(entry)
+        entry.rect = rect
+        self._file(entry)
+
+    def _descendants(self, entry):
+        entries = self._entries
+        stack = list(entry.children)
+        while stack:
+            child = entries[stack.pop()]
+            yield child
+            stack.extend(child.children)
+
+    def _drop(self, entry, detach=True):
+        # Removes entry and its descendants.
+        if detach:
+            parent = self._entries.get(entry.parent)
+            if parent is not None:
+                parent.children.remove(entry.key)
+        for e in [entry] + list(self._descendants(entry)):
+            self._unfile(e)
+            del self._entries[e.key]
+            if e.event_key is not None:
+                self._event_keys.pop(e.event_key, None)
+
+    def relocate(self, acc):
+        '''
+        Reads the location of an indexed object again. A full object that
+        only moved carries its descendants along with it; one that was
+        resized has theirs read again too.
+
+        @param acc: The object
+        @type acc: IAccessible or L{pyia.accessible.ManagedChildAccessible}
+        '''
+        self._relocate(self._keyOf(acc))
+
+    def _relocate(self, key):
+        if key not in self._entries:
+            return
+        rect = _location(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            old = entry.rect
+            self._move(entry, rect)
+            self.relocations += 1
+            if not entry.children or old == rect:
+                return
+            if rect is not None and old is not None and \
+                    rect[2:] == old[2:]:
+                dx = rect[0] - old[0]
+                dy = rect[1] - old[1]
+                for child in self._descendants(entry):
+                    if child.rect is not None:
+                        left, top, width, height = child.rect
+                        self._move(child, (left + dx, top + dy, width,
+                                           height))
+                return
+            keys = [child.key for child in self._descendants(entry)]
+        rects = [(k, _location(k)) for k in keys]
+        with self._lock:
+            for k, rect in rects:
+                child = self._entries.get(k)
+                if child is not None:
+                    self._move(child, rect)
+            self.relocations += len(rects)
+
+    def refresh(self, acc):
+        '''
+        Walks the subtree of an indexed object again, as after a reorder.
+
+        @param acc: The object
+        @type acc: IAccessible or L{pyia.accessible.ManagedChildAccessible}
+        '''
+        self._refresh(self._keyOf(acc))
+
+    def _refresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        nodes = self._walk(key, entry.depth, self.max_depth)
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            for child in list(entry.children):
+                self._drop(self._entries[child], False)
+            entry.children = []
+            self._move(entry, nodes[0][3])
+            self._insert(nodes[1:])
+            self.rebuilds += 1
+
+    def remove(self, acc):
+        '''
+        Drops an object and its descendants from the index.
+
+        @param acc: The object
+        @type acc: IAccessible or L{pyia.accessible.ManagedChildAccessible}
+        '''
+        self._remove(self._keyOf(acc))
+
+    def _remove(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if key == self.root:
+                self._entries.clear()
+                self._cells.clear()
+                self._large.clear()
+                self._event_keys.clear()
+                self._unknown_keys.clear()
+            else:
+                self._drop(entry)
+            self.removals += 1
+
+    def _resolve(self, hwnd, object_id, child_id):
+        event_key = (hwnd, object_id, child_id)
+        key = self._event_keys.get(event_key)
+        if key is not None:
+            return key
+        if event_key in self._unknown_keys:
+            return None
+        backend = getBackend()
+        window = self.window
+        if window is not None and hwnd != window and \
+                not backend.isChildWindow(window, hwnd):
+            return None
+        if not backend.isWindow(hwnd):
+            return None
+        try:
+            rv = backend.accessibleObjectFromEvent(hwnd, object_id, child_id)
+        except Exception:
+            rv = None
+        with self._lock:
+            entry = None
+            if rv is not None:
+                acc, child_id = rv
+                key = (acc, child_id or CHILDID_SELF)
+                entry = self._entries.get(key)
+            if entry is None:
+                unknown = self._unknown_keys
+                unknown[event_key] = True
+                if len(unknown) > self.max_unknown:
+                    unknown.popitem(last=False)
+                return None
+            entry.event_key = event_key
+            self._event_keys[event_key] = key
+        return key
+
+    def handleEvent(self, event):
+        '''
+        Updates the index for a location change, reorder or destroy event.
+        Events about objects that are not indexed are ignored. A destroyed
+        object can only be told apart once an earlier event has named it;
+        otherwise it goes when the reorder event of its container arrives.
+
+        @param event: The event
+        @type event: L{pyia.event.Event}
+        '''
+        key = self._resolve(event.hwnd, event.object_id, event.child_id)
+        if key is None:
+            return
+        if event.type == constants.EVENT_OBJECT_LOCATIONCHANGE:
+            self._relocate(key)
+        elif event.type == constants.EVENT_OBJECT_REORDER:
+            self._refresh(key)
+        elif event.type == constants.EVENT_OBJECT_DESTROY:
+            self._remove(key)
+
+    def attach(self, registry=None, dispatch=DISPATCH_INLINE, process_id=0):
+        '''
+        Keeps the index current from the events registry delivers.
+
+        @param registry: Registry to listen to, the pyia singleton by default
+        @type registry: L{pyia.registry.Registry}
+        @param dispatch: Dispatch policy of the listener, see
+        L{pyia.registry.Registry.registerEventListener}
+        @param process_id: Only follow events from this process, 0 for any
+        @type process_id: integer
+        '''
+        if registry is None:
+            from . import Registry as registry
+        self.detach()
+        registry.registerEventListener(self.handleEvent, *INDEX_EVENTS,
+                                       dispatch=dispatch,
+                                       process_id=process_id)
+        self._registry = registry
+
+    def detach(self):
+        registry, self._registry = self._registry, None
+        if registry is not None:
+            registry.deregisterEventListener(self.handleEvent, *INDEX_EVENTS)
+
+    def _accessible(self, entry):
+        acc, child_id = entry.key
+        if child_id == CHILDID_SELF:
+            return acc
+        return ManagedChildAccessible(acc, child_id)
+
+    def _candidates(self, x0, y0, x1, y1):
+        size = self.cell_size
+        cells = self._cells
+        for cx in range(x0 // size, x1 // size + 1):
+            for cy in range(y0 // size, y1 // size + 1):
+                keys = cells.get((cx, cy))
+                if keys:
+                    yield keys
+        if self._large:
+            yield self._large
+
+    def _above(self, a, b):
+        # Whether a hit test descending from the root would reach a before
+        # b: the deeper of an object and its ancestor, or at the point where
+        # their branches part, the later sibling, which is drawn on top.
+        entries = self._entries
+        a_top, b_top = a, b
+        while a_top.depth > b_top.depth:
+            a_top = entries[a_top.parent]
+        while b_top.depth > a_top.depth:
+            b_top = entries[b_top.parent]
+        if a_top is b_top:
+            return a.depth > b.depth
+        while a_top.parent != b_top.parent:
+            a_top = entries[a_top.parent]
+            b_top = entries[b_top.parent]
+        return a_top.order > b_top.order
+
+    def hitTest(self, x, y):
+        '''
+        Finds the object at a screen point, as recursive accHitTest calls
+        from the root would: the last child containing the point, then the
+        last of its children containing it, and so on. Objects with no
+        location do not stop the descent.
+
+        @return: The object, or None if no indexed object contains the point
+        @rtype: IAccessible or L{pyia.accessible.ManagedChildAccessible}
+        '''
+        with self._lock:
+            entries = self._entries
+            hits = {}
+            for keys in self._candidates(x, y, x, y):
+                for key in keys:
+                    left, top, width, height = entries[key].rect
+                    if left <= x < left + width and top <= y < top + height:
+                        hits[key] = entries[key]
+            best = None
+            for entry in hits.values():
+                if best is not None and not self._above(entry, best):
+                    continue
+                # Every located ancestor below the root must contain the
+                # point too.
+                ancestor = entry
+                while ancestor.parent is not None and \
+                        ancestor.parent != self.root:
+                    ancestor = entries[ancestor.parent]
+                    if ancestor.key not in hits and not _empty(ancestor.rect):
+                        break
+                else:
+                    best = entry
+            if best is None:
+                return None
+            return self._accessible(best)
+
+    def query(self, left, top, width, height, contained=False):
+        '''
+        Finds the objects whose rectangles intersect a screen rectangle.
+
+        @param contained: Only objects lying entirely within the rectangle
+        @type contained: boolean
+        @return: The objects, in no particular order
+        @rtype: list
+        '''
+        if width <= 0 or height <= 0:
+            return []
+        right = left + width
+        bottom = top + height
+        rv = []
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            for keys in self._candidates(left, top, right - 1, bottom - 1):
+                for key in keys:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    entry = entries[key]
+                    l, t, w, h = entry.rect
+                    if contained:
+                        hit = left <= l and top <= t and \
+                            l + w <= right and t + h <= bottom
+                    else:
+                        hit = l < right and left < l + w and \
+                            t < bottom and top < t + h
+                    if hit:
+                        rv.append(self._accessible(entry))
+        return rv
+
+    def stats(self):
+        '''
+        @return: Object, grid cell and large object counts, and the update
+        counters
+        @rtype: dictionary
+        '''
+        return {'objects': len(self._entries), 'cells': len(self._cells),
+                'large': len(self._large), 'relocations': self.relocations,
+                'rebuilds': self.rebuilds, 'removals': self.removals}
@@ -0,0 +1,219 @@
+'''
+Accessible states as a set value backed by the MSAA state bitmask.
+
+A L{StateSet} holds an accState() value and acts as a set of state names:
+membership is one mask test, set algebra is integer arithmetic, and names
+are decoded a byte at a time through precomputed tables, only when asked
+for.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+from .backend import getBackend
+from .constants import UNLOCALIZED_STATE_NAMES
+
+_NAME_BITS = dict((name, bit) for bit, name in UNLOCALIZED_STATE_NAMES.items())
+
+# Per byte of a state: byte value -> the bits set in it and their names,
+# shifted into place. Built on first use.
+_BYTE_BITS = None
+_BYTE_NAMES = None
+
+def _buildTables():
+    global _BYTE_BITS, _BYTE_NAMES
+    byte_bits = []
+    byte_names = []
+    for shift in range(0, 64, 8):
+        bits = []
+        names = []
+        for byte in range(256):
+            set_bits = tuple((1 << (shift + i)) for i in range(8)
+                             if byte & (1 << i))
+            bits.append(set_bits)
+            names.append(tuple(UNLOCALIZED_STATE_NAMES.get(bit, 'unknown')
+                               for bit in set_bits))
+        byte_bits.append(tuple(bits))
+        byte_names.append(tuple(names))
+    _BYTE_BITS = tuple(byte_bits)
+    _BYTE_NAMES = tuple(byte_names)
+
+def _decode(value, names):
+    if _BYTE_BITS is None:
+        _buildTables()
+    tables = _BYTE_NAMES if names else _BYTE_BITS
+    rv = ()
+    i = 0
+    while value:
+        byte = value & 0xff
+        if byte:
+            rv += tables[i][byte]
+        value >>= 8
+        i += 1
+    return rv
+
+def _unsigned(value):
+    # accState() comes back as a signed VT_I4 when bit 31 is set.
+    if value < 0:
+        value &= 0xffffffff
+    return value
+
+def _bitOf(state):
+    if isinstance(state, StateSet):
+        return state.value
+    if isinstance(state, str):
+        return _NAME_BITS[state]
+    return _unsigned(state)
+
+class StateSet(object):
+    '''
+    Set of accessible states. Iterating gives state names, as
+    accStateSet() did when it returned lists, in bit order; C{in} takes
+    names, STATE_SYSTEM_* bits or other state sets (for subsets). Combine
+    sets with C{|}, C{&}, C{-} and C{^}, which take state sets, bitmasks or
+    names (raising KeyError for unknown names).
+
+    @ivar value: The accState() bitmask, as an unsigned value
+    @type value: integer
+    '''
+    __slots__ = ('value', '_names')
+
+    def __init__(self, value=0):
+        self.value = _unsigned(value)
+        self._names = None
+
+    @classmethod
+    def fromNames(cls, names):
+        '''
+        @param names: Unlocalized state names, such as 'focused'
+        @type names: iterable
+        @raise KeyError: A name is not a known state
+        '''
+        value = 0
+        for name in names:
+            value |= _NAME_BITS[name]
+        return cls(value)
+
+    @property
+    def names(self):
+        '''
+        Unlocalized names of the states in the set, 'unknown' for bits with
+        no name.
+
+        @rtype: tuple
+        '''
+        names = self._names
+        if names is None:
+            names = self._names = _decode(self.value, True)
+        return names
+
+    @property
+    def bits(self):
+        '''
+        The STATE_SYSTEM_* bits in the set.
+
+        @rtype: tuple
+        '''
+        return _decode(self.value, False)
+
+    @property
+    def localizedNames(self):
+        '''
+        Names of the states in the set in the language of the system.
+
+        @rtype: tuple
+        '''
+        stateText = getBackend().localizedStateText
+        return tuple(stateText(bit) for bit in self.bits)
+
+    def __contains__(self, state):
+        try:
+            bit = _bitOf(state)
+        except KeyError:
+            return False
+        return bool(bit) and self.value & bit == bit
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return bin(self.value).count('1')
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __int__(self):
+        return self.value
+
+    __index__ = __int__
+
+    def __eq__(self, other):
+        if isinstance(other, StateSet):
+            return self.value == other.value
+        if isinstance(other, int):
+            return self.value == _unsigned(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        rv = self.__eq__(other)
+        if rv is NotImplemented:
+            return rv
+        return not rv
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __or__(self, other):
+        return StateSet(self.value | _bitOf(other))
+
+    def __and__(self, other):
+        return StateSet(self.value & _bitOf(other))
+
+    def __sub__(self, other):
+        return StateSet(self.value & ~_bitOf(other))
+
+    def __xor__(self, other):
+        return StateSet(self.value ^ _bitOf(other))
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __le__(self, other):
+        other = _bitOf(other)
+        return self.value & other == self.value
+
+    def __ge__(self, other):
+        other = _bitOf(other)
+        return self.value & other == other
+
+    def diff(self, old):
+        '''
+        Compares with an earlier state, as when handling a state change
+        event.
+
+        @param old: The earlier state, a state set or bitmask
+        @return: The states added and the states removed since old
+        @rtype: tuple of L{StateSet}
+        '''
+        old = _bitOf(old)
+        return StateSet(self.value & ~old), StateSet(old & ~self.value)
+
+    def __repr__(self):
+        return '<StateSet %s>' % ', '.join(self.names)
@@ -0,0 +1,302 @@
+'''
+Structural diffs between snapshots of the same accessible tree.
+
+L{diffSnapshots} compares two L{pyia.snapshot.Snapshot}s and reports what
+happened in between as L{TreeChange} operations: subtrees inserted, removed
+or moved, and property changes of the nodes found in both. Nodes are paired
+from the root down, among the children of already paired parents, by
+identity key (role, name and how many earlier siblings share them), then,
+for nodes that were renamed, with the sibling of the same role sharing the
+most children and properties. Subtrees whose hashes did not change
+are skipped whole, so a small change in a big tree takes time in proportion
+to the change once the snapshots' hashes are computed.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+from bisect import bisect_left
+from collections import deque
+
+# Renamed nodes are paired with the most similar of at most this many
+# unpaired siblings of the same role.
+_MAX_CANDIDATES = 32
+
+# Kinds of change
+INSERT = 'insert'
+REMOVE = 'remove'
+MOVE = 'move'
+CHANGE = 'change'
+
+class TreeChange(object):
+    '''
+    One difference between two snapshots. Indices refer to the old and new
+    snapshot, -1 where a node is not in one of them.
+
+      - L{INSERT}: new is the root of an inserted subtree, new_parent its
+        parent and position its place among the parent's children.
+      - L{REMOVE}: old is the root of a removed subtree, old_parent its
+        parent.
+      - L{MOVE}: the subtree at old is at new now, under a different parent
+        or at a different place among its siblings.
+      - L{CHANGE}: prop of the node changed from old_value to new_value.
+
+    @ivar kind: One of L{INSERT}, L{REMOVE}, L{MOVE} or L{CHANGE}
+    '''
+    __slots__ = ('kind', 'old', 'new', 'old_parent', 'new_parent',
+                 'position', 'prop', 'old_value', 'new_value')
+
+    def __init__(self, kind, old=-1, new=-1, old_parent=-1, new_parent=-1,
+                 position=-1, prop=None, old_value=None, new_value=None):
+        self.kind = kind
+        self.old = old
+        self.new = new
+        self.old_parent = old_parent
+        self.new_parent = new_parent
+        self.position = position
+        self.prop = prop
+        self.old_value = old_value
+        self.new_value = new_value
+
+    def __repr__(self):
+        if self.kind == CHANGE:
+            return '<TreeChange change %d/%d %s: %r -> %r>' % (
+                self.old, self.new, self.prop, self.old_value,
+                self.new_value)
+        return '<TreeChange %s old=%d new=%d parent=%d/%d position=%d>' % (
+            self.kind, self.old, self.new, self.old_parent, self.new_parent,
+            self.position)
+
+def _getter(snapshot, prop):
+    if prop in snapshot.properties:
+        return lambda index: snapshot.get(index, prop)
+    return lambda index: None
+
+def _keys(indices, role, name):
+    # (role, name, occurrence) for each node, occurrence telling apart
+    # siblings that look the same.
+    seen = {}
+    keys = []
+    for index in indices:
+        base = (role(index), name(index))
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        keys.append(base + (n,))
+    return keys
+
+def _stable(positions):
+    '''
+    @return: Indices into positions of a longest increasing run, the
+    children that kept their order
+    @rtype: set
+    '''
+    tails = []
+    tail_at = []
+    previous = [-1] * len(positions)
+    for i, p in enumerate(positions):
+        j = bisect_left(tails, p)
+        if j == len(tails):
+            tails.append(p)
+            tail_at.append(i)
+        else:
+            tails[j] = p
+            tail_at[j] = i
+        if j:
+            previous[i] = tail_at[j - 1]
+    rv = set()
+    i = -1
+    if tail_at:
+        i = tail_at[-1]
+    while i >= 0:
+        rv.add(i)
+        i = previous[i]
+    return rv
+
+class _Differ(object):
+    def __init__(self, old, new, properties):
+        self.old = old
+        self.new = new
+        self.properties = properties
+        self.old_role = _getter(old, 'role')
+        self.old_name = _getter(old, 'name')
+        self.new_role = _getter(new, 'role')
+        self.new_name = _getter(new, 'name')
+        self.changes = []
+
+    def compare(self, pairs):
+        '''
+        Diffs paired nodes and their descendants.
+
+        @return: Subtrees removed, as (old index, old parent), and inserted,
+        as (new index, new parent, position)
+        @rtype: tuple of lists
+        '''
+        old, new = self.old, self.new
+        old_role, new_role = self.old_role, self.new_role
+        changes = self.changes
+        removed = []
+        inserted = []
+        while pairs:
+            o, n = pairs.popleft()
+            if old.subtreeHash(o) == new.subtreeHash(n):
+                continue
+            for prop in self.properties:
+                old_value = old.get(o, prop)
+                new_value = new.get(n, prop)
+                if old_value != new_value:
+                    changes.append(TreeChange(CHANGE, o, n, prop=prop,
+                                              old_value=old_value,
+                                              new_value=new_value))
+            old_children = list(old.children(o))
+            new_children = list(new.children(n))
+            by_key = dict(zip(_keys(old_children, old_role, self.old_name),
+                              old_children))
+            # New child -> paired old child.
+            paired = {}
+            unpaired_old = set(old_children)
+            for child, key in zip(new_children, _keys(new_children, new_role,
+                                                      self.new_name)):
+                match = by_key.get(key)
+                if match is not None:
+                    paired[child] = match
+                    unpaired_old.discard(match)
+            # Pair what is left among nodes of the same role: renamed nodes.
+            by_role = {}
+            for child in old_children:
+                if child in unpaired_old:
+                    by_role.setdefault(old_role(child), []).append(child)
+            for child in new_children:
+                if child in paired:
+                    continue
+                candidates = by_role.get(new_role(child))
+                if candidates:
+                    match = self.closest(child, candidates)
+                    candidates.remove(match)
+                    paired[child] = match
+                    unpaired_old.discard(match)
+            # Children that changed places among their siblings.
+            order = [(i, c) for i, c in enumerate(new_children)
+                     if c in paired]
+            old_position = dict((c, i) for i, c in enumerate(old_children))
+            kept = _stable([old_position[paired[c]] for i, c in order])
+            for j, (position, child) in enumerate(order):
+                if j not in kept:
+                    changes.append(TreeChange(
+                        MOVE, paired[child], child, o, n, position))
+            for position, child in enumerate(new_children):
+                match = paired.get(child)
+                if match is None:
+                    inserted.append((child, n, position))
+                else:
+                    pairs.append((match, child))
+            for child in old_children:
+                if child in unpaired_old:
+                    removed.append((child, o))
+        return removed, inserted
+
+    def closest(self, n, candidates):
+        '''
+        @return: The old node in candidates most like new node n: the one
+        sharing the most children by role and name, then the most
+        properties. Ties go to the earliest, and only the first
+        L{_MAX_CANDIDATES} are looked at.
+        '''
+        if len(candidates) == 1:
+            return candidates[0]
+        old, new = self.old, self.new
+        old_role, old_name = self.old_role, self.old_name
+        child_keys = set((self.new_role(c), self.new_name(c))
+                         for c in new.children(n))
+        values = [new.get(n, prop) for prop in self.properties]
+        best = None
+        best_score = None
+        for o in candidates[:_MAX_CANDIDATES]:
+            shared = 0
+            if child_keys:
+                for c in old.children(o):
+                    if (old_role(c), old_name(c)) in child_keys:
+                        shared += 1
+            same = 0
+            for prop, value in zip(self.properties, values):
+                if old.get(o, prop) == value:
+                    same += 1
+            score = (shared, same)
+            if best_score is None or score > best_score:
+                best = o
+                best_score = score
+        return best
+
+    def run(self):
+        pairs = deque([(0, 0)])
+        while pairs:
+            removed, inserted = self.compare(pairs)
+            # Subtrees that went from one parent to another: pair removed
+            # and inserted nodes whose role and name are unique among them,
+            # then diff inside them too.
+            removed_by_key = {}
+            for child, parent in removed:
+                key = (self.old_role(child), self.old_name(child))
+                removed_by_key.setdefault(key, []).append((child, parent))
+            inserted_by_key = {}
+            for child, parent, position in inserted:
+                key = (self.new_role(child), self.new_name(child))
+                inserted_by_key.setdefault(key, []).append(
+                    (child, parent, position))
+            moved_old = set()
+            moved_new = set()
+            for key, candidates in inserted_by_key.items():
+                matches = removed_by_key.get(key)
+                if len(candidates) != 1 or not matches or len(matches) != 1:
+                    continue
+                (child, parent, position), (match, old_parent) = \
+                    candidates[0], matches[0]
+                moved_old.add(match)
+                moved_new.add(child)
+                self.changes.append(TreeChange(MOVE, match, child, old_parent,
+                                               parent, position))
+                pairs.append((match, child))
+            for child, parent in removed:
+                if child not in moved_old:
+                    self.changes.append(TreeChange(REMOVE, child, -1, parent))
+            for child, parent, position in inserted:
+                if child not in moved_new:
+                    self.changes.append(TreeChange(
+                        INSERT, -1, child, new_parent=parent,
+                        position=position))
+        return self.changes
+
+def diffSnapshots(old, new, properties=None):
+    '''
+    Lists the changes that turn old into new. The roots of the two
+    snapshots are taken to be the same node. Inserted and removed subtrees
+    are reported once, by their root.
+
+    @param old: Earlier snapshot
+    @type old: L{pyia.snapshot.Snapshot}
+    @param new: Later snapshot
+    @type new: L{pyia.snapshot.Snapshot}
+    @param properties: Properties to compare, by default all those both
+    snapshots captured
+    @type properties: iterable
+    @return: The changes
+    @rtype: list of L{TreeChange}
+    '''
+    if properties is None:
+        properties = [p for p in old.properties if p in new.properties]
+    return _Differ(old, new, tuple(properties)).run()
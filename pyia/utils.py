@@ -24,13 +24,17 @@ Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 Boston, MA 02111-1307, USA.
 '''
 
+import queue
+import threading
+import time
+from collections import deque
 from . import constants
-from ctypes import windll, oledll, POINTER, byref, c_int
-from comtypes.automation import VARIANT
-from comtypes.gen.Accessibility import IAccessible
+from .accessible import ManagedChildAccessible
+from .backend import getBackend
+from .selector import Selector, compileSelector
 
 def getDesktop():
-  desktop_hwnd = windll.user32.GetDesktopWindow()
+  desktop_hwnd = getBackend().getDesktopWindow()
   desktop_window = accessibleObjectFromWindow(desktop_hwnd)
   for child in desktop_window:
     if child.accRole() == constants.ROLE_SYSTEM_CLIENT:
@@ -39,144 +43,449 @@ def getDesktop():
 
 def getForegroundWindow():
   return accessibleObjectFromWindow(
-    windll.user32.GetForegroundWindow())
+    getBackend().getForegroundWindow())
 
 def accessibleObjectFromWindow(hwnd):
-  ptr = POINTER(IAccessible)()
-  res = oledll.oleacc.AccessibleObjectFromWindow(
-    hwnd,0,
-    byref(IAccessible._iid_),byref(ptr))
-  return ptr
+  return getBackend().accessibleObjectFromWindow(hwnd, 0)
 
 def accessibleObjectFromEvent(event):
-  if not windll.user32.IsWindow(event.hwnd):
+  backend = getBackend()
+  if not backend.isWindow(event.hwnd):
     return None
-  ptr = POINTER(IAccessible)()
-  varChild = VARIANT()
-  res = windll.oleacc.AccessibleObjectFromEvent(
-    event.hwnd, event.object_id, event.child_id,
-    byref(ptr), byref(varChild))
-  if res == 0:
-    child=varChild.value
-    return ptr.QueryInterface(IAccessible)
+  rv = backend.accessibleObjectFromEvent(
+    event.hwnd, event.object_id, event.child_id)
+  if rv is not None:
+    acc, child = rv
+    return acc
   else:
     return None
 
 
-def findDescendant(acc, pred, breadth_first=False):
+def _test(func, acc):
+  try:
+    return func(acc)
+  except Exception:
+    return False
+
+def iterDescendants(acc, pred=None, breadth_first=False, max_depth=None,
+                    limit=None, prune=None):
   '''
-  Searches for a descendant node satisfying the given predicate starting at 
-  this node. The search is performed in depth-first order by default or
-  in breadth first order if breadth_first is True. For example,
-  
-  my_win = findDescendant(lambda x: x.name == 'My Window')
-  
-  will search all descendants of x until one is located with the name 'My
-  Window' or all nodes are exausted. Calls L{_findDescendantDepth} or
-  L{_findDescendantBreadth} to start the recursive search.
-  
-  @param acc: Root accessible of the search
+  Generates the descendants of acc satisfying the given predicate, in
+  depth-first (pre-order) order by default or in breadth first order if
+  breadth_first is True. The walk is iterative, so deep trees do not run
+  into the recursion limit, and lazy: children are only fetched once the
+  walk gets to them, and nothing past the last match consumed is visited.
+  For example,
+
+  hidden = lambda x: x.accState() & STATE_SYSTEM_INVISIBLE
+  for link in iterDescendants(doc, lambda x: x.accRole() == ROLE_SYSTEM_LINK,
+                              prune=hidden):
+    ...
+
+  visits the links of doc that are not in an invisible subtree. Selectors
+  say the same more briefly, and compile to a matcher that also prunes
+  subtrees it cannot match in:
+
+  iterDescendants(doc, 'link', prune=hidden)
+
+  Predicates and prune callbacks raising an exception count as False, and
+  subtrees whose children cannot be fetched are skipped.
+
+  @param acc: Root accessible of the search, not itself tested
   @type acc: Accessibility.Accessible
-  @param pred: Search predicate returning True if accessible matches the 
-  search criteria or False otherwise
-  @type pred: callable
+  @param pred: Search predicate returning True if accessible matches the
+  search criteria or False otherwise, a selector (see L{pyia.selector}), or
+  None to match everything
+  @type pred: callable, string or L{Selector}
   @param breadth_first: Search breadth first (True) or depth first (False)?
   @type breadth_first: boolean
-  @return: Accessible matching the criteria or None if not found
-  @rtype: Accessibility.Accessible or None
+  @param max_depth: Deepest level to visit, 1 for the children of acc only,
+  or None for no limit
+  @type max_depth: integer
+  @param limit: Stop after this many matches, or None for no limit
+  @type limit: integer
+  @param prune: Called with each descendant before it is tested; returning
+  True skips it along with its whole subtree
+  @type prune: callable
+  @return: Matching accessibles
+  @rtype: generator
   '''
+  if isinstance(pred, str):
+    pred = compileSelector(pred)
+  if isinstance(pred, Selector):
+    yield from pred.iterMatches(acc, breadth_first, max_depth, limit, prune)
+    return
+  if limit is not None and limit <= 0:
+    return
+  found = 0
   if breadth_first:
-    return _findDescendantBreadth(acc, pred)
-  
-  for child in acc:
+    # Nodes whose children are still to be visited, with the children's depth.
+    pending = deque([(acc, 1)])
+    while pending:
+      node, depth = pending.popleft()
+      expand = max_depth is None or depth < max_depth
+      try:
+        for child in node:
+          if prune is not None and _test(prune, child):
+            continue
+          if pred is None or _test(pred, child):
+            yield child
+            found += 1
+            if found == limit:
+              return
+          if expand:
+            pending.append((child, depth + 1))
+      except Exception:
+        pass
+    return
+  # One child iterator per level of the current path.
+  stack = [(iter(acc), 1)]
+  while stack:
+    children, depth = stack[-1]
     try:
-      ret = _findDescendantDepth(acc, pred)
+      child = next(children)
     except Exception:
-      ret = None
-    if ret is not None: return ret
-
-def _findDescendantBreadth(acc, pred):
-  '''  
-  Internal function for locating one descendant. Called by L{findDescendant} to
-  start the search.
- 
-  @param acc: Root accessible of the search
-  @type acc: Accessibility.Accessible
-  @param pred: Search predicate returning True if accessible matches the 
-  search criteria or False otherwise
-  @type pred: callable
-  @return: Matching node or None to keep searching
-  @rtype: Accessibility.Accessible or None
+      # Exhausted, or the children could not be fetched.
+      stack.pop()
+      continue
+    if prune is not None and _test(prune, child):
+      continue
+    if pred is None or _test(pred, child):
+      yield child
+      found += 1
+      if found == limit:
+        return
+    if max_depth is None or depth < max_depth:
+      stack.append((iter(child), depth + 1))
+
+class _ParallelSearch(object):
   '''
-  for child in acc:
+  One search spread over a worker pool. Each task walks a subtree and puts
+  its matches on a queue; tasks for the upper split_depth levels hand the
+  children they find to new tasks instead of walking them.
+  '''
+  def __init__(self, pred, workers, split_depth, max_depth, prune,
+               marshal=False):
+    from .dispatch import WorkerPool
+    self.pred = pred
+    self.split_depth = split_depth
+    self.max_depth = max_depth
+    self.prune = prune
+    # Whether matches have to be marshaled back to the caller.
+    self.marshal = marshal
+    self.results = queue.Queue()
+    self.cancelled = False
+    self._pool = WorkerPool(workers)
+    self._lock = threading.Lock()
+    # Marshaled children of the root no task has unpacked yet.
+    self._roots = {}
+    # Running and queued tasks, plus one held while the root's children are
+    # being submitted.
+    self._pending = 1
+
+  def submit(self, acc, depth, steps=None, marshaled=False):
+    # Submitting under the lock means cancel() cannot shut the pool down
+    # in between.
+    with self._lock:
+      if marshaled:
+        self._roots[id(acc)] = acc
+      if self.cancelled:
+        return
+      self._pending += 1
+      self._pool.submit(lambda: self._run(acc, depth, steps, marshaled))
+
+  def cancel(self):
+    with self._lock:
+      self.cancelled = True
+    self._pool.shutdown(wait=False)
+
+  def _run(self, acc, depth, steps, marshaled):
     try:
-      if pred(child): return child
+      if marshaled:
+        with self._lock:
+          acc = self._roots.pop(id(acc), None)
+        if acc is None:
+          # discard() released it.
+          return
+        acc = _unmarshal(acc)
+      if not self.cancelled:
+        self._search(acc, depth, steps)
     except Exception:
       pass
-  for child in acc:
+    finally:
+      self.taskDone()
+
+  def taskDone(self):
+    with self._lock:
+      self._pending -= 1
+      done = not self._pending
+    if done:
+      self.results.put(_SEARCH_DONE)
+
+  def _search(self, acc, depth, steps):
+    # acc is at the given depth below the search root and not tested yet.
+    # For selectors, steps says which parts of it acc may match.
+    pred, prune = self.pred, self.prune
+    if prune is not None and _test(prune, acc):
+      return
+    selector = isinstance(pred, Selector)
+    if selector:
+      matched, steps = pred.step(acc, steps)
+    else:
+      matched = pred is None or _test(pred, acc)
+    if matched:
+      self._found(acc)
+    if self.max_depth is not None and depth >= self.max_depth:
+      return
+    if selector and steps is None:
+      # Nothing below can match.
+      return
+    if depth < self.split_depth:
+      for child in acc:
+        if self.cancelled:
+          return
+        self.submit(child, depth + 1, steps)
+      return
+    max_depth = self.max_depth
+    if max_depth is not None:
+      max_depth -= depth
+    if selector:
+      # Selectors only come back with matches, so make a cancelled search
+      # prune everything instead.
+      for node in pred.iterMatches(acc, max_depth=max_depth,
+                                   prune=self._cancelledOr, steps=steps):
+        if self.cancelled:
+          return
+        self._found(node)
+      return
+    # Walk everything and test here, so a cancelled search stops at the
+    # next node rather than the next match.
+    for node in iterDescendants(acc, None, max_depth=max_depth, prune=prune):
+      if self.cancelled:
+        return
+      if pred is None or _test(pred, node):
+        self._found(node)
+
+  def _found(self, acc):
+    if not self.marshal:
+      self.results.put(acc)
+      return
     try:
-      ret = _findDescendantBreadth(child, pred)
+      packed = _marshal(acc)
     except Exception:
-      ret = None
-    if ret is not None: return ret
+      return
+    with self._lock:
+      if not self.cancelled:
+        self.results.put(packed)
+        return
+    _unmarshal(packed)
+
+  def discard(self):
+    # Unpacks, and so releases, whatever was marshaled for tasks the
+    # cancelled pool dropped or matches the caller no longer wants.
+    with self._lock:
+      leftovers = list(self._roots.values())
+      self._roots.clear()
+    while True:
+      try:
+        match = self.results.get_nowait()
+      except queue.Empty:
+        break
+      if self.marshal and match is not _SEARCH_DONE:
+        leftovers.append(match)
+    for packed in leftovers:
+      try:
+        _unmarshal(packed)
+      except Exception:
+        pass
+
+  def _cancelledOr(self, acc):
+    return self.cancelled or self.prune is not None and self.prune(acc)
 
-def _findDescendantDepth(acc, pred):
+def _marshal(acc):
+  # Simple children travel as their marshaled parent and child ID.
+  backend = getBackend()
+  if isinstance(acc, ManagedChildAccessible):
+    return backend.marshalAccessible(acc.parent), acc.child_id
+  return backend.marshalAccessible(acc), None
+
+def _unmarshal(marshaled):
+  packed, child_id = marshaled
+  acc = getBackend().unmarshalAccessible(packed)
+  if child_id is None:
+    return acc
+  return ManagedChildAccessible(acc, child_id)
+
+_SEARCH_DONE = object()
+
+def iterDescendantsParallel(acc, pred=None, workers=8, split_depth=1,
+                            max_depth=None, limit=None, prune=None,
+                            timeout=None):
   '''
-  Internal function for locating one descendant. Called by L{findDescendant} to
-  start the search.
+  Generates the descendants of acc satisfying the given predicate, searching
+  the subtrees of its children in parallel on a pool of worker threads, each
+  initialized for the backend (joining the multithreaded COM apartment on
+  Windows).
+  Searching the desktop this way walks every top level window at once, so
+  one slow or hung application no longer holds up the others:
+
+  for match in iterDescendantsParallel(getDesktop(), pred):
+    ...
+
+  Matches are generated in the order they are found, which varies from run
+  to run. Once limit matches were generated, the timeout expired or the
+  generator is closed, the remaining work is cancelled; workers stop at the
+  next node, or as soon as a hung call returns.
+
+  When the workers cannot use the calling thread's accessibles as they are,
+  such as on a thread in a single-threaded COM apartment, the children of acc
+  are marshaled to them and every match marshaled back (see
+  L{pyia.backend.Backend.sharesAccessibles}).
+
+  @param acc: Root accessible of the search, not itself tested
+  @type acc: Accessibility.Accessible
+  @param pred: Search predicate returning True if accessible matches the
+  search criteria or False otherwise, a selector (see L{pyia.selector}), or
+  None to match everything
+  @type pred: callable, string or L{Selector}
+  @param workers: Number of worker threads
+  @type workers: integer
+  @param split_depth: Levels below acc whose nodes each get a task of their
+  own. 1 searches the children of acc in parallel, 2 their children too,
+  which helps when a single application holds most of the tree.
+  @type split_depth: integer
+  @param max_depth: Deepest level to visit, or None for no limit
+  @type max_depth: integer
+  @param limit: Stop after this many matches, or None for no limit
+  @type limit: integer
+  @param prune: Called with each descendant before it is tested; returning
+  True skips it along with its whole subtree
+  @type prune: callable
+  @param timeout: Seconds after which to give up on the search, or None to
+  wait for all of it
+  @type timeout: float
+  @return: Matching accessibles
+  @rtype: generator
+  '''
+  if limit is not None and limit <= 0:
+    return
+  marshal = not getBackend().sharesAccessibles()
+  if isinstance(pred, str):
+    pred = compileSelector(pred)
+  search = _ParallelSearch(pred, workers, max(split_depth, 1), max_depth,
+                           prune, marshal)
+  try:
+    deadline = None
+    if timeout is not None:
+      deadline = time.time() + timeout
+    steps = None
+    if isinstance(pred, Selector):
+      steps = pred.start
+    try:
+      for child in acc:
+        if marshal:
+          try:
+            child = _marshal(child)
+          except Exception:
+            continue
+        search.submit(child, 1, steps, marshal)
+    except Exception:
+      pass
+    search.taskDone()
+    found = 0
+    while True:
+      if deadline is None:
+        match = search.results.get()
+      else:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return
+        try:
+          match = search.results.get(timeout=remaining)
+        except queue.Empty:
+          return
+      if match is _SEARCH_DONE:
+        return
+      if marshal:
+        try:
+          match = _unmarshal(match)
+        except Exception:
+          continue
+      yield match
+      found += 1
+      if found == limit:
+        return
+  finally:
+    search.cancel()
+    if marshal:
+      search.discard()
+
+def findDescendant(acc, pred, breadth_first=False, max_depth=None,
+                   prune=None, workers=None):
+  '''
+  Searches for a descendant node satisfying the given predicate starting at 
+  this node. The search is performed in depth-first order by default or
+  in breadth first order if breadth_first is True. For example,
+  
+  my_win = findDescendant(lambda x: x.name == 'My Window')
+  
+  will search all descendants of x until one is located with the name 'My
+  Window' or all nodes are exausted. See L{iterDescendants}, which does the
+  search, for max_depth and prune. Given a number of workers, the subtrees
+  of the children of acc are searched in parallel instead, see
+  L{iterDescendantsParallel}; any match may be returned then, not
+  necessarily the first in tree order.
   
   @param acc: Root accessible of the search
   @type acc: Accessibility.Accessible
   @param pred: Search predicate returning True if accessible matches the 
-  search criteria or False otherwise
-  @type pred: callable
-  @return: Matching node or None to keep searching
+  search criteria or False otherwise, or a selector (see L{pyia.selector})
+  @type pred: callable, string or L{Selector}
+  @param breadth_first: Search breadth first (True) or depth first (False)?
+  @type breadth_first: boolean
+  @return: Accessible matching the criteria or None if not found
   @rtype: Accessibility.Accessible or None
   '''
-  try:
-    if pred(acc): return acc
-  except Exception:
-    pass
-  for child in acc:
-    try:
-      ret = _findDescendantDepth(child, pred)
-    except Exception:
-      ret = None
-    if ret is not None: return ret
+  if workers:
+    matches = iterDescendantsParallel(acc, pred, workers, max_depth=max_depth,
+                                      limit=1, prune=prune)
+  else:
+    matches = iterDescendants(acc, pred, breadth_first, max_depth, 1, prune)
+  for match in matches:
+    return match
+  return None
    
-def findAllDescendants(acc, pred):
+def findAllDescendants(acc, pred, breadth_first=False, max_depth=None,
+                       limit=None, prune=None, workers=None):
   '''
   Searches for all descendant nodes satisfying the given predicate starting at 
-  this node. Does an in-order traversal. For example,
+  this node. Does an in-order traversal unless breadth_first is True. For
+  example,
   
   pred = lambda x: x.getRole() == pyatspi.ROLE_PUSH_BUTTON
   buttons = pyatspi.findAllDescendants(node, pred)
   
-  will locate all push button descendants of node.
+  will locate all push button descendants of node. See L{iterDescendants},
+  which does the search, for max_depth, limit and prune, and to consume
+  matches as they are found. Given a number of workers, the subtrees of the
+  children of acc are searched in parallel and matches come in the order
+  they were found, see L{iterDescendantsParallel}.
   
   @param acc: Root accessible of the search
   @type acc: Accessibility.Accessible
   @param pred: Search predicate returning True if accessible matches the 
-      search criteria or False otherwise
-  @type pred: callable
+      search criteria or False otherwise, or a selector (see
+      L{pyia.selector})
+  @type pred: callable, string or L{Selector}
   @return: All nodes matching the search criteria
   @rtype: list
   '''
-  matches = []
-  _findAllDescendants(acc, pred, matches)
-  return matches
-
-def _findAllDescendants(acc, pred, matches):
-  '''
-  Internal method for collecting all descendants. Reuses the same matches
-  list so a new one does not need to be built on each recursive step.
-  '''
-  for child in acc:
-    try:
-      if pred(child): matches.append(child)
-    except Exception:
-      pass
-    _findAllDescendants(child, pred, matches)
+  if workers:
+    return list(iterDescendantsParallel(acc, pred, workers,
+                                        max_depth=max_depth, limit=limit,
+                                        prune=prune))
+  return list(iterDescendants(acc, pred, breadth_first, max_depth, limit,
+                              prune))
 
 def findAncestor(acc, pred):
     if acc is None:
@@ -184,7 +493,7 @@ def findAncestor(acc, pred):
         return None
     while 1:
         try:
-            parent = acc.accParent.QueryInterface(IAccessible)
+            parent = acc.accParent.QueryInterface(getBackend().IAccessible)
         except:
             parent = None
         if parent is None:
@@ -205,21 +514,18 @@ def printSubtree(acc, indent=0):
     except:
       pass
 
+def refreshLocalizedText():
+  '''
+  Rereads the localized role and state text pyia keeps, after the system
+  language changed.
+  '''
+  getBackend().refreshLocalizedText()
+
 def windowFromAccessibleObject(acc):
-  hwnd = c_int()
-  try:
-    res = windll.oleacc.WindowFromAccessibleObject(acc, byref(hwnd))
-  except:
-    res = 0
-  if res == 0:
-    return hwnd.value
-  else:
-    return 0
+  return getBackend().windowFromAccessibleObject(acc)
 
 def getWindowThreadProcessID(hwnd):
-  processID = c_int()
-  threadID = windll.user32.GetWindowThreadProcessId(hwnd,byref(processID))
-  return (processID.value, threadID)
+  return getBackend().getWindowThreadProcessID(hwnd)
 
 def getAccessibleThreadProcessID(acc):
   hwnd = windowFromAccessibleObject(acc)
@@ -0,0 +1,205 @@
+'''
+The real MSAA backend, built on comtypes, oleacc.dll and user32.dll.
+
+@author: Eitan Isaacson
+@copyright: Copyright (c) 2008, Eitan Isaacson
+@license: LGPL
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License as published by the Free Software Foundation; either
+version 2 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+
+You should have received a copy of the GNU Library General Public
+License along with this library; if not, write to the
+Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+Boston, MA 02111-1307, USA.
+'''
+
+from ctypes import CFUNCTYPE, POINTER, byref, c_int, c_long, c_voidp, \
+    create_unicode_buffer, oledll, windll
+from comtypes.client import PumpEvents
+try:
+    # comtypes keeps generated typelib wrappers in comtypes.gen, so only the
+    # very first run needs to pay for GetModule().
+    from comtypes.gen.Accessibility import IAccessible
+except ImportError:
+    from comtypes.client import GetModule
+    GetModule('oleacc.dll')
+    from comtypes.gen.Accessibility import IAccessible
+    del GetModule
+from comtypes.automation import VARIANT, VT_I4, VT_DISPATCH
+from comtypes import named_property, COMError, CoInitializeEx, \
+    CoUninitialize, COINIT_MULTITHREADED
+from .backend import Backend
+
+# CoGetApartmentType() types of single-threaded apartments
+APTTYPE_STA = 0
+APTTYPE_MAINSTA = 3
+
+WINEVENTPROC = CFUNCTYPE(c_voidp, c_int, c_int, c_int, c_int, c_int, c_int,
+                         c_int)
+
+class WindowsBackend(Backend):
+    name = 'windows'
+    IAccessible = IAccessible
+    COMError = COMError
+    named_property = named_property
+
+    def __init__(self):
+        # Keep the ctypes callbacks alive for as long as their hook is.
+        self._hook_procs = {}
+
+    def _fetchChildren(self, acc, start, count, rgvarChildren):
+        pcObtained = c_long()
+        try:
+            oledll.oleacc.AccessibleChildren(acc, start, count,
+                                             rgvarChildren, byref(pcObtained))
+        except:
+            return []
+        children = []
+        for i in range(pcObtained.value):
+            child = rgvarChildren[i]
+            if child.vt == VT_I4:
+                children.append(child.value)
+            elif child.vt == VT_DISPATCH:
+                children.append(child.value.QueryInterface(IAccessible))
+            # Drop the array's reference; the children we keep hold their own.
+            oledll.oleaut32.VariantClear(byref(child))
+        return children
+
+    def accessibleChildren(self, acc, start, count):
+        return self._fetchChildren(acc, start, count, (VARIANT * count)())
+
+    def iterChildren(self, acc, count, chunk_size):
+        chunk_size = min(chunk_size, count)
+        if chunk_size <= 0:
+            return
+        rgvarChildren = (VARIANT * chunk_size)()
+        start = 0
+        while start < count:
+            n = min(chunk_size, count - start)
+            children = self._fetchChildren(acc, start, n, rgvarChildren)
+            for child in children:
+                yield child
+            if len(children) < n:
+                return
+            start += n
+
+    def accessibleObjectFromWindow(self, hwnd, object_id=0):
+        ptr = POINTER(IAccessible)()
+        oledll.oleacc.AccessibleObjectFromWindow(
+            hwnd, object_id, byref(IAccessible._iid_), byref(ptr))
+        return ptr
+
+    def accessibleObjectFromEvent(self, hwnd, object_id, child_id):
+        ptr = POINTER(IAccessible)()
+        varChild = VARIANT()
+        res = windll.oleacc.AccessibleObjectFromEvent(
+            hwnd, object_id, child_id, byref(ptr), byref(varChild))
+        if res == 0:
+            return ptr.QueryInterface(IAccessible), varChild.value
+        return None
+
+    def windowFromAccessibleObject(self, acc):
+        hwnd = c_int()
+        try:
+            res = windll.oleacc.WindowFromAccessibleObject(acc, byref(hwnd))
+        except:
+            res = 0
+        if res == 0:
+            return hwnd.value
+        return 0
+
+    def getWindowThreadProcessID(self, hwnd):
+        processID = c_int()
+        threadID = windll.user32.GetWindowThreadProcessId(
+            hwnd, byref(processID))
+        return (processID.value, threadID)
+
+    def getDesktopWindow(self):
+        return windll.user32.GetDesktopWindow()
+
+    def getForegroundWindow(self):
+        return windll.user32.GetForegroundWindow()
+
+    def isWindow(self, hwnd):
+        return bool(windll.user32.IsWindow(hwnd))
+
+    def isChildWindow(self, parent, hwnd):
+        return bool(windll.user32.IsChild(parent, hwnd))
+
+    def _getText(self, func, value):
+        # Try a buffer that fits any role or state name seen in practice
+        # first, asking for the length only if it was too small.
+        buf = create_unicode_buffer(64)
+        length = func(value, buf, len(buf))
+        if length < len(buf) - 1:
+            return buf.value
+        length = func(value, 0, 0)
+        buf = create_unicode_buffer(length + 2)
+        func(value, buf, length + 1)
+        return buf.value
+
+    def getRoleText(self, role):
+        return self._getText(oledll.oleacc.GetRoleTextW, role)
+
+    def getStateText(self, state_bit):
+        return self._getText(oledll.oleacc.GetStateTextW, state_bit)
+
+    def setWinEventHook(self, event_min, event_max, callback,
+                        process_id=0, thread_id=0, flags=0):
+        proc = WINEVENTPROC(callback)
+        hook_id = windll.user32.SetWinEventHook(
+            event_min, event_max, 0, proc, process_id, thread_id, flags)
+        if hook_id:
+            self._hook_procs[hook_id] = proc
+        return hook_id
+
+    def unhookWinEvent(self, hook_id):
+        if not windll.user32.UnhookWinEvent(hook_id):
+            # The hook is still installed, so its callback must stay alive.
+            return False
+        self._hook_procs.pop(hook_id, None)
+        return True
+
+    def initThread(self):
+        CoInitializeEx(COINIT_MULTITHREADED)
+
+    def uninitThread(self):
+        CoUninitialize()
+
+    def sharesAccessibles(self):
+        # Worker threads join the multithreaded apartment. Interface pointers
+        # of a single-threaded one fail there unless marshaled.
+        apartment = c_int()
+        qualifier = c_int()
+        try:
+            oledll.ole32.CoGetApartmentType(byref(apartment),
+                                            byref(qualifier))
+        except OSError:
+            # COM is not initialized on this thread, so it holds no
+            # accessibles.
+            return True
+        return apartment.value not in (APTTYPE_STA, APTTYPE_MAINSTA)
+
+    def marshalAccessible(self, acc):
+        stream = c_voidp()
+        oledll.ole32.CoMarshalInterThreadInterfaceInStream(
+            byref(IAccessible._iid_), acc, byref(stream))
+        return stream
+
+    def unmarshalAccessible(self, marshaled):
+        acc = POINTER(IAccessible)()
+        # Releases the stream, whether or not it succeeds.
+        oledll.ole32.CoGetInterfaceAndReleaseStream(
+            marshaled, byref(IAccessible._iid_), byref(acc))
+        return acc
+
+    def pumpEvents(self, timeout):
+        PumpEvents(timeout)
@@ -0,0 +1,90 @@
+'''
+Tests for child access through L{pyia.accessible}: indexing, chunked
+iteration, memoized children and simple children.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.accessible import CHILD_CHUNK_SIZE, ManagedChildAccessible
+
+class ChildrenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+        self.backend.buildTree(self.app, 10, 1)
+        for i in range(5):
+            self.app.addSimpleChild(name='s%d' % i,
+                                    role=constants.ROLE_SYSTEM_LISTITEM)
+        self.backend.resetCalls()
+
+    def names(self, children):
+        return [child.accName() for child in children]
+
+class IndexTest(ChildrenTestCase):
+    def testIndex(self):
+        self.assertEqual(self.app[3].accName(), 'item 3')
+        self.assertEqual(self.app[-1].accName(), 's4')
+        self.assertRaises(IndexError, lambda: self.app[15])
+        self.assertRaises(IndexError, lambda: self.app[-16])
+
+    def testFetchesOnlyTheChild(self):
+        self.app[7]
+        # One AccessibleChildren call for one child, not the whole list.
+        self.assertEqual(self.backend.calls['AccessibleChildren'], 1)
+
+    def testSlices(self):
+        self.assertEqual(self.names(self.app[2:5]),
+                         ['item 2', 'item 3', 'item 4'])
+        self.assertEqual(self.names(self.app[::-4]),
+                         ['s4', 's0', 'item 6', 'item 2'])
+        self.assertEqual(self.app[20:], [])
+
+    def testMemoized(self):
+        with pyia.memoizedChildren():
+            for i in range(len(self.app)):
+                self.app[i]
+            children = list(self.app)
+        self.assertEqual(len(children), 15)
+        self.assertEqual(self.backend.calls['AccessibleChildren'], 1)
+
+class IterationTest(ChildrenTestCase):
+    def testChunks(self):
+        for i in range(1000):
+            self.app.addSimpleChild(name='more %d' % i)
+        self.backend.resetCalls()
+        self.assertEqual(len(list(self.app)), 1015)
+        chunks = -(-1015 // CHILD_CHUNK_SIZE)
+        self.assertEqual(self.backend.calls['AccessibleChildren'], chunks)
+        self.backend.resetCalls()
+        self.assertEqual(len(list(self.app.iterChildren(7))), 1015)
+        self.assertEqual(self.backend.calls['AccessibleChildren'],
+                         -(-1015 // 7))
+
+    def testFirstChildRightAway(self):
+        children = self.app.iterChildren(4)
+        self.assertEqual(next(children).accName(), 'item 0')
+        self.assertEqual(self.backend.calls['AccessibleChildren'], 1)
+
+class SimpleChildTest(ChildrenTestCase):
+    def testFlyweight(self):
+        child = self.app[12]
+        self.assertIsInstance(child, ManagedChildAccessible)
+        self.assertFalse(hasattr(child, '__dict__'))
+        self.assertEqual(child.accName(), 's2')
+        self.assertEqual(child.accRoleName(), 'list item')
+        self.assertIs(child.accParent, self.app)
+        self.assertEqual(child, self.app[12])
+        self.assertEqual(hash(child), hash(self.app[12]))
+        self.assertRaises(AttributeError, getattr, child, 'bogus')
+
+    def testSimpleChildren(self):
+        children = self.app.simpleChildren()
+        self.assertEqual(len(children), 5)
+        self.assertEqual(children[3].accName(), 's3')
+        self.assertEqual(list(children.get('accName')),
+                         ['s0', 's1', 's2', 's3', 's4'])
+
+if __name__ == '__main__':
+    unittest.main()
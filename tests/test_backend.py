@@ -0,0 +1,122 @@
+'''
+Tests for L{pyia.backend}.
+'''
+
+import os
+import subprocess
+import sys
+import unittest
+
+import pyia
+from pyia import backend, constants
+from pyia.simulated import SimulatedBackend, SimulatedAccessible
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class LanguageBackend(SimulatedBackend):
+    '''
+    Prefixes role and state text with a language that can be switched.
+    '''
+    language = 'en'
+
+    def getRoleText(self, role):
+        return '%s:%s' % (self.language,
+                          SimulatedBackend.getRoleText(self, role))
+
+    def getStateText(self, state_bit):
+        return '%s:%s' % (self.language,
+                          SimulatedBackend.getStateText(self, state_bit))
+
+class BackendTest(unittest.TestCase):
+    def testByName(self):
+        active = pyia.setBackend('simulated')
+        self.assertIsInstance(active, SimulatedBackend)
+        self.assertIs(pyia.getBackend(), active)
+        self.assertIs(pyia.IAccessible, SimulatedAccessible)
+
+    def testByInstance(self):
+        instance = SimulatedBackend(latency=0.0)
+        self.assertIs(pyia.setBackend(instance), instance)
+        self.assertIs(pyia.getBackend(), instance)
+
+    def testUnknown(self):
+        active = pyia.setBackend('simulated')
+        self.assertRaises(ValueError, pyia.setBackend, 'no such backend')
+        self.assertIs(pyia.getBackend(), active)
+
+    def testMixins(self):
+        active = pyia.setBackend('simulated')
+        app = active.createWindow(name='App')
+        self.assertEqual(str(app), '[client | App]')
+        self.assertEqual(app.accRoleName(), 'client')
+        self.assertTrue(SimulatedAccessible._pyia_mixed)
+
+    def testEnvironment(self):
+        # The backend is picked from PYIA_BACKEND on first use, and the
+        # simulated one never loads comtypes.
+        env = dict(os.environ, PYIA_BACKEND='simulated', PYTHONPATH=ROOT)
+        out = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, pyia; '
+             'print(pyia.getBackend().name, "comtypes" in sys.modules)'],
+            env=env, cwd=ROOT)
+        self.assertEqual(out.split(), [b'simulated', b'False'])
+
+    def testRoundTrips(self):
+        active = pyia.setBackend(SimulatedBackend())
+        app = active.createWindow(name='App')
+        active.resetCalls()
+        app.accName()
+        app.accName()
+        self.assertEqual(active.calls['accName'], 2)
+        self.assertIsInstance(backend.getBackend(), SimulatedBackend)
+
+class LocalizedTextTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend(SimulatedBackend())
+
+    def testTablesReadOnce(self):
+        self.assertEqual(
+            self.backend.localizedRoleText(constants.ROLE_SYSTEM_CLIENT),
+            'client')
+        self.assertEqual(self.backend.calls['GetRoleTextW'],
+                         len(constants.UNLOCALIZED_ROLE_NAMES))
+        self.assertEqual(self.backend.calls['GetStateTextW'],
+                         len(constants.UNLOCALIZED_STATE_NAMES))
+        self.backend.resetCalls()
+        self.backend.localizedRoleText(constants.ROLE_SYSTEM_CLIENT)
+        self.assertEqual(
+            self.backend.localizedStateText(constants.STATE_SYSTEM_FOCUSED),
+            'focused')
+        self.assertEqual(sum(self.backend.calls.values()), 0)
+
+    def testUnknownValues(self):
+        self.backend.localizedRoleText(constants.ROLE_SYSTEM_CLIENT)
+        self.backend.resetCalls()
+        for i in range(3):
+            self.assertEqual(self.backend.localizedRoleText(0x1234),
+                             'unknown object')
+            self.assertEqual(self.backend.localizedStateText(1 << 31), '')
+        # Read once when first asked for, then kept.
+        self.assertEqual(self.backend.calls['GetRoleTextW'], 1)
+        self.assertEqual(self.backend.calls['GetStateTextW'], 1)
+
+    def testRefresh(self):
+        active = pyia.setBackend(LanguageBackend())
+        app = active.createWindow(name='App')
+        self.assertEqual(app.accLocalizedRoleName(), 'en:client')
+        self.assertEqual(active.localizedRoleText(0x1234),
+                         'en:unknown object')
+        active.language = 'fr'
+        # Kept until the tables are read again.
+        self.assertEqual(app.accLocalizedRoleName(), 'en:client')
+        pyia.refreshLocalizedText()
+        self.assertEqual(app.accLocalizedRoleName(), 'fr:client')
+        self.assertEqual(
+            active.localizedStateText(constants.STATE_SYSTEM_FOCUSED),
+            'fr:focused')
+        self.assertEqual(active.localizedRoleText(0x1234),
+                         'fr:unknown object')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+'''
+Tests for L{pyia.cache}, invalidated by events fired on the simulated
+backend.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.constants import CHILDID_SELF
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.cache = self.registry.enablePropertyCache(max_entries=16)
+        self.app = self.backend.createWindow(name='App')
+        self.list = self.backend.createAccessible(
+            self.app, name='List', role=constants.ROLE_SYSTEM_LIST)
+        self.item = self.list.addSimpleChild(
+            name='first', role=constants.ROLE_SYSTEM_LISTITEM)
+        self.wrapped = self.cache.wrap(self.list, self.list.hwnd,
+                                       self.list.object_id)
+
+    def tearDown(self):
+        self.registry.clearListeners()
+
+    def fire(self, event_type, child_id=CHILDID_SELF):
+        self.backend.fireEvent(event_type, self.list.hwnd,
+                               self.list.object_id, child_id)
+
+    def calls(self, method):
+        return self.backend.calls[method]
+
+class CachedAccessibleTest(CacheTestCase):
+    def testHits(self):
+        self.assertEqual(self.wrapped.accName(), 'List')
+        self.assertEqual(self.wrapped.accName(CHILDID_SELF), 'List')
+        self.assertEqual(self.calls('accName'), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.wrapped.accRoleName(), 'list')
+        self.assertEqual(self.wrapped.accChildCount, 1)
+
+    def testSimpleChild(self):
+        self.assertEqual(self.wrapped.accName(self.item), 'first')
+        self.assertEqual(self.wrapped.accName(self.item), 'first')
+        self.assertEqual(self.wrapped.accName(), 'List')
+        self.assertEqual(self.calls('accName'), 2)
+        child = self.cache.wrap(self.list, self.list.hwnd,
+                                self.list.object_id, self.item)
+        self.assertEqual(child.accName(), 'first')
+        self.assertEqual(child.accRoleName(), 'list item')
+        self.assertEqual(self.calls('accName'), 2)
+
+    def testPropertyChange(self):
+        self.wrapped.accName()
+        self.wrapped.accState()
+        self.list.setProperties(name='Renamed',
+                                state=constants.STATE_SYSTEM_FOCUSED)
+        self.assertEqual(self.wrapped.accName(), 'List')
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE)
+        self.assertEqual(self.wrapped.accName(), 'Renamed')
+        # Only the property named by the event is dropped.
+        self.assertEqual(self.wrapped.accState(), 0)
+        self.fire(constants.EVENT_OBJECT_STATECHANGE)
+        self.assertIn('focused', self.wrapped.accStateSet())
+
+    def testSimpleChildChange(self):
+        self.wrapped.accName()
+        self.wrapped.accName(self.item)
+        self.list.setProperties(self.item, name='changed')
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.item)
+        self.assertEqual(self.wrapped.accName(self.item), 'changed')
+        self.assertEqual(self.calls('accName'), 3)
+        self.wrapped.accName()
+        self.assertEqual(self.calls('accName'), 3)
+
+    def testReorder(self):
+        self.wrapped.accName()
+        self.wrapped.accName(self.item)
+        self.fire(constants.EVENT_OBJECT_REORDER)
+        self.assertEqual(len(self.cache), 0)
+
+    def testDestroy(self):
+        self.wrapped.accName()
+        self.wrapped.accName(self.item)
+        self.fire(constants.EVENT_OBJECT_DESTROY, self.item)
+        self.assertEqual(len(self.cache), 1)
+        self.fire(constants.EVENT_OBJECT_DESTROY)
+        self.assertEqual(len(self.cache), 0)
+
+    def testEviction(self):
+        for i in range(20):
+            self.wrapped.accName(self.list.addSimpleChild(name=str(i)))
+        self.assertEqual(len(self.cache), 16)
+        self.assertEqual(self.cache.stats()['evictions'], 4)
+
+    def testFromEvent(self):
+        seen = []
+        def listener(event):
+            seen.append(self.cache.fromEvent(event).accName())
+        self.registry.registerEventListener(
+            listener, constants.EVENT_OBJECT_NAMECHANGE)
+        self.list.setProperties(self.item, name='second')
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.item)
+        self.assertEqual(seen, ['second'])
+
+    def testDisable(self):
+        self.registry.disablePropertyCache()
+        self.assertIsNone(self.registry.property_cache)
+        self.assertEqual(self.registry.hooks, {})
+
+if __name__ == '__main__':
+    unittest.main()
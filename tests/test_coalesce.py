@@ -0,0 +1,108 @@
+'''
+Tests for L{pyia.coalesce}, through the registry and events fired on the
+simulated backend.
+'''
+
+import time
+import unittest
+
+import pyia
+from pyia import constants
+
+class CoalesceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.app = self.backend.createWindow(name='App', pid=5)
+        self.other = self.backend.createWindow(name='Other', pid=20)
+        self.got = []
+
+    def tearDown(self):
+        self.registry.disableCoalescing()
+        self.registry.clearListeners()
+
+    def listen(self, *event_types, **kwargs):
+        tag = kwargs.pop('tag', None)
+        self.registry.registerEventListener(
+            lambda event: self.got.append(
+                (tag, event.type, event.hwnd, event.timestamp)),
+            *event_types, **kwargs)
+
+    def fire(self, event_type, acc, timestamp):
+        self.backend.fireEvent(event_type, acc.hwnd, timestamp=timestamp)
+
+    def testBurst(self):
+        coalescer = self.registry.enableCoalescing(window=60)
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE)
+        for i in range(50):
+            self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, i)
+        self.assertEqual(self.got, [])
+        self.registry.disableCoalescing()
+        # Only the latest event of the burst is delivered.
+        self.assertEqual(self.got, [
+            (None, constants.EVENT_OBJECT_NAMECHANGE, self.app.hwnd, 49)])
+        self.assertEqual(coalescer.stats(),
+                         {'pending': 0, 'suppressed': 49, 'dispatched': 1})
+
+    def testDistinctKeys(self):
+        self.registry.enableCoalescing(window=60)
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE,
+                    constants.EVENT_OBJECT_VALUECHANGE)
+        for i in range(2):
+            self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, i)
+            self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.other, i)
+            self.fire(constants.EVENT_OBJECT_VALUECHANGE, self.app, i)
+        self.registry.disableCoalescing()
+        self.assertEqual(self.got, [
+            (None, constants.EVENT_OBJECT_NAMECHANGE, self.app.hwnd, 1),
+            (None, constants.EVENT_OBJECT_NAMECHANGE, self.other.hwnd, 1),
+            (None, constants.EVENT_OBJECT_VALUECHANGE, self.app.hwnd, 1)])
+
+    def testDistinctScopes(self):
+        self.registry.enableCoalescing(window=60)
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE, tag='all')
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE, tag='process',
+                    process_id=5)
+        for i in range(3):
+            self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, i)
+        self.registry.disableCoalescing()
+        # Each scope gets the latest event once; neither swallows the
+        # other's.
+        self.assertEqual(sorted(self.got), [
+            ('all', constants.EVENT_OBJECT_NAMECHANGE, self.app.hwnd, 2),
+            ('process', constants.EVENT_OBJECT_NAMECHANGE, self.app.hwnd,
+             2)])
+
+    def testOtherTypesPassThrough(self):
+        self.registry.enableCoalescing(window=60)
+        self.listen(constants.EVENT_OBJECT_FOCUS)
+        for i in range(3):
+            self.fire(constants.EVENT_OBJECT_FOCUS, self.app, i)
+        self.assertEqual(len(self.got), 3)
+
+    def testMaxDepthFlushes(self):
+        coalescer = self.registry.enableCoalescing(window=60, max_depth=3)
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE,
+                    constants.EVENT_OBJECT_VALUECHANGE)
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, 0)
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.other, 0)
+        self.assertEqual(len(coalescer), 2)
+        self.fire(constants.EVENT_OBJECT_VALUECHANGE, self.app, 0)
+        self.assertEqual(len(coalescer), 0)
+        self.assertEqual(len(self.got), 3)
+
+    def testWindowExpires(self):
+        coalescer = self.registry.enableCoalescing(window=0.01)
+        self.listen(constants.EVENT_OBJECT_NAMECHANGE)
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, 0)
+        self.fire(constants.EVENT_OBJECT_NAMECHANGE, self.app, 1)
+        self.assertEqual(self.got, [])
+        time.sleep(0.02)
+        self.registry.iter_loop(0.02)
+        self.assertEqual(self.got, [
+            (None, constants.EVENT_OBJECT_NAMECHANGE, self.app.hwnd, 1)])
+        self.assertEqual(len(coalescer), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+'''
+Tests for L{pyia.dispatch} and the parallel search running on it.
+'''
+
+import threading
+import time
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.dispatch import WorkerPool, QueuedListener, DISPATCH_POOL, \
+    OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST
+from pyia.simulated import SimulatedBackend
+
+class ApartmentBackend(SimulatedBackend):
+    '''
+    Stands in for Windows with the creating thread in a single-threaded
+    apartment, whose accessibles other threads must unmarshal.
+    '''
+    def __init__(self):
+        SimulatedBackend.__init__(self)
+        self.caller = threading.current_thread()
+        self.marshaled = []
+        self.unmarshaled = []
+
+    def sharesAccessibles(self):
+        return threading.current_thread() is not self.caller
+
+    def marshalAccessible(self, acc):
+        self.marshaled.append(threading.current_thread().name)
+        return [acc]
+
+    def unmarshalAccessible(self, marshaled):
+        self.unmarshaled.append(threading.current_thread().name)
+        # Like a stream, it can only be unpacked once.
+        return marshaled.pop()
+
+class ManualPool(object):
+    '''
+    Runs submitted work only when told to.
+    '''
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, func):
+        self.tasks.append(func)
+
+    def run(self):
+        while self.tasks:
+            self.tasks.pop(0)()
+
+def workerThreads():
+    return [t for t in threading.enumerate()
+            if t.name.startswith('pyia-worker')]
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        pyia.setBackend('simulated')
+
+    def testRuns(self):
+        pool = WorkerPool(2)
+        done = threading.Event()
+        pool.submit(done.set)
+        self.assertTrue(done.wait(5))
+        pool.shutdown()
+
+    def testSubmitAfterShutdown(self):
+        pool = WorkerPool(2)
+        pool.submit(lambda: None)
+        pool.shutdown()
+        self.assertRaises(RuntimeError, pool.submit, lambda: None)
+        self.assertEqual(pool._threads, [])
+
+class QueuedListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ManualPool()
+        self.got = []
+
+    def listener(self, maxsize, overflow):
+        return QueuedListener(self.got.append, self.pool, maxsize, overflow)
+
+    def testDropOldest(self):
+        listener = self.listener(3, OVERFLOW_DROP_OLDEST)
+        for i in range(5):
+            listener(i)
+        self.pool.run()
+        self.assertEqual(self.got, [2, 3, 4])
+        self.assertEqual(listener.stats(),
+                         {'depth': 0, 'delivered': 3, 'dropped': 2})
+
+    def testDropNewest(self):
+        listener = self.listener(3, OVERFLOW_DROP_NEWEST)
+        for i in range(5):
+            listener(i)
+        self.assertEqual(listener.depth, 3)
+        self.pool.run()
+        self.assertEqual(self.got, [0, 1, 2])
+        self.assertEqual(listener.stats(),
+                         {'depth': 0, 'delivered': 3, 'dropped': 2})
+
+    def testBlock(self):
+        listener = self.listener(2, OVERFLOW_BLOCK)
+        producer = threading.Thread(
+            target=lambda: [listener(i) for i in range(4)])
+        producer.start()
+        deadline = time.monotonic() + 5
+        while listener.depth < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        # The producer waits for room rather than dropping anything.
+        self.assertTrue(producer.is_alive())
+        while (producer.is_alive() or self.pool.tasks) and \
+                time.monotonic() < deadline:
+            self.pool.run()
+            time.sleep(0.001)
+        producer.join(5)
+        self.assertEqual(self.got, [0, 1, 2, 3])
+        self.assertEqual(listener.dropped, 0)
+
+    def testUnknownOverflow(self):
+        self.assertRaises(ValueError, self.listener, 3, 'spill')
+
+    def testSubmitAfterShutdown(self):
+        pool = WorkerPool(1)
+        pool.shutdown()
+        listener = QueuedListener(self.got.append, pool)
+        self.assertRaises(RuntimeError, listener, 0)
+
+class PoolDispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.app = self.backend.createWindow(name='App')
+
+    def tearDown(self):
+        self.registry.clearListeners()
+
+    def testListenerStats(self):
+        got = []
+        done = threading.Event()
+
+        def listener(event):
+            got.append(event.hwnd)
+            if len(got) == 10:
+                done.set()
+        self.registry.registerEventListener(
+            listener, constants.EVENT_OBJECT_FOCUS, dispatch=DISPATCH_POOL)
+        for i in range(10):
+            self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS,
+                                   self.app.hwnd)
+        self.assertTrue(done.wait(5))
+        stats = self.registry.listenerStats()
+        self.assertEqual(list(stats), [listener])
+        self.assertEqual(stats[listener]['dropped'], 0)
+        deadline = time.monotonic() + 5
+        while stats[listener]['delivered'] < 10 and \
+                time.monotonic() < deadline:
+            time.sleep(0.001)
+            stats = self.registry.listenerStats()
+        self.assertEqual(stats[listener]['delivered'], 10)
+        self.registry.deregisterEventListener(listener,
+                                              constants.EVENT_OBJECT_FOCUS)
+        self.assertEqual(self.registry.listenerStats(), {})
+
+    def testDeregisterInlineAndPool(self):
+        listener = lambda event: None
+        self.registry.registerEventListener(listener,
+                                            constants.EVENT_OBJECT_FOCUS)
+        self.registry.registerEventListener(
+            listener, constants.EVENT_OBJECT_FOCUS, dispatch=DISPATCH_POOL)
+        self.registry.deregisterEventListener(listener,
+                                              constants.EVENT_OBJECT_FOCUS)
+        self.assertEqual(self.registry.clients, {})
+        self.assertEqual(self.registry.hooks, {})
+        self.assertEqual(self.registry.listenerStats(), {})
+
+class ParallelSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        for pid in range(1, 5):
+            app = self.backend.createWindow(name='App %d' % pid, pid=pid)
+            self.backend.buildTree(app, 3, 3)
+        self.root = self.backend.desktop_client
+
+    def testFindsEverything(self):
+        expected = set(pyia.iterDescendants(self.root))
+        found = list(pyia.iterDescendantsParallel(self.root, workers=4))
+        self.assertEqual(len(found), len(expected))
+        self.assertEqual(set(found), expected)
+
+    def testCancelledSearchesStopWorkers(self):
+        self.backend.latency = 0.0005
+        before = len(workerThreads())
+        for i in range(5):
+            matches = pyia.iterDescendantsParallel(self.root, workers=4,
+                                                   split_depth=2)
+            next(matches)
+            matches.close()
+        deadline = time.monotonic() + 5
+        while len(workerThreads()) > before and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(workerThreads()), before)
+
+    def testUnsharedAccessibles(self):
+        backend = pyia.setBackend(ApartmentBackend())
+        for pid in range(1, 5):
+            app = backend.createWindow(name='App %d' % pid, pid=pid)
+            backend.buildTree(app, 3, 2, simple_leaves=True)
+        root = backend.desktop_client
+        expected = set(pyia.iterDescendants(root))
+        found = list(pyia.iterDescendantsParallel(root, workers=4))
+        self.assertEqual(len(found), len(expected))
+        self.assertEqual(set(found), expected)
+        # The four windows went to the workers marshaled, and every match
+        # came back the same way.
+        caller = threading.current_thread().name
+        self.assertEqual(backend.marshaled.count(caller), 4)
+        self.assertEqual(backend.unmarshaled.count(caller), len(found))
+        self.assertEqual(len(backend.unmarshaled), len(found) + 4)
+
+    def testUnsharedAccessiblesCancelled(self):
+        backend = pyia.setBackend(ApartmentBackend())
+        app = backend.createWindow(name='App', pid=1)
+        backend.buildTree(app, 10, 2)
+        matches = pyia.iterDescendantsParallel(backend.desktop_client,
+                                               workers=2)
+        next(matches)
+        matches.close()
+        # Everything marshaled is unpacked, and so released, once running
+        # tasks see the search was cancelled.
+        deadline = time.monotonic() + 5
+        while len(backend.unmarshaled) < len(backend.marshaled) and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(backend.unmarshaled), len(backend.marshaled))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+'''
+Tests for L{pyia.event}.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.event import Event, SOURCE_LAZY, SOURCE_EAGER, SOURCE_NEVER
+
+class EventTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+
+    def event(self, resolve):
+        return Event(constants.EVENT_OBJECT_FOCUS, self.app.hwnd,
+                     constants.OBJID_CLIENT, constants.CHILDID_SELF, 1, 0,
+                     resolve)
+
+    def testLazy(self):
+        event = self.event(SOURCE_LAZY)
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 0)
+        self.assertEqual(event.source.accName(), 'App')
+        self.assertIs(event.source, event.source)
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 1)
+
+    def testEager(self):
+        event = self.event(SOURCE_EAGER)
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 1)
+        self.assertEqual(event.source.accName(), 'App')
+
+    def testNever(self):
+        self.assertIsNone(self.event(SOURCE_NEVER).source)
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 0)
+
+    def testUnknownResolution(self):
+        self.assertRaises(ValueError, self.event, 'lazzy')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+'''
+Tests for L{pyia.guard}.
+'''
+
+import time
+import unittest
+
+import pyia
+from pyia.guard import AppNotResponding, CallTimeout, DeadlineExceeded, \
+    CLOSED, OPEN, HALF_OPEN, CircuitBreaker
+from pyia.simulated import SimulatedBackend
+
+class ChunkedBackend(SimulatedBackend):
+    '''
+    Fetches chunks of children without going through accessibleChildren,
+    as the Windows backend does.
+    '''
+    def iterChildren(self, acc, count, chunk_size):
+        self._roundTrip('AccessibleChildren', acc.hwnd)
+        for child in acc._children[:count]:
+            yield child
+
+class ApartmentBackend(SimulatedBackend):
+    '''
+    Stands in for Windows with the calling thread in a single-threaded
+    apartment, so calls cannot be timed on the workers.
+    '''
+    def sharesAccessibles(self):
+        return False
+
+class GuardTestCase(unittest.TestCase):
+    backend_class = SimulatedBackend
+
+    def setUp(self):
+        self.backend = pyia.setBackend(self.backend_class())
+        self.good = self.backend.createWindow(name='good', pid=100)
+        self.bad = self.backend.createWindow(name='bad', pid=200)
+        self.backend.buildTree(self.good, 3, 2)
+        self.backend.buildTree(self.bad, 3, 2)
+
+    def tearDown(self):
+        pyia.disableCallGuard()
+
+    def findAll(self):
+        return pyia.findAllDescendants(self.backend.desktop_client,
+                                       lambda acc: True)
+
+class CircuitBreakerTest(unittest.TestCase):
+    def testOpensAfterThreshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.failure(0)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.failure(0)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow(5))
+        self.assertTrue(breaker.allow(10))
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # Only one probe at a time.
+        self.assertFalse(breaker.allow(10))
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def testAbandonedProbe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure(0)
+        self.assertTrue(breaker.allow(10))
+        breaker.abandon(12)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.trips, 1)
+        self.assertFalse(breaker.allow(20))
+        self.assertTrue(breaker.allow(22))
+
+class CallGuardTest(GuardTestCase):
+    def testTimeoutOpensBreaker(self):
+        guard = pyia.enableCallGuard(call_timeout=0.02, failure_threshold=2,
+                                     reset_timeout=60)
+        # Learn the process before it stops answering.
+        self.bad.accName()
+        self.backend.process_latency[200] = 0.2
+        for i in range(2):
+            self.assertRaises(CallTimeout, self.bad.accName)
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        self.assertRaises(AppNotResponding, self.bad.accName)
+        self.assertFalse(guard.isResponding(self.bad))
+        self.assertEqual(self.good.accName(), 'good')
+
+    def testSearchSkipsHungProcess(self):
+        expected = len(self.findAll())
+        self.backend.process_latency[200] = 0.2
+        pyia.enableCallGuard(call_timeout=0.02, failure_threshold=2,
+                             reset_timeout=60)
+        t0 = time.monotonic()
+        found = self.findAll()
+        self.assertLess(time.monotonic() - t0, 1.0)
+        self.assertLess(len(found), expected)
+        self.assertIn(self.good, found)
+
+    def testProbeCloses(self):
+        guard = pyia.enableCallGuard(call_timeout=0.02, failure_threshold=1,
+                                     reset_timeout=0.05)
+        self.bad.accName()
+        self.backend.process_latency[200] = 0.2
+        self.assertRaises(CallTimeout, self.bad.accName)
+        self.backend.process_latency[200] = 0
+        time.sleep(0.06)
+        self.assertEqual(self.bad.accName(), 'bad')
+        self.assertEqual(guard.breaker(200).state, CLOSED)
+
+    def testProbeCutShortByDeadline(self):
+        guard = pyia.enableCallGuard(slow_call=0.01, failure_threshold=1,
+                                     reset_timeout=0.05)
+        self.bad.accName()
+        self.backend.method_latency['accName'] = 0.02
+        self.bad.accName()
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        time.sleep(0.06)
+        with guard.deadline(0.01) as deadline:
+            self.assertRaises(DeadlineExceeded, self.bad.accName)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        # The probe slot is free again once the reset timeout passes.
+        del self.backend.method_latency['accName']
+        time.sleep(0.06)
+        self.assertEqual(self.bad.accName(), 'bad')
+        self.assertEqual(guard.breaker(200).state, CLOSED)
+
+    def testProbeRaisingOtherError(self):
+        guard = pyia.enableCallGuard(failure_threshold=1, reset_timeout=0.05)
+        self.bad.accName()
+        guard.breaker(200).failure()
+        time.sleep(0.06)
+        self.assertRaises(TypeError, self.bad.accName, 0, 'extra')
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        time.sleep(0.06)
+        self.assertEqual(self.bad.accName(), 'bad')
+        self.assertEqual(guard.breaker(200).state, CLOSED)
+
+    def testDeadline(self):
+        self.backend.latency = 0.002
+        guard = pyia.enableCallGuard()
+        with guard.deadline(0.05) as deadline:
+            t0 = time.monotonic()
+            self.findAll()
+            self.assertLess(time.monotonic() - t0, 0.5)
+        self.assertTrue(deadline.expired)
+
+    def testDisable(self):
+        pyia.enableCallGuard(call_timeout=1)
+        self.assertIn('accessibleChildren', self.backend.__dict__)
+        pyia.disableCallGuard()
+        self.assertNotIn('accessibleChildren', self.backend.__dict__)
+        self.assertNotIn('iterChildren', self.backend.__dict__)
+        self.assertIsNone(pyia.getCallGuard())
+
+class ChunkedChildrenTest(GuardTestCase):
+    backend_class = ChunkedBackend
+
+    def testIterationGuarded(self):
+        guard = pyia.enableCallGuard(call_timeout=0.02, failure_threshold=1,
+                                     reset_timeout=60)
+        self.bad.accName()
+        self.backend.method_latency['AccessibleChildren'] = 0.2
+        self.assertRaises(CallTimeout, list, self.bad)
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        self.assertRaises(AppNotResponding, list, self.bad)
+
+class ApartmentTest(GuardTestCase):
+    backend_class = ApartmentBackend
+
+    def testSlowCallsOpenBreaker(self):
+        guard = pyia.enableCallGuard(call_timeout=0.02, failure_threshold=1,
+                                     reset_timeout=60)
+        self.bad.accName()
+        self.backend.process_latency[200] = 0.05
+        # The call is not timed, but taking longer than the timeout counts
+        # against the process all the same.
+        self.assertEqual(self.bad.accName(), 'bad')
+        self.assertEqual(guard.timeouts, 0)
+        self.assertEqual(guard.breaker(200).state, OPEN)
+        self.assertRaises(AppNotResponding, self.bad.accName)
+        self.assertEqual(self.good.accName(), 'good')
+
+if __name__ == '__main__':
+    unittest.main()
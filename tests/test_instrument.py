@@ -0,0 +1,61 @@
+'''
+Tests for L{pyia.instrument}.
+'''
+
+import logging
+import unittest
+
+import pyia
+
+class InstrumentTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+        logging.getLogger('pyia.instrument').disabled = True
+
+    def tearDown(self):
+        pyia.disableInstrumentation()
+        pyia.disableCallGuard()
+        logging.getLogger('pyia.instrument').disabled = False
+
+    def slowCaller(self):
+        return self.app.accName()
+
+    def testCounts(self):
+        stats = pyia.enableInstrumentation()
+        for i in range(3):
+            self.app.accName()
+        self.app.accRole()
+        self.assertRaises(self.backend.COMError, self.app.accName, 99)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['accName']['calls'], 4)
+        self.assertEqual(snapshot['accName']['errors'], 1)
+        self.assertEqual(snapshot['accRole']['calls'], 1)
+        self.assertLessEqual(snapshot['accName']['p50'],
+                             snapshot['accName']['max'])
+        self.assertIn('pyia_calls_total{method="accName"} 4',
+                      stats.prometheus())
+        self.assertIs(pyia.disableInstrumentation(), stats)
+        self.app.accName()
+        self.assertEqual(stats.snapshot()['accName']['calls'], 4)
+
+    def checkSlowCallStack(self):
+        self.backend.method_latency['accName'] = 0.002
+        stats = pyia.enableInstrumentation(slow_threshold=0.001,
+                                           stack_depth=2)
+        self.slowCaller()
+        stack = stats.slow_calls[-1].stack
+        self.assertEqual(len(stack), 2)
+        # The innermost frame is the caller, not one of pyia's hooks.
+        self.assertIn('in slowCaller', stack[-1])
+        self.assertIn('in checkSlowCallStack', stack[-2])
+
+    def testSlowCallStack(self):
+        self.checkSlowCallStack()
+
+    def testSlowCallStackGuarded(self):
+        pyia.enableCallGuard(call_timeout=5)
+        self.checkSlowCallStack()
+
+if __name__ == '__main__':
+    unittest.main()
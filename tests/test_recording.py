@@ -0,0 +1,79 @@
+'''
+Tests for L{pyia.recording}.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.recording import countEvents, readEvents, replayEvents
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.app = self.backend.createWindow(name='App', pid=5)
+        self.backend.buildTree(self.app, 5, 2)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.bin')
+
+    def tearDown(self):
+        self.registry.stopRecording()
+        self.registry.clearListeners()
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        event_types = [constants.EVENT_OBJECT_FOCUS,
+                       constants.EVENT_OBJECT_NAMECHANGE]
+        got = []
+        listener = lambda event: got.append(
+            (event.type, event.hwnd, event.object_id, event.child_id))
+        self.registry.registerEventListener(listener, *event_types)
+        self.registry.startRecording(self.path)
+        events = list(self.backend.eventStorm(200, event_types, seed=1))
+        for event in events:
+            self.backend.fireEvent(*event)
+        self.registry.stopRecording()
+        self.assertEqual(countEvents(self.path), 200)
+        records = list(readEvents(self.path))
+        self.assertEqual([record[:4] for record in records], events)
+        recorded, got[:] = list(got), []
+        count, seconds = replayEvents(self.path, speed=None)
+        self.assertEqual(count, 200)
+        self.assertEqual(got, recorded)
+
+    def testScopedListeners(self):
+        other = self.backend.createWindow(name='Other', pid=20, tid=21)
+        got = []
+        self.registry.registerEventListener(
+            lambda event: got.append(('all', event.hwnd)),
+            constants.EVENT_OBJECT_FOCUS)
+        self.registry.registerEventListener(
+            lambda event: got.append(('process', event.hwnd)),
+            constants.EVENT_OBJECT_FOCUS, process_id=5)
+        self.registry.startRecording(self.path)
+        self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS, self.app.hwnd)
+        self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS, other.hwnd)
+        self.registry.stopRecording()
+        # Both hooks see the first event, but it is recorded once.
+        self.assertEqual(countEvents(self.path), 2)
+        self.assertEqual([record[6] for record in readEvents(self.path)],
+                         [5, 20])
+        recorded, got[:] = sorted(got), []
+        replayEvents(self.path, speed=None)
+        self.assertEqual(sorted(got), recorded)
+        self.assertEqual(recorded, sorted([
+            ('all', self.app.hwnd), ('process', self.app.hwnd),
+            ('all', other.hwnd)]))
+
+    def testNotARecording(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a recording')
+        self.assertRaises(ValueError, list, readEvents(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
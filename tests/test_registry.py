@@ -0,0 +1,176 @@
+'''
+Tests for L{pyia.registry}.
+'''
+
+import asyncio
+import io
+import sys
+import threading
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.simulated import SimulatedBackend
+
+class ThreadBackend(SimulatedBackend):
+    def __init__(self):
+        SimulatedBackend.__init__(self)
+        self.threads = []
+
+    def initThread(self):
+        self.threads.append(('init', threading.current_thread().name))
+
+    def uninitThread(self):
+        self.threads.append(('uninit', threading.current_thread().name))
+
+class RegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.app = self.backend.createWindow(name='App', pid=5)
+
+    def tearDown(self):
+        self.registry.clearListeners()
+
+class HookTest(RegistryTestCase):
+    def ranges(self):
+        return sorted(key[1:] for key in self.registry.hooks)
+
+    def testSharedRanges(self):
+        got = []
+        listeners = [lambda event, i=i: got.append(i) for i in range(30)]
+        event_types = (constants.EVENT_OBJECT_NAMECHANGE,
+                       constants.EVENT_OBJECT_STATECHANGE,
+                       constants.EVENT_OBJECT_LOCATIONCHANGE)
+        for listener in listeners:
+            self.registry.registerEventListener(listener, *event_types)
+        # Thirty listeners of three adjacent event types share one hook.
+        self.assertEqual(self.ranges(),
+                         [(constants.EVENT_OBJECT_STATECHANGE,
+                           constants.EVENT_OBJECT_NAMECHANGE)])
+        self.assertEqual(len(self.backend._hooks), 1)
+        self.backend.fireEvent(constants.EVENT_OBJECT_NAMECHANGE,
+                               self.app.hwnd)
+        self.assertEqual(sorted(got), list(range(30)))
+        # Events in the range nobody asked for are not dispatched.
+        self.backend.fireEvent(constants.EVENT_OBJECT_SELECTION,
+                               self.app.hwnd)
+        self.assertEqual(len(got), 30)
+        for listener in listeners:
+            self.registry.deregisterEventListener(listener, *event_types)
+        self.assertEqual(self.registry.hooks, {})
+        self.assertEqual(self.backend._hooks, {})
+
+    def testPropertyCacheHooks(self):
+        self.registry.registerEventListener(lambda event: None,
+                                            constants.EVENT_OBJECT_FOCUS)
+        before = self.ranges()
+        self.registry.enablePropertyCache()
+        self.assertNotEqual(self.ranges(), before)
+        self.registry.disablePropertyCache()
+        self.assertEqual(self.ranges(), before)
+
+    def testFilters(self):
+        other = self.backend.createWindow(name='Other', pid=20, tid=21)
+        got = []
+        self.registry.registerEventListener(
+            lambda event: got.append(('process', event.hwnd)),
+            constants.EVENT_OBJECT_FOCUS, process_id=5)
+        self.registry.registerEventListener(
+            lambda event: got.append(('window', event.hwnd)),
+            constants.EVENT_OBJECT_FOCUS, hwnd=other.hwnd)
+        self.registry.registerEventListener(
+            lambda event: got.append(('all', event.hwnd)),
+            constants.EVENT_OBJECT_FOCUS)
+        # The process filter gets a hook of its own; the window filter is
+        # applied at dispatch.
+        scopes = sorted(key[0] for key in self.registry.hooks)
+        self.assertEqual(scopes, [(0, 0, 0), (5, 0, 0)])
+        self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS, self.app.hwnd)
+        self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS, other.hwnd)
+        self.assertEqual(sorted(got), sorted([
+            ('process', self.app.hwnd), ('all', self.app.hwnd),
+            ('window', other.hwnd), ('all', other.hwnd)]))
+
+    def testListenerErrorsDoNotStopDispatch(self):
+        got = []
+        def broken(event):
+            raise RuntimeError('listener failed')
+        self.registry.registerEventListener(broken,
+                                            constants.EVENT_OBJECT_FOCUS)
+        self.registry.registerEventListener(got.append,
+                                            constants.EVENT_OBJECT_FOCUS)
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            self.backend.fireEvent(constants.EVENT_OBJECT_FOCUS,
+                                   self.app.hwnd)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(len(got), 1)
+        self.assertEqual(got[0].source.accName(), 'App')
+
+class RunTest(RegistryTestCase):
+    def testHooksMoveToPumpThread(self):
+        got = []
+        self.registry.registerEventListener(
+            lambda event: got.append(threading.current_thread().name),
+            constants.EVENT_OBJECT_FOCUS)
+
+        async def main():
+            task = asyncio.ensure_future(self.registry.run())
+            await asyncio.sleep(0.1)
+            self.backend.postEvent(constants.EVENT_OBJECT_FOCUS,
+                                   self.app.hwnd)
+            await asyncio.sleep(0.2)
+            self.registry.stop()
+            await task
+
+        asyncio.run(main())
+        self.assertEqual(got, ['pyia-pump'])
+        # Every hook was removed by the thread that installed it, and those
+        # installed for run() are back on this thread.
+        self.assertEqual(sorted(self.backend._hooks),
+                         sorted(self.registry.hooks.values()))
+        self.registry.clearListeners()
+        self.assertEqual(self.backend._hooks, {})
+
+    def testRunFromOtherThread(self):
+        self.registry.registerEventListener(lambda event: None,
+                                            constants.EVENT_OBJECT_FOCUS)
+        errors = []
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.2, self.registry.stop)
+            await self.registry.run()
+
+        def run():
+            try:
+                asyncio.run(main())
+            except RuntimeError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(self.backend._hooks), 1)
+
+    def testPumpThreadInitialized(self):
+        self.registry.clearListeners()
+        self.backend = pyia.setBackend(ThreadBackend())
+        self.app = self.backend.createWindow(name='App', pid=5)
+        self.registry.registerEventListener(lambda event: None,
+                                            constants.EVENT_OBJECT_FOCUS)
+
+        async def main():
+            asyncio.get_running_loop().call_later(0.1, self.registry.stop)
+            await self.registry.run()
+
+        asyncio.run(main())
+        self.assertEqual(self.backend.threads,
+                         [('init', 'pyia-pump'), ('uninit', 'pyia-pump')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+Tests for L{pyia.selector}.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+
+class SelectorTest(unittest.TestCase):
+    def setUp(self):
+        backend = self.backend = pyia.setBackend('simulated')
+        self.app = backend.createWindow(name='app',
+                                        role=constants.ROLE_SYSTEM_WINDOW)
+        self.dialog = backend.createAccessible(
+            self.app, name='Save', role=constants.ROLE_SYSTEM_DIALOG)
+        self.ok = backend.createAccessible(
+            self.dialog, name='OK', role=constants.ROLE_SYSTEM_PUSHBUTTON,
+            state=constants.STATE_SYSTEM_FOCUSABLE)
+        self.cancel = backend.createAccessible(
+            self.dialog, name='Cancel', role=constants.ROLE_SYSTEM_PUSHBUTTON,
+            state=constants.STATE_SYSTEM_FOCUSABLE)
+        self.pane = backend.createAccessible(
+            self.dialog, name='p', role=constants.ROLE_SYSTEM_PANE)
+        self.nested = backend.createAccessible(
+            self.pane, name='OK', role=constants.ROLE_SYSTEM_PUSHBUTTON,
+            state=constants.STATE_SYSTEM_FOCUSABLE)
+        self.outside = backend.createAccessible(
+            self.app, name='OK', role=constants.ROLE_SYSTEM_PUSHBUTTON)
+        backend.buildTree(self.app, 3, 2)
+        self.root = backend.desktop_client
+
+    def find(self, selector, *args, **kwargs):
+        return pyia.findAllDescendants(self.root, selector, *args, **kwargs)
+
+    def testChild(self):
+        self.assertEqual(
+            self.find('dialog > "push button"[name="OK"]:focusable'),
+            [self.ok])
+
+    def testDescendant(self):
+        self.assertEqual(self.find('dialog push-button[name=OK]'),
+                         [self.ok, self.nested])
+
+    def testAttributesAndStates(self):
+        self.assertEqual(self.find('"push button"[name^=O]:not(focusable)'),
+                         [self.outside])
+        self.assertEqual(self.find('*[name~="^Canc"]'), [self.cancel])
+
+    def testBreadthFirst(self):
+        self.assertEqual(self.find('dialog > *', True),
+                         [self.ok, self.cancel, self.pane])
+
+    def testRooted(self):
+        self.assertEqual(self.find('> window > dialog'), [self.dialog])
+
+    def testCompiled(self):
+        text = 'dialog > "push button"[name="OK"]:focusable'
+        selector = pyia.compileSelector(text)
+        self.assertIs(pyia.compileSelector(text), selector)
+        self.assertTrue(selector(self.ok))
+        self.assertFalse(selector(self.nested))
+
+    def testParallel(self):
+        self.assertEqual(
+            set(self.find('dialog "push button"', workers=3)),
+            set([self.ok, self.nested, self.cancel]))
+
+    def testFewerRoundTrips(self):
+        # Roles are checked before names, so most nodes cost one call.
+        self.backend.resetCalls()
+        self.find(lambda acc: acc.accRoleName() == 'push button' and
+                  acc.accName() == 'OK')
+        by_function = sum(self.backend.calls.values())
+        self.backend.resetCalls()
+        self.find('"push button"[name=OK]')
+        self.assertLessEqual(sum(self.backend.calls.values()), by_function)
+
+    def testSyntaxErrors(self):
+        for text in ('', 'dialog >', '[foo=1]', ':nostate', 'dialog[name=',
+                     'a $ b'):
+            self.assertRaises(ValueError, pyia.compileSelector, text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests for L{pyia.snapfile}.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyia
+from pyia import constants
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class SnapfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+        self.backend.buildTree(self.app, 3, 3, simple_leaves=True)
+        self.snapshot = pyia.snapshotSubtree(self.app)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'tree.snap')
+        pyia.writeSnapshot(self.snapshot, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+class SnapfileTest(SnapfileTestCase):
+    def testRoundTrip(self):
+        with pyia.openSnapshot(self.path) as mapped:
+            self.assertEqual(len(mapped), len(self.snapshot))
+            self.assertEqual(mapped.properties, self.snapshot.properties)
+            for index in range(len(self.snapshot)):
+                self.assertEqual(mapped.childID(index),
+                                 self.snapshot.childID(index))
+                for prop in self.snapshot.properties:
+                    self.assertEqual(mapped.get(index, prop),
+                                     self.snapshot.get(index, prop))
+            self.assertEqual(mapped.subtreeHash(0),
+                             self.snapshot.subtreeHash(0))
+            self.assertEqual(pyia.diffSnapshots(self.snapshot, mapped), [])
+            self.assertEqual(mapped.root.accName(), 'App')
+
+    def testNotASnapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, pyia.openSnapshot, self.path)
+
+    def testArrayOutlivesClose(self):
+        with pyia.openSnapshot(self.path) as mapped:
+            roles = mapped.array('role')
+            held = memoryview(roles)
+        self.assertEqual(roles[0], self.snapshot.get(0, 'role'))
+        self.assertEqual(held[1], constants.ROLE_SYSTEM_LISTITEM)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def testNumpyArrayOutlivesClose(self):
+        with pyia.openSnapshot(self.path) as mapped:
+            roles = mapped.array('role')
+            locations = mapped.array('location')
+        self.assertEqual(roles.shape, (len(self.snapshot),))
+        self.assertEqual(locations.shape, (len(self.snapshot), 4))
+        self.assertEqual(int(roles[0]), self.snapshot.get(0, 'role'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+'''
+Tests for L{pyia.snapshot}.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+        self.backend.buildTree(self.app, 3, 3, simple_leaves=True)
+        self.backend.resetCalls()
+
+    def testOnePass(self):
+        snapshot = pyia.snapshotSubtree(self.app, max_depth=2)
+        self.assertEqual(len(snapshot), 13)
+        # Each property is read once per node, children fetched once per
+        # parent.
+        self.assertEqual(self.backend.calls['accName'], 13)
+        self.assertEqual(self.backend.calls['AccessibleChildren'], 4)
+        self.backend.resetCalls()
+        root = snapshot.root
+        self.assertEqual(root.accName(), 'App')
+        self.assertEqual([child.accName() for child in root],
+                         ['item 0', 'item 1', 'item 2'])
+        self.assertEqual(root[0][2].accName(), 'item 0.2')
+        self.assertEqual(root[0][2].accParent.accName(), 'item 0')
+        self.assertEqual(sum(self.backend.calls.values()), 0)
+
+    def testSimpleChildren(self):
+        snapshot = pyia.snapshotSubtree(self.app,
+                                        properties=['name', 'state'])
+        self.assertEqual(len(snapshot), 40)
+        leaf = pyia.findDescendant(snapshot.root,
+                                   lambda node: node.accName() == 'item 0.0.1')
+        self.assertEqual(leaf.childID, 2)
+        self.assertEqual(leaf.accParent.accName(), 'item 0.0')
+        self.assertRaises(KeyError, leaf.accRole)
+
+    def testStringRoles(self):
+        self.app[1].setProperties(role='mozstring')
+        snapshot = pyia.snapshotSubtree(self.app)
+        self.assertEqual(snapshot.root[1].accRole(), 'mozstring')
+        self.assertEqual(snapshot.root[0].accRole(),
+                         constants.ROLE_SYSTEM_LISTITEM)
+
+    def testSearch(self):
+        snapshot = pyia.snapshotSubtree(self.app)
+        node = pyia.findDescendant(
+            snapshot.root, lambda node: node.accName() == 'item 2.2', True)
+        self.assertEqual(node.accName(), 'item 2.2')
+        self.assertEqual(snapshot.subtreeHash(0),
+                         pyia.snapshotSubtree(self.app).subtreeHash(0))
+
+if __name__ == '__main__':
+    unittest.main()
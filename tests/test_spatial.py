@@ -0,0 +1,98 @@
+'''
+Tests for L{pyia.spatial}.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.spatial import SpatialIndex
+
+class SpatialTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.registry = pyia.Registry
+        self.registry.clearListeners()
+        self.app = self.backend.createWindow(name='App', pid=5,
+                                             location=(0, 0, 400, 300))
+        self.buttons = [
+            self.backend.createAccessible(
+                self.app, name='b%d' % i, location=(i * 100, 0, 100, 50))
+            for i in range(4)]
+        self.index = SpatialIndex(cell_size=64)
+        self.index.build(self.app)
+
+    def tearDown(self):
+        self.index.detach()
+        self.registry.clearListeners()
+
+    def fire(self, event_type, acc):
+        self.backend.fireEvent(event_type, acc.hwnd, acc.object_id)
+
+    def testBuild(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertTrue(self.buttons[0] in self.index)
+        self.assertEqual(self.index.hitTest(150, 10), self.buttons[1])
+        self.assertEqual(self.index.hitTest(150, 100), self.app)
+        self.assertEqual(self.index.hitTest(500, 10), None)
+        self.assertEqual(
+            sorted(acc.accName() for acc in
+                   self.index.query(50, 0, 200, 10)),
+            ['App', 'b0', 'b1', 'b2'])
+        self.assertEqual(
+            sorted(acc.accName() for acc in
+                   self.index.query(90, 0, 220, 60, contained=True)),
+            ['b1', 'b2'])
+
+    def testRelocate(self):
+        self.index.attach()
+        self.buttons[1].setProperties(location=(100, 200, 100, 50))
+        self.fire(constants.EVENT_OBJECT_LOCATIONCHANGE, self.buttons[1])
+        self.assertEqual(self.index.relocations, 1)
+        self.assertEqual(self.index.hitTest(150, 210), self.buttons[1])
+        self.assertEqual(self.index.hitTest(150, 10), self.app)
+
+    def testDestroy(self):
+        self.index.attach()
+        button = self.buttons[2]
+        # Name the object while it can still be resolved.
+        self.fire(constants.EVENT_OBJECT_LOCATIONCHANGE, button)
+        button.remove()
+        self.fire(constants.EVENT_OBJECT_DESTROY, button)
+        self.assertEqual(self.index.removals, 1)
+        self.assertFalse(button in self.index)
+        self.assertEqual(self.index.hitTest(250, 10), self.app)
+
+    def testUnrelatedWindow(self):
+        other = self.backend.createWindow(name='Other', pid=20,
+                                          location=(0, 0, 400, 300))
+        self.index.attach()
+        self.backend.resetCalls()
+        for i in range(1000):
+            self.fire(constants.EVENT_OBJECT_LOCATIONCHANGE, other)
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 0)
+        self.assertEqual(self.index.hitTest(10, 10), self.buttons[0])
+
+    def testChildWindow(self):
+        pane = self.backend.createWindow(self.app, name='Pane',
+                                         location=(0, 100, 400, 50))
+        self.index.build(self.app)
+        self.index.attach()
+        pane.setProperties(location=(0, 200, 400, 50))
+        self.fire(constants.EVENT_OBJECT_LOCATIONCHANGE, pane)
+        self.assertEqual(self.index.hitTest(10, 225), pane)
+        self.assertEqual(self.index.hitTest(10, 125), self.app)
+
+    def testUnknownObjects(self):
+        self.index.build(self.app, max_depth=0)
+        self.index.attach()
+        self.backend.resetCalls()
+        for i in range(100):
+            self.fire(constants.EVENT_OBJECT_LOCATIONCHANGE, self.buttons[0])
+        # The first event finds the object is not indexed; later ones are
+        # dropped without asking again.
+        self.assertEqual(self.backend.calls['AccessibleObjectFromEvent'], 1)
+        self.assertEqual(self.index.relocations, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+'''
+Tests for L{pyia.stateset}.
+'''
+
+import unittest
+
+from pyia import constants
+from pyia.stateset import StateSet
+
+class StateSetTest(unittest.TestCase):
+    def testNames(self):
+        states = StateSet(constants.STATE_SYSTEM_FOCUSED |
+                          constants.STATE_SYSTEM_FOCUSABLE)
+        self.assertEqual(list(states), ['focused', 'focusable'])
+        self.assertEqual(len(states), 2)
+        self.assertIn('focused', states)
+        self.assertIn(constants.STATE_SYSTEM_FOCUSABLE, states)
+        self.assertNotIn('selected', states)
+        self.assertNotIn('no such state', states)
+
+    def testNegativeState(self):
+        # Bit 31 set comes back as a negative VT_I4.
+        value = constants.STATE_SYSTEM_FOCUSED - (1 << 31)
+        states = StateSet(value)
+        self.assertEqual(len(states), 2)
+        self.assertEqual(states.bits,
+                         (constants.STATE_SYSTEM_FOCUSED, 1 << 31))
+        self.assertIn('focused', states)
+        self.assertIn(value, states)
+        self.assertEqual(states, value)
+        self.assertEqual(len(states - 'focused'), 1)
+
+    def testOperators(self):
+        focused = StateSet.fromNames(['focused'])
+        both = focused | 'selected'
+        self.assertEqual(both.names, ('selected', 'focused'))
+        self.assertEqual(both & 'focused', focused)
+        self.assertEqual(both - focused, StateSet.fromNames(['selected']))
+        self.assertTrue(focused <= both)
+        self.assertTrue(both >= focused)
+        self.assertRaises(KeyError, StateSet.fromNames, ['no such state'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+'''
+Tests for L{pyia.treediff}.
+'''
+
+import unittest
+
+import pyia
+from pyia import constants
+from pyia.treediff import diffSnapshots, INSERT, REMOVE, MOVE, CHANGE
+
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = pyia.setBackend('simulated')
+        self.app = self.backend.createWindow(name='App')
+        self.backend.buildTree(self.app, 4, 3)
+        self.before = pyia.snapshotSubtree(self.app)
+
+    def find(self, name):
+        return pyia.findDescendant(self.app,
+                                   lambda acc: acc.accName() == name)
+
+    def diff(self):
+        after = pyia.snapshotSubtree(self.app)
+        changes = diffSnapshots(self.before, after)
+        name = lambda snapshot, i: i >= 0 and snapshot.get(i, 'name') or None
+        return [(c.kind, name(self.before, c.old), name(after, c.new),
+                 c.prop) for c in changes]
+
+    def testUnchanged(self):
+        self.assertEqual(self.diff(), [])
+
+    def testPropertyChange(self):
+        self.find('item 1.2').setProperties(
+            state=constants.STATE_SYSTEM_FOCUSED)
+        self.assertEqual(self.diff(),
+                         [(CHANGE, 'item 1.2', 'item 1.2', 'state')])
+
+    def testInsertAndRemove(self):
+        self.find('item 2.2.2').remove()
+        self.backend.createAccessible(self.find('item 0'), name='new')
+        self.assertEqual(sorted(self.diff()),
+                         [(INSERT, None, 'new', None),
+                          (REMOVE, 'item 2.2.2', None, None)])
+
+    def testMove(self):
+        parent = self.find('item 3')
+        parent._children.insert(0, parent._children.pop())
+        self.assertEqual(self.diff(), [(MOVE, 'item 3.3', 'item 3.3', None)])
+
+    def testRemoveAndRename(self):
+        self.find('item 1').remove()
+        self.find('item 2').setProperties(name='renamed')
+        self.assertEqual(sorted(self.diff()),
+                         [(CHANGE, 'item 2', 'renamed', 'name'),
+                          (REMOVE, 'item 1', None, None)])
+
+if __name__ == '__main__':
+    unittest.main()